@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import psycopg2
+import pytz
+from market_history import BAR_VIEWS, load_chain_bars
+from signal_rules import RSI_OVERSOLD, RSI_OVERBOUGHT, MEDIAN_ATR_WINDOW, compute_indicators, detect_signals
+from db import db_params
+
+BACKTEST_CACHE_DIR = os.getenv("BACKTEST_CACHE_DIR", "backtest_cache")
+
+# Bar columns kept in the cache, one .npy file each (time as int64 epoch microseconds)
+CACHE_COLUMNS = ("time", "open", "high", "low", "close")
+
+# Parameters that change the indicator series vs. those that only change the rules applied to them
+INDICATOR_PARAMS = {"rsi_period": 14, "macd_fast": 12, "macd_slow": 26, "macd_signal": 9, "atr_period": 14}
+RULE_PARAMS = {"rsi_oversold": RSI_OVERSOLD, "rsi_overbought": RSI_OVERBOUGHT, "median_window": MEDIAN_ATR_WINDOW}
+
+
+def build_cache(conn, cache_dir, start_time, end_time=None, resolution="1m", lot_size=None, days=None):
+    """Load a chain's bars once from TimescaleDB and write them with write_cache."""
+    history = load_chain_bars(conn, start_time, resolution, end_time)
+    return write_cache(history, cache_dir, start_time, end_time, resolution, lot_size, days, "timescaledb")
+
+
+def write_cache(history, cache_dir, start_time, end_time=None, resolution="1m", lot_size=None, days=None,
+                source=None):
+    """Store per-instrument bars as flat per-column .npy files plus an offsets index.
+
+    ``days`` and ``source`` are recorded in meta.json so a later run can tell
+    whether the cache was built with the same arguments (see cache_matches).
+    """
+    keys = sorted(history)
+    os.makedirs(cache_dir, exist_ok=True)
+    for column in CACHE_COLUMNS:
+        parts = [history[key][column] for key in keys]
+        if column == "time":
+            parts = [part.view("int64") for part in parts]
+        array = np.concatenate(parts) if parts else np.empty(0, dtype="int64" if column == "time" else "float64")
+        np.save(os.path.join(cache_dir, f"{column}.npy"), array)
+    lengths = [len(history[key]["close"]) for key in keys]
+    meta = {
+        "resolution": resolution,
+        "start": start_time.isoformat(),
+        "end": end_time.isoformat() if end_time else None,
+        "days": days,
+        "source": source,
+        "keys": keys,
+        "offsets": np.concatenate(([0], np.cumsum(lengths))).astype(int).tolist(),
+        "lot_sizes": [lot_size(key) if lot_size else 25 for key in keys]
+    }
+    with open(os.path.join(cache_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def cache_matches(cache_dir, resolution, days, source):
+    """True if ``cache_dir`` holds a cache built with this resolution, history length and source."""
+    path = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        meta = json.load(f)
+    return (meta.get("resolution"), meta.get("days"), meta.get("source")) == (resolution, days, source)
+
+
+class BarCache:
+    """Read-only, memory-mapped view of a cache written by build_cache.
+
+    Opening is cheap and pages are shared through the OS page cache, so each
+    pool worker maps the same files instead of receiving pickled arrays.
+    """
+
+    def __init__(self, cache_dir):
+        with open(os.path.join(cache_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.keys = self.meta["keys"]
+        self.offsets = self.meta["offsets"]
+        self.lot_sizes = self.meta["lot_sizes"]
+        self.columns = {
+            column: np.load(os.path.join(cache_dir, f"{column}.npy"), mmap_mode="r")
+            for column in CACHE_COLUMNS
+        }
+
+    def __len__(self):
+        return len(self.keys)
+
+    def series(self, index):
+        """Column slices for the index-th instrument (time as datetime64[us] UTC)."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        series = {column: array[start:end] for column, array in self.columns.items()}
+        series["time"] = series["time"].view("datetime64[us]")
+        return series
+
+    @property
+    def bars(self):
+        return self.offsets[-1]
+
+
+def parameter_grid(spec):
+    """Expand {param: [values]} into a list of full parameter dicts (defaults for missing params)."""
+    names = list(spec)
+    grid = []
+    for values in itertools.product(*(spec[name] for name in names)):
+        params = dict(INDICATOR_PARAMS, **RULE_PARAMS)
+        params.update(zip(names, values))
+        if params["macd_fast"] < params["macd_slow"]:
+            grid.append(params)
+    return grid
+
+
+def simulate_fills(buy_idx, sell_idx, opens, closes, quantity, slippage_bps=0.0):
+    """Fill each signal as a market order at the next bar's open, adverse slippage in basis points.
+
+    Mirrors trade_execution: every BUY/SELL signal sends one MARKET order for
+    ``quantity`` units regardless of the open position. Signals on the last
+    bar have no next bar and are not filled. Returns realised plus
+    marked-to-market PnL, fill counts and slippage cost versus the signal ltp.
+    """
+    fill_idx = np.concatenate((buy_idx, sell_idx)) + 1
+    sides = np.concatenate((np.ones(len(buy_idx)), -np.ones(len(sell_idx))))
+    filled = fill_idx < len(closes)
+    fill_idx, sides = fill_idx[filled], sides[filled]
+    if not len(fill_idx):
+        return {"pnl": 0.0, "fills": 0, "buys": 0, "sells": 0, "slippage": 0.0}
+    reference = opens[fill_idx]
+    reference = np.where(np.isnan(reference), closes[fill_idx], reference)
+    prices = reference * (1.0 + sides * slippage_bps / 10000.0)
+    position = sides.sum() * quantity
+    cash = -(sides * prices).sum() * quantity
+    return {
+        "pnl": float(cash + position * closes[-1]),
+        "fills": int(len(fill_idx)),
+        "buys": int((sides > 0).sum()),
+        "sells": int((sides < 0).sum()),
+        "slippage": float((sides * (prices - closes[fill_idx - 1])).sum() * quantity)
+    }
+
+
+def run_indicator_group(cache_dir, indicator_params, rule_grid, slippage_bps):
+    """Compute indicators once per instrument for one indicator setting, then apply every rule setting."""
+    cache = BarCache(cache_dir)
+    totals = [{"pnl": 0.0, "fills": 0, "buys": 0, "sells": 0, "slippage": 0.0, "instruments_traded": 0}
+              for _ in rule_grid]
+    for i in range(len(cache)):
+        series = cache.series(i)
+        closes = np.ascontiguousarray(series["close"])
+        highs = np.ascontiguousarray(series["high"])
+        lows = np.ascontiguousarray(series["low"])
+        rsi, macd, signal, atr = compute_indicators(closes, highs, lows, **indicator_params)
+        if rsi is None:
+            continue
+        for rules, total in zip(rule_grid, totals):
+            buy_idx, sell_idx = detect_signals(rsi, macd, signal, atr, rolling=True, **rules)
+            result = simulate_fills(buy_idx, sell_idx, series["open"], closes, cache.lot_sizes[i], slippage_bps)
+            for name, value in result.items():
+                total[name] += value
+            total["instruments_traded"] += result["fills"] > 0
+    return [dict(indicator_params, **rules, **total) for rules, total in zip(rule_grid, totals)]
+
+
+def run_backtest(cache_dir, grid, workers=None, slippage_bps=0.0):
+    """Evaluate a parameter grid over the cache, one pool task per distinct indicator setting."""
+    groups = {}
+    for params in grid:
+        indicator = tuple(params[name] for name in INDICATOR_PARAMS)
+        groups.setdefault(indicator, []).append({name: params[name] for name in RULE_PARAMS})
+    tasks = [(dict(zip(INDICATOR_PARAMS, indicator)), rules) for indicator, rules in groups.items()]
+
+    results = []
+    if workers == 1:
+        for indicator_params, rules in tasks:
+            results.extend(run_indicator_group(cache_dir, indicator_params, rules, slippage_bps))
+        return results
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_indicator_group, cache_dir, indicator_params, rules, slippage_bps)
+                   for indicator_params, rules in tasks]
+        for future in futures:
+            results.extend(future.result())
+    return results
+
+
+def _values(text):
+    return [float(v) if "." in v else int(v) for v in text.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep signal parameters over cached market_data bars")
+    parser.add_argument("--cache-dir", default=BACKTEST_CACHE_DIR)
+    parser.add_argument("--rebuild-cache", action="store_true", help="Reload history from TimescaleDB")
+    parser.add_argument("--days", type=int, default=60, help="History to load when building the cache")
+    parser.add_argument("--resolution", default="1m", help="Bar resolution when building the cache")
+    parser.add_argument("--archive", help="Build the cache from a tick_archive root instead of TimescaleDB")
+    parser.add_argument("--workers", type=int, default=None, help="Pool size (1 runs in-process)")
+    parser.add_argument("--slippage-bps", type=float, default=5.0)
+    parser.add_argument("--top", type=int, default=10, help="Results to print, best PnL first")
+    parser.add_argument("--output", help="Write all results as JSON lines")
+    for name, default in dict(INDICATOR_PARAMS, **RULE_PARAMS).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=_values, default=[default],
+                            help=f"Comma-separated values (default {default})")
+    args = parser.parse_args(argv)
+
+    source = f"archive:{os.path.abspath(args.archive)}" if args.archive else "timescaledb"
+    rebuild = args.rebuild_cache or not cache_matches(args.cache_dir, args.resolution, args.days, source)
+    if rebuild and not args.rebuild_cache and os.path.exists(os.path.join(args.cache_dir, "meta.json")):
+        print(f"Cache in {args.cache_dir} was built with a different --days, --resolution or source; rebuilding")
+    if rebuild:
+        from instrument_master import get_instrument_master
+        master = get_instrument_master()
+        start_time = datetime.now(pytz.timezone("Asia/Kolkata")) - timedelta(days=args.days)
+        started = time.perf_counter()
+        if args.archive:
+            from tick_archive import TickArchive
+            history = TickArchive(args.archive).load_bars(
+                start_time.date(), start_time.date() + timedelta(days=args.days), BAR_VIEWS[args.resolution][1]
+            )
+            meta = write_cache(history, args.cache_dir, start_time, resolution=args.resolution, lot_size=master.lot_size,
+                               days=args.days, source=source)
+        else:
+            conn = psycopg2.connect(**db_params)
+            meta = build_cache(conn, args.cache_dir, start_time, resolution=args.resolution, lot_size=master.lot_size,
+                               days=args.days)
+            conn.close()
+        print(f"Cached {meta['offsets'][-1]} bars for {len(meta['keys'])} instruments "
+              f"in {time.perf_counter() - started:.1f} s")
+
+    cache = BarCache(args.cache_dir)
+    grid = parameter_grid({name: getattr(args, name) for name in dict(INDICATOR_PARAMS, **RULE_PARAMS)})
+    started = time.perf_counter()
+    results = run_backtest(args.cache_dir, grid, args.workers, args.slippage_bps)
+    elapsed = time.perf_counter() - started
+    print(f"{len(grid)} parameter sets x {len(cache)} instruments ({cache.bars} bars) in {elapsed:.2f} s, "
+          f"{len(grid) * cache.bars / elapsed:.0f} bar-evaluations/s")
+
+    results.sort(key=lambda r: r["pnl"], reverse=True)
+    for result in results[:args.top]:
+        params = ", ".join(f"{name}={result[name]}" for name in dict(INDICATOR_PARAMS, **RULE_PARAMS))
+        print(f"PnL {result['pnl']:>12.2f}  fills {result['fills']:>6} ({result['buys']} buy / {result['sells']} sell)  "
+              f"slippage {result['slippage']:>10.2f}  [{params}]")
+    if args.output:
+        with open(args.output, "w") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+import sys
+import time
+import argparse
+from datetime import datetime
+import pytz
+from tick_decoder import ColumnarTickDecoder, decode_protobuf, build_market_rows
+from tick_replay import read_recording, synthesize_chain_frames
+
+def read_frames(path):
+    """Load raw FeedResponse frames from a tick_replay recording."""
+    return [frame for _, frame in read_recording(path)]
+
+
+def synthesize_frames(count, strikes, depth=5):
+    """Build FeedResponse frames for the index plus a CE/PE chain around 23000."""
+    return [frame for _, frame in synthesize_chain_frames(count, strikes, depth)]
+
+
+def run_dict_path(frames, current_time):
+    rows = 0
+    for frame in frames:
+        rows += len(build_market_rows(decode_protobuf(frame), current_time))
+    return rows
+
+
+def run_columnar_path(frames, current_time, decoder):
+    rows = 0
+    for frame in frames:
+        rows += len(decoder.decode(frame).to_rows(current_time))
+    return rows
+
+
+def run_columnar_decode_only(frames, decoder):
+    rows = 0
+    for frame in frames:
+        rows += decoder.decode(frame).size
+    return rows
+
+
+# market_data columns that hold text; everything else is compared numerically
+_TEXT_COLUMNS = (0, 1, 7, 9)
+
+
+def _normalize(row):
+    # MessageToDict renders int64 fields as strings, so compare numbers as floats
+    return tuple(
+        value if i in _TEXT_COLUMNS or value is None else float(value)
+        for i, value in enumerate(row)
+    )
+
+
+def check_parity(frames, current_time, decoder):
+    """Verify both decode paths produce the same market_data rows."""
+    for frame in frames:
+        expected = sorted(map(_normalize, build_market_rows(decode_protobuf(frame), current_time)), key=lambda r: r[1])
+        actual = sorted(map(_normalize, decoder.decode(frame).to_rows(current_time)), key=lambda r: r[1])
+        if expected != actual:
+            return False
+    return True
+
+
+def timed(label, fn, frames, repeat):
+    best = float("inf")
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = fn()
+        best = min(best, time.perf_counter() - start)
+    per_frame_us = best / len(frames) * 1e6
+    print(f"{label:<24} {len(frames) / best:>10.0f} frames/s {rows / best:>12.0f} ticks/s {per_frame_us:>9.1f} us/frame")
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmark MessageToDict vs columnar tick decoding")
+    parser.add_argument("--frames", help="Feed recording written by tick_replay.FrameRecorder")
+    parser.add_argument("--count", type=int, default=500, help="Synthetic frames when no recording is given")
+    parser.add_argument("--strikes", type=int, default=50, help="Synthetic strikes per frame (CE and PE each)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    frames = read_frames(args.frames) if args.frames else synthesize_frames(args.count, args.strikes)
+    if not frames:
+        print("No frames to benchmark")
+        return 1
+    current_time = datetime.now(pytz.timezone("Asia/Kolkata"))
+    decoder = ColumnarTickDecoder()
+
+    print(f"{len(frames)} frames, parity: {'ok' if check_parity(frames, current_time, decoder) else 'MISMATCH'}")
+    dict_time = timed("MessageToDict + rows", lambda: run_dict_path(frames, current_time), frames, args.repeat)
+    columnar_time = timed("columnar + rows", lambda: run_columnar_path(frames, current_time, decoder), frames, args.repeat)
+    timed("columnar decode only", lambda: run_columnar_decode_only(frames, decoder), frames, args.repeat)
+    print(f"Speedup (rows): {dict_time / columnar_time:.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
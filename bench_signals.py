@@ -0,0 +1,81 @@
+import sys
+import time
+import argparse
+import numpy as np
+from signal_rules import compute_indicators, detect_signals
+
+
+def synthetic_chain(instruments, bars, seed=11):
+    """Random-walk close/high/low series for a chain of option instruments."""
+    rng = np.random.default_rng(seed)
+    chain = []
+    for _ in range(instruments):
+        closes = np.maximum(100.0 + np.cumsum(rng.normal(0, 0.8, bars)), 0.05)
+        spread = np.abs(rng.normal(0, 0.4, bars))
+        chain.append((closes, closes + spread, np.maximum(closes - spread, 0.05)))
+    return chain
+
+
+def loop_detect(rsi, macd, signal, atr):
+    """Reference per-bar loop equivalent to the previous generate_signals body."""
+    median_atr = np.median(atr[-14:]) if len(atr) >= 14 else 0
+    buy, sell = [], []
+    for i in range(1, len(rsi)):
+        if atr[i] <= median_atr:
+            continue
+        if rsi[i] < 30 and macd[i] > signal[i] and macd[i-1] <= signal[i-1]:
+            buy.append(i)
+        elif rsi[i] > 70 and macd[i] < signal[i] and macd[i-1] >= signal[i-1]:
+            sell.append(i)
+    return np.array(buy, dtype=np.int64), np.array(sell, dtype=np.int64)
+
+
+def run(chain, detect):
+    signals = 0
+    for closes, highs, lows in chain:
+        rsi, macd, signal, atr = compute_indicators(closes, highs, lows)
+        buy, sell = detect(rsi, macd, signal, atr)
+        signals += len(buy) + len(sell)
+    return signals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark signal detection across an option chain")
+    parser.add_argument("--instruments", type=int, default=200, help="Instruments in the synthetic chain")
+    parser.add_argument("--bars", type=int, default=20000, help="Bars per instrument")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    chain = synthetic_chain(args.instruments, args.bars)
+    total_bars = args.instruments * args.bars
+
+    # Both paths must flag exactly the same bars
+    for closes, highs, lows in chain:
+        indicators = compute_indicators(closes, highs, lows)
+        for expected, actual in zip(loop_detect(*indicators), detect_signals(*indicators)):
+            if not np.array_equal(expected, actual):
+                print("MISMATCH between loop and vectorized detection")
+                return 1
+
+    indicator_only = min(
+        _timed(lambda: [compute_indicators(*series) for series in chain]) for _ in range(args.repeat)
+    )
+    for label, detect in (("per-bar loop", loop_detect), ("vectorized", detect_signals)):
+        best = min(_timed(lambda: run(chain, detect)) for _ in range(args.repeat))
+        detect_only = max(best - indicator_only, 1e-9)
+        print(
+            f"{label:<14} {total_bars / best:>12.0f} bars/s end-to-end "
+            f"{total_bars / detect_only:>14.0f} bars/s detection only ({best:.3f} s)"
+        )
+    print(f"{args.instruments} instruments x {args.bars} bars, indicators alone {indicator_only:.3f} s")
+    return 0
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,328 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import platform
+import argparse
+import subprocess
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+import numpy as np
+
+# Each run appends one JSON line here; runs are compared with the last pinned one (see --pin)
+BENCH_RESULTS_PATH = os.getenv("BENCH_RESULTS_PATH", "bench_results.jsonl")
+
+# A throughput drop or p99 rise beyond this fraction of the baseline is a regression
+BENCH_REGRESSION_THRESHOLD = float(os.getenv("BENCH_REGRESSION_THRESHOLD", "0.10"))
+
+# Synthetic instrument keys written by the database case, deleted again afterwards
+BENCH_KEY_PREFIX = "BENCH|"
+
+
+def time_items(fn, items, repeat):
+    """Best-of-``repeat`` wall time for ``fn`` over every item, with per-item latencies from that run."""
+    best, best_latencies = float("inf"), None
+    for _ in range(repeat):
+        latencies = np.empty(len(items), dtype=np.int64)
+        started = time.perf_counter()
+        for i, item in enumerate(items):
+            item_started = time.perf_counter_ns()
+            fn(item)
+            latencies[i] = time.perf_counter_ns() - item_started
+        elapsed = time.perf_counter() - started
+        if elapsed < best:
+            best, best_latencies = elapsed, latencies
+    return best, best_latencies
+
+
+def result(units, unit, seconds, latencies):
+    """One case's figures: throughput in ``unit``/s and per-item latency percentiles in us."""
+    p50, p99 = np.percentile(latencies, (50, 99)) / 1000.0
+    return {"unit": unit, "units": int(units), "seconds": seconds,
+            "throughput": units / seconds, "p50_us": float(p50), "p99_us": float(p99)}
+
+
+def _now():
+    import pytz
+    return datetime.now(pytz.timezone("Asia/Kolkata"))
+
+
+def bench_decode(args):
+    """Feed frames through the columnar decoder into market_data rows (ticks/s, latency per frame)."""
+    from bench_decode import synthesize_frames
+    from tick_decoder import ColumnarTickDecoder
+    frames = synthesize_frames(args.frames, args.strikes)
+    decoder = ColumnarTickDecoder()
+    current_time = _now()
+    ticks = sum(decoder.decode(frame).size for frame in frames)
+    seconds, latencies = time_items(lambda frame: decoder.decode(frame).to_rows(current_time), frames, args.repeat)
+    return result(ticks, "ticks", seconds, latencies)
+
+
+def bench_decode_dict(args):
+    """The MessageToDict path kept as decode_protobuf, for comparison with the columnar decoder."""
+    from bench_decode import synthesize_frames
+    from tick_decoder import decode_protobuf, build_market_rows
+    frames = synthesize_frames(args.frames, args.strikes)
+    current_time = _now()
+    ticks = sum(len(build_market_rows(decode_protobuf(frame), current_time)) for frame in frames)
+    seconds, latencies = time_items(
+        lambda frame: build_market_rows(decode_protobuf(frame), current_time), frames, args.repeat
+    )
+    return result(ticks, "ticks", seconds, latencies)
+
+
+def _tick_batches(args):
+    """One list of market_data rows per synthetic frame, keyed under BENCH_KEY_PREFIX."""
+    from bench_decode import synthesize_frames
+    from tick_decoder import ColumnarTickDecoder
+    decoder = ColumnarTickDecoder()
+    started = _now()
+    batches = []
+    for n, frame in enumerate(synthesize_frames(args.frames, args.strikes)):
+        # One frame every 100 ms, like the live feed, so batches do not overwrite each other
+        rows = decoder.decode(frame).to_rows(started + timedelta(milliseconds=100 * n))
+        batches.append([(row[0], BENCH_KEY_PREFIX + row[1]) + tuple(row[2:]) for row in rows])
+    return batches
+
+
+def bench_ingest(args):
+    """Serialize tick batches into the TickWriter COPY stream (the database-free part of a flush)."""
+    from market_data_writer import rows_to_copy_buffer
+    batches = _tick_batches(args)
+    seconds, latencies = time_items(rows_to_copy_buffer, batches, args.repeat)
+    return result(sum(map(len, batches)), "rows", seconds, latencies)
+
+
+def bench_ingest_db(args):
+    """Write tick batches through TickWriter.write_rows into the configured database (rows/s, latency per batch).
+
+    Meant for a local Postgres/TimescaleDB container; the synthetic rows and
+    registry entries are deleted again afterwards.
+    """
+    from db import db_params, ConnectionPool
+    from market_data_writer import TickWriter
+    batches = _tick_batches(args)
+    writer = TickWriter(db_params, report_interval=0)
+    try:
+        seconds, latencies = time_items(writer.write_rows, batches, args.repeat)
+    finally:
+        writer.close()
+        pool = ConnectionPool(db_params, maxconn=1, name="bench")
+        with pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("DELETE FROM market_data WHERE instrument_key LIKE %s;", (BENCH_KEY_PREFIX + "%",))
+            cursor.execute("DELETE FROM instrument_registry WHERE instrument_key LIKE %s;", (BENCH_KEY_PREFIX + "%",))
+        pool.close()
+    return result(sum(map(len, batches)), "rows", seconds, latencies)
+
+
+def bench_indicators(args):
+    """compute_indicators over a synthetic chain (bars/s, latency per instrument)."""
+    from bench_signals import synthetic_chain
+    from signal_rules import compute_indicators
+    chain = synthetic_chain(args.instruments, args.bars)
+    seconds, latencies = time_items(lambda series: compute_indicators(*series), chain, args.repeat)
+    return result(args.instruments * args.bars, "bars", seconds, latencies)
+
+
+def bench_signals(args):
+    """detect_signals over precomputed indicators (bars/s, latency per instrument)."""
+    from bench_signals import synthetic_chain
+    from signal_rules import compute_indicators, detect_signals
+    indicators = [compute_indicators(*series) for series in synthetic_chain(args.instruments, args.bars)]
+    seconds, latencies = time_items(lambda series: detect_signals(*series), indicators, args.repeat)
+    return result(args.instruments * args.bars, "bars", seconds, latencies)
+
+
+class MockBrokerError(Exception):
+    """A transient HTTP failure from the mock broker."""
+
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+class MockOrderApi:
+    """Stand-in for the SDK OrderApi: answers after ``latency`` seconds, failing ``error_rate`` of the calls."""
+
+    def __init__(self, latency=0.002, error_rate=0.0, seed=11):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.placed = 0
+
+    def place_order(self, order_data, api_version="2.0"):
+        time.sleep(self.latency)
+        if self.rng.random() < self.error_rate:
+            raise MockBrokerError(503)
+        self.placed += 1
+        return SimpleNamespace(data=SimpleNamespace(order_id=f"MOCK{self.placed}", status="complete"))
+
+    def get_order_book(self, api_version="2.0"):
+        time.sleep(self.latency)
+        return SimpleNamespace(data=[])
+
+
+def bench_orders(args):
+    """Place orders through OrderRouter against MockOrderApi (orders/s, latency per order).
+
+    Rate limits are opened up so the figure measures dispatch overhead and
+    concurrency, not the broker's throttle.
+    """
+    from order_router import OrderRouter, order_payload
+
+    async def place_all(router, count):
+        latencies = np.empty(count, dtype=np.int64)
+
+        async def place(i):
+            started = time.perf_counter_ns()
+            await router.place(order_payload(f"NSE_FO|{40000 + i % 400}", "BUY" if i % 2 else "SELL", 75), f"BENCH{i}")
+            latencies[i] = time.perf_counter_ns() - started
+
+        started = time.perf_counter()
+        await asyncio.gather(*(place(i) for i in range(count)))
+        return time.perf_counter() - started, latencies
+
+    best, best_latencies = float("inf"), None
+    for _ in range(args.repeat):
+        api = MockOrderApi(args.broker_latency, args.broker_error_rate)
+        router = OrderRouter(api, limits=((args.orders * 10, 1.0),), concurrency=args.concurrency, backoff=0.0)
+        try:
+            seconds, latencies = asyncio.run(place_all(router, args.orders))
+        finally:
+            router.close()
+        if seconds < best:
+            best, best_latencies = seconds, latencies
+    return result(args.orders, "orders", best, best_latencies)
+
+
+# Cases run by default; ingest_db also needs --db and a database it may write to
+CASES = {
+    "decode": bench_decode,
+    "decode_dict": bench_decode_dict,
+    "ingest": bench_ingest,
+    "ingest_db": bench_ingest_db,
+    "indicators": bench_indicators,
+    "signals": bench_signals,
+    "orders": bench_orders,
+}
+
+
+# Fixture sizes a run is recorded with; runs are only compared when these match
+BENCH_PARAMS = ("repeat", "frames", "strikes", "instruments", "bars", "orders", "concurrency",
+                "broker_latency", "broker_error_rate")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_baseline(path, label=None):
+    """The last pinned run (with ``label`` if given) from the results file, or None."""
+    if not os.path.exists(path):
+        return None
+    baseline = None
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            run = json.loads(line)
+            if run.get("pinned") and (label is None or run.get("label") == label):
+                baseline = run
+    return baseline
+
+
+def find_regressions(results, baseline, threshold=BENCH_REGRESSION_THRESHOLD):
+    """(case, metric, before, after) for each figure that got worse than ``threshold`` allows."""
+    regressions = []
+    for case, current in results.items():
+        before = baseline["results"].get(case)
+        if before is None:
+            continue
+        if current["throughput"] < before["throughput"] * (1 - threshold):
+            regressions.append((case, "throughput", before["throughput"], current["throughput"]))
+        if current["p99_us"] > before["p99_us"] * (1 + threshold):
+            regressions.append((case, "p99_us", before["p99_us"], current["p99_us"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the decode, ingest, indicator, signal and order paths")
+    parser.add_argument("cases", nargs="*", help=f"Cases to run from {', '.join(CASES)} (default: all but ingest_db)")
+    parser.add_argument("--db", action="store_true", help="Also run ingest_db against the configured database")
+    parser.add_argument("--results", default=BENCH_RESULTS_PATH, help="JSON lines file runs are appended to")
+    parser.add_argument("--label", help="Name this run; --baseline picks the last pinned run with a given name")
+    parser.add_argument("--baseline", help="Compare against the last pinned run with this label")
+    parser.add_argument("--pin", action="store_true",
+                        help="Make this run the baseline later runs are compared with (even if it regressed)")
+    parser.add_argument("--threshold", type=float, default=BENCH_REGRESSION_THRESHOLD)
+    parser.add_argument("--no-save", action="store_true", help="Compare only; do not append this run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--frames", type=int, default=200, help="Synthetic feed frames")
+    parser.add_argument("--strikes", type=int, default=50, help="Synthetic strikes per frame (CE and PE each)")
+    parser.add_argument("--instruments", type=int, default=200, help="Instruments in the synthetic chain")
+    parser.add_argument("--bars", type=int, default=5000, help="Bars per instrument")
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16, help="OrderRouter worker threads")
+    parser.add_argument("--broker-latency", type=float, default=0.002, help="Mock broker response time in seconds")
+    parser.add_argument("--broker-error-rate", type=float, default=0.0, help="Share of mock orders failing with 503")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.cases if name not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+
+    names = args.cases or [name for name in CASES if name != "ingest_db"]
+    if args.db and "ingest_db" not in names:
+        names.append("ingest_db")
+
+    results = {}
+    for name in names:
+        figures = CASES[name](args)
+        results[name] = figures
+        print(f"{name:<12} {figures['throughput']:>14.0f} {figures['unit']}/s  "
+              f"p50 {figures['p50_us']:>10.1f} us  p99 {figures['p99_us']:>10.1f} us")
+
+    params = {name: getattr(args, name) for name in BENCH_PARAMS}
+    baseline = load_baseline(args.results, args.baseline)
+    regressions = []
+    pin = args.pin
+    if baseline is None:
+        print(f"No pinned baseline in {args.results}" + ("" if args.no_save else "; pinning this run"))
+        pin = True
+    elif baseline.get("params") != params:
+        print("Baseline was recorded with different fixture sizes; not comparing (pass --pin to re-baseline)")
+    else:
+        regressions = find_regressions(results, baseline, args.threshold)
+        print(f"Compared with {baseline.get('label') or baseline.get('revision') or 'the previous run'} "
+              f"from {baseline['at']}")
+        for case, metric, before, after in regressions:
+            print(f"REGRESSION {case} {metric}: {before:.1f} -> {after:.1f} ({(after / before - 1) * 100:+.0f}%)")
+        if not regressions:
+            print(f"No regressions beyond {args.threshold:.0%}")
+        if not pin:
+            print("Baseline unchanged; pass --pin to make this run the baseline")
+
+    if not args.no_save:
+        run = {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "label": args.label,
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "machine": platform.node(),
+            "params": params,
+            "pinned": pin,
+            "results": results,
+        }
+        with open(args.results, "a") as f:
+            f.write(json.dumps(run) + "\n")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
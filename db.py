@@ -0,0 +1,313 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import psycopg2
+import psycopg2.extensions
+from metrics import REGISTRY
+
+# Optional JSON file with a "database" section; PROMPT_TRADER_DB_* variables override it
+CONFIG_PATH = os.getenv("PROMPT_TRADER_CONFIG", "prompt_trader.json")
+
+DEFAULT_DB_PARAMS = {
+    "dbname": "prompt_trader",
+    "user": "trader",
+    "password": "secure_password",
+    "host": "localhost",
+    "port": "5432"
+}
+
+# Pool sizing; callers wait up to DB_POOL_TIMEOUT seconds for a free connection
+DB_POOL_MAX = int(os.getenv("PROMPT_TRADER_DB_POOL_MAX", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("PROMPT_TRADER_DB_POOL_TIMEOUT", "10"))
+
+# Connections idle for longer than this are checked with a round-trip before reuse
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("PROMPT_TRADER_DB_HEALTH_CHECK_INTERVAL", "30"))
+
+
+def load_db_params(config_path=CONFIG_PATH):
+    """Connection parameters: defaults, then the config file's "database" section, then the environment."""
+    params = dict(DEFAULT_DB_PARAMS)
+    if config_path and os.path.exists(config_path):
+        with open(config_path) as f:
+            params.update(json.load(f).get("database", {}))
+    for name in params:
+        value = os.getenv(f"PROMPT_TRADER_DB_{'NAME' if name == 'dbname' else name.upper()}")
+        if value:
+            params[name] = value
+    return params
+
+
+# Database connection parameters shared by every module
+db_params = load_db_params()
+
+
+class PoolTimeout(RuntimeError):
+    """No connection became free within the pool timeout."""
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers its prepared statements and last use."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
+
+
+# Server-side prepared statements by name; SQL uses $1, $2 ... placeholders
+PREPARED_STATEMENTS = {}
+
+
+def prepare(name, sql):
+    """Register a statement; each connection PREPAREs it the first time it is executed there."""
+    PREPARED_STATEMENTS[name] = sql
+    return name
+
+
+def execute_prepared(cursor, name, params=()):
+    conn = cursor.connection
+    if name not in conn.prepared:
+        cursor.execute(f"PREPARE {name} AS {PREPARED_STATEMENTS[name]}")
+        conn.prepared.add(name)
+    if params:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+
+class ConnectionPool:
+    """Thread-safe pool of up to ``maxconn`` connections, with an asyncio front end.
+
+    Connections open lazily, so a database that is down does not stop a
+    process from starting. A connection idle for longer than
+    ``health_check_interval`` gets a ``SELECT 1`` before it is handed out,
+    and is replaced if that fails. A connection that raised a connection
+    error is discarded rather than returned. ``run_async`` runs blocking
+    database work on a pooled connection in the pool's own threads, so an
+    event loop never waits on the network. After a fork the child drops the
+    parent's connections and opens its own.
+    """
+
+    def __init__(self, params=None, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                 health_check_interval=DB_HEALTH_CHECK_INTERVAL, name="default"):
+        self.params = params or db_params
+        self.name = name
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+        self._executor = None
+        self.opened = REGISTRY.counter("db_connections_opened_total", "Database connections opened", pool=name)
+        self.health_failures = REGISTRY.counter("db_health_check_failures_total", "Pooled connections found dead",
+                                                pool=name)
+        REGISTRY.gauge("db_pool_connections", "Open pooled connections", fn=lambda: self._size, pool=name)
+        REGISTRY.gauge("db_pool_in_use", "Pooled connections checked out",
+                       fn=lambda: self._size - len(self._idle), pool=name)
+
+    def _connect(self):
+        conn = psycopg2.connect(connection_factory=PooledConnection, **self.params)
+        self.opened.inc()
+        return conn
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - conn.last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            self.health_failures.inc()
+            return False
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            if os.getpid() != self._pid:
+                # Forked: the parent's sockets are not ours to use or close
+                self._idle, self._size, self._pid, self._executor = [], 0, os.getpid(), None
+            while not self._idle and self._size >= self.maxconn:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No database connection free within {self.timeout:.0f} s")
+                self._cond.wait(remaining)
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._size += 1
+        if conn is not None and self._healthy(conn):
+            return conn
+        if conn is not None:
+            conn.close()
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, broken=False):
+        if not broken and not conn.closed and conn.status != psycopg2.extensions.STATUS_READY:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        with self._cond:
+            if broken or conn.closed:
+                self._size -= 1
+                conn.close()
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """A pooled connection for one transaction: committed on success, rolled back on error."""
+        conn = self.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException as e:
+            broken = conn.closed or isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            if not broken:
+                try:
+                    conn.rollback()
+                    if conn.prepared:
+                        # A PREPARE in the failed transaction may or may not have survived it
+                        with conn.cursor() as cursor:
+                            cursor.execute("DEALLOCATE ALL")
+                        conn.commit()
+                        conn.prepared.clear()
+                except psycopg2.Error:
+                    broken = True
+            self.putconn(conn, broken)
+            raise
+        self.putconn(conn)
+
+    def fetch_all(self, name, params=()):
+        """Rows of a prepared statement (see ``prepare``)."""
+        started = time.perf_counter()
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                execute_prepared(cursor, name, params)
+                rows = cursor.fetchall()
+        REGISTRY.histogram("db_query_seconds", "Database query latency", query=name).observe(
+            time.perf_counter() - started)
+        return rows
+
+    def execute(self, name, params=()):
+        """Run a prepared statement in its own transaction; returns the row count."""
+        started = time.perf_counter()
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                execute_prepared(cursor, name, params)
+                count = cursor.rowcount
+        REGISTRY.histogram("db_query_seconds", "Database query latency", query=name).observe(
+            time.perf_counter() - started)
+        return count
+
+    def _run(self, fn, args):
+        with self.connection() as conn:
+            return fn(conn, *args)
+
+    async def run_async(self, fn, *args):
+        """Await ``fn(conn, *args)`` run in one transaction on a pooled connection in a pool thread."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.maxconn, thread_name_prefix="db-pool")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._run, fn, args)
+
+    def report(self):
+        """Print connections opened and per-query latency from the metrics registry."""
+        lines = [f"Database ({self.name} pool): {self.opened.value} connections opened, {self._size} open"]
+        for metric in REGISTRY.metrics():
+            if metric.name == "db_query_seconds" and metric.total:
+                lines.append(f"  {metric.labels['query']}: {metric.summary()}")
+        print("\n".join(lines))
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn in idle:
+            conn.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+# Process-wide pool, created on first use
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ConnectionPool()
+        return _default_pool
+
+
+BENCH_QUERY = prepare("bench_registry_page", """
+    SELECT instrument_id, instrument_key FROM instrument_registry
+    WHERE segment = $1 AND instrument_id > $2 ORDER BY instrument_id LIMIT 50
+""")
+
+
+def benchmark(queries=500):
+    """Compare a fresh connection per query (the old pattern) with the pool and a prepared statement."""
+    direct = []
+    for _ in range(queries):
+        started = time.perf_counter()
+        conn = psycopg2.connect(**db_params)
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT instrument_id, instrument_key FROM instrument_registry "
+                "WHERE segment = %s AND instrument_id > %s ORDER BY instrument_id LIMIT 50;", ("NSE_FO", 0)
+            )
+            cursor.fetchall()
+        conn.close()
+        direct.append(time.perf_counter() - started)
+
+    pool = ConnectionPool(maxconn=1, name="bench")
+    pooled = []
+    for _ in range(queries):
+        started = time.perf_counter()
+        pool.fetch_all(BENCH_QUERY, ("NSE_FO", 0))
+        pooled.append(time.perf_counter() - started)
+    pool.close()
+
+    for label, samples, connections in (("connect per query", direct, queries),
+                                        ("pooled + prepared", pooled, 1)):
+        samples.sort()
+        print(f"{label:>18}: {connections} connections, p50 {samples[len(samples) // 2] * 1000:.2f} ms, "
+              f"p99 {samples[int(len(samples) * 0.99)] * 1000:.2f} ms, total {sum(samples):.2f} s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Database configuration and connection pool")
+    parser.add_argument("command", choices=("config", "bench"))
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args(argv)
+    if args.command == "config":
+        print(json.dumps(dict(db_params, password="***"), indent=2))
+        return 0
+    benchmark(args.queries)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+import os
+import json
+import math
+from collections import deque
+
+# Indicator parameters (same as compute_indicators in trading_strategy.py)
+RSI_PERIOD = 14
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+ATR_PERIOD = 14
+MEDIAN_ATR_WINDOW = 14
+
+INDICATOR_CHECKPOINT_PATH = os.getenv("INDICATOR_CHECKPOINT_PATH", "indicator_state.json")
+
+NAN = float("nan")
+
+
+class IndicatorState:
+    """Per-instrument Wilder RSI, EMA MACD and Wilder ATR state updated in O(1) per bar.
+
+    Warm-up reproduces TA-Lib's seeding exactly: RSI and ATR start from simple
+    averages of the first ``period`` changes / true ranges, the slow EMA from
+    the SMA of the first 26 closes, the fast EMA from the SMA of the 12 closes
+    ending on the same bar, and the signal line from the SMA of the first 9
+    MACD values. Outputs are NaN until TA-Lib would produce a value.
+    """
+
+    def __init__(self):
+        self.bars = 0
+        self.last_time = None
+        self.prev_close = None
+        # RSI
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        # MACD
+        self.warmup_closes = []
+        self.fast_ema = None
+        self.slow_ema = None
+        self.warmup_macd = []
+        self.signal_ema = None
+        # ATR
+        self.atr = None
+        self.tr_sum = 0.0
+        # Latest outputs and the previous MACD/signal pair for crossovers
+        self.rsi = NAN
+        self.macd = NAN
+        self.signal = NAN
+        self.prev_macd = NAN
+        self.prev_signal = NAN
+        self.recent_atr = deque(maxlen=MEDIAN_ATR_WINDOW)
+
+    def update(self, close, high, low):
+        """Fold one bar into the state and return (rsi, macd, signal, atr)."""
+        index = self.bars
+        self.bars += 1
+        prev_close = self.prev_close
+        self.prev_close = close
+        self.prev_macd, self.prev_signal = self.macd, self.signal
+
+        if index > 0:
+            self._update_rsi(index, close - prev_close)
+            tr = max(high - low, abs(high - prev_close), abs(low - prev_close))
+            self._update_atr(index, tr)
+        self._update_macd(index, close)
+
+        atr = self.atr if self.atr is not None else NAN
+        if self.atr is not None:
+            self.recent_atr.append(atr)
+        return self.rsi, self.macd, self.signal, atr
+
+    def median_atr(self):
+        """Median of the last MEDIAN_ATR_WINDOW ATR values (0 until the window fills)."""
+        if len(self.recent_atr) < MEDIAN_ATR_WINDOW:
+            return 0.0
+        values = sorted(self.recent_atr)
+        middle = len(values) // 2
+        return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+    def _update_rsi(self, index, change):
+        gain = change if change > 0 else 0.0
+        loss = -change if change < 0 else 0.0
+        if index <= RSI_PERIOD:
+            self.avg_gain += gain
+            self.avg_loss += loss
+            if index < RSI_PERIOD:
+                return
+            self.avg_gain /= RSI_PERIOD
+            self.avg_loss /= RSI_PERIOD
+        else:
+            self.avg_gain = (self.avg_gain * (RSI_PERIOD - 1) + gain) / RSI_PERIOD
+            self.avg_loss = (self.avg_loss * (RSI_PERIOD - 1) + loss) / RSI_PERIOD
+        total = self.avg_gain + self.avg_loss
+        self.rsi = 100.0 * (self.avg_gain / total) if abs(total) >= 1e-8 else 0.0
+
+    def _update_atr(self, index, tr):
+        if index <= ATR_PERIOD:
+            self.tr_sum += tr
+            if index == ATR_PERIOD:
+                self.atr = self.tr_sum / ATR_PERIOD
+            return
+        self.atr = (self.atr * (ATR_PERIOD - 1) + tr) / ATR_PERIOD
+
+    def _update_macd(self, index, close):
+        if self.slow_ema is None:
+            self.warmup_closes.append(close)
+            if index < MACD_SLOW - 1:
+                return
+            self.slow_ema = sum(self.warmup_closes) / MACD_SLOW
+            self.fast_ema = sum(self.warmup_closes[-MACD_FAST:]) / MACD_FAST
+            self.warmup_closes = []
+        else:
+            self.fast_ema = (close - self.fast_ema) * (2.0 / (MACD_FAST + 1)) + self.fast_ema
+            self.slow_ema = (close - self.slow_ema) * (2.0 / (MACD_SLOW + 1)) + self.slow_ema
+
+        macd = self.fast_ema - self.slow_ema
+        if self.signal_ema is None:
+            self.warmup_macd.append(macd)
+            if len(self.warmup_macd) < MACD_SIGNAL:
+                return
+            self.signal_ema = sum(self.warmup_macd) / MACD_SIGNAL
+            self.warmup_macd = []
+        else:
+            self.signal_ema = (macd - self.signal_ema) * (2.0 / (MACD_SIGNAL + 1)) + self.signal_ema
+        self.macd = macd
+        self.signal = self.signal_ema
+
+    def to_dict(self):
+        data = dict(self.__dict__)
+        data["recent_atr"] = list(self.recent_atr)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        state.__dict__.update(data)
+        state.recent_atr = deque(data.get("recent_atr", []), maxlen=MEDIAN_ATR_WINDOW)
+        return state
+
+
+class IndicatorEngine:
+    """Streaming indicators for many instruments with a JSON checkpoint."""
+
+    def __init__(self, checkpoint_path=INDICATOR_CHECKPOINT_PATH):
+        self.checkpoint_path = checkpoint_path
+        self.states = {}
+
+    def __contains__(self, instrument_key):
+        return instrument_key in self.states
+
+    def state(self, instrument_key):
+        state = self.states.get(instrument_key)
+        if state is None:
+            state = self.states[instrument_key] = IndicatorState()
+        return state
+
+    def last_time(self, instrument_key):
+        """Timestamp of the last bar folded in for an instrument, or None."""
+        state = self.states.get(instrument_key)
+        return state.last_time if state is not None else None
+
+    def update(self, instrument_key, bar_time, close, high, low):
+        """Fold one new bar into an instrument's state and return (rsi, macd, signal, atr)."""
+        state = self.state(instrument_key)
+        state.last_time = bar_time
+        return state.update(close, high, low)
+
+    def warm_up(self, instrument_key, prices, highs, lows, last_time):
+        """Rebuild an instrument's state from a full history window ending at last_time."""
+        state = self.states[instrument_key] = IndicatorState()
+        for close, high, low in zip(prices.tolist(), highs.tolist(), lows.tolist()):
+            state.update(close, high, low)
+        state.last_time = last_time
+        return state
+
+    def save(self):
+        """Atomically write every instrument's state to the checkpoint file."""
+        data = {}
+        for key, state in self.states.items():
+            entry = state.to_dict()
+            if entry["last_time"] is not None:
+                entry["last_time"] = entry["last_time"].isoformat()
+            data[key] = entry
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def load(self):
+        """Restore states saved by save(); a missing checkpoint means a cold start."""
+        from datetime import datetime
+        if not os.path.exists(self.checkpoint_path):
+            return self
+        with open(self.checkpoint_path) as f:
+            data = json.load(f)
+        for key, entry in data.items():
+            if entry.get("last_time"):
+                entry["last_time"] = datetime.fromisoformat(entry["last_time"])
+            self.states[key] = IndicatorState.from_dict(entry)
+        return self
+
+
+def compare_with_talib(prices, highs, lows):
+    """Return the max absolute difference between streaming and TA-Lib indicators."""
+    import numpy as np
+    import talib
+    rsi = talib.RSI(prices, timeperiod=RSI_PERIOD)
+    macd, signal, _ = talib.MACD(prices, fastperiod=MACD_FAST, slowperiod=MACD_SLOW, signalperiod=MACD_SIGNAL)
+    atr = talib.ATR(highs, lows, prices, timeperiod=ATR_PERIOD)
+
+    state = IndicatorState()
+    streamed = np.array([state.update(c, h, l) for c, h, l in zip(prices, highs, lows)])
+    diffs = {}
+    for column, (name, expected) in enumerate((("rsi", rsi), ("macd", macd), ("signal", signal), ("atr", atr))):
+        actual = streamed[:, column]
+        if not np.array_equal(np.isnan(expected), np.isnan(actual)):
+            diffs[name] = math.inf
+        else:
+            mask = ~np.isnan(expected)
+            diffs[name] = float(np.max(np.abs(expected[mask] - actual[mask]))) if mask.any() else 0.0
+    return diffs
+
+
+if __name__ == "__main__":
+    import numpy as np
+    rng = np.random.default_rng(7)
+    closes = 100.0 + np.cumsum(rng.normal(0, 1, 5000))
+    spread = np.abs(rng.normal(0, 0.5, 5000))
+    print(compare_with_talib(closes, closes + spread, closes - spread))
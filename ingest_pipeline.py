@@ -0,0 +1,236 @@
+import os
+import time
+import struct
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from metrics import REGISTRY, SampledLogger
+
+# Supported behaviours when the raw frame queue is full
+BACKPRESSURE_POLICIES = ("block", "drop-oldest", "spill")
+
+# Spill record header: received_at (perf_counter seconds) and frame length
+_SPILL_HEADER = struct.Struct("<dI")
+
+
+class StageMetrics:
+    """Queue depth and throughput counters for one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.depth = 0
+        self.max_depth = 0
+        self.processed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.busy_seconds = 0.0
+
+    def observe_depth(self, depth):
+        self.depth = depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def snapshot(self):
+        """Return counters and reset the max-depth watermark."""
+        data = {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "avg_ms": self.busy_seconds / self.processed * 1000.0 if self.processed else 0.0
+        }
+        self.max_depth = self.depth
+        return data
+
+
+class SpillFile:
+    """Append-only overflow file for raw frames, replayed in FIFO order."""
+
+    def __init__(self, path):
+        self.path = path
+        self._writer = open(path, "wb")
+        self._reader = open(path, "rb")
+        self.pending = 0
+
+    def append(self, frame, received_at):
+        self._writer.write(_SPILL_HEADER.pack(received_at, len(frame)))
+        self._writer.write(frame)
+        self.pending += 1
+
+    def pop(self):
+        """Read the oldest spilled frame; truncate the file once fully drained."""
+        self._writer.flush()
+        received_at, length = _SPILL_HEADER.unpack(self._reader.read(_SPILL_HEADER.size))
+        frame = self._reader.read(length)
+        self.pending -= 1
+        if self.pending == 0:
+            self._writer.seek(0)
+            self._writer.truncate()
+            self._reader.seek(0)
+        return frame, received_at
+
+    def close(self):
+        self._writer.close()
+        self._reader.close()
+        os.remove(self.path)
+
+
+class IngestPipeline:
+    """Staged receive -> decode -> store pipeline for websocket feed frames.
+
+    The receiver only enqueues raw frames. Decoding runs in an executor with
+    up to ``decode_inflight`` frames in parallel while results are consumed
+    strictly in arrival order, and ``store`` runs in its own worker thread so
+    a slow database never blocks ``websocket.recv()``.
+    """
+
+    def __init__(self, decode, store, queue_size=2000, policy="block", decode_workers=2,
+                 decode_inflight=64, executor="thread", spill_path="ingest_spill.bin",
+                 report_interval=10.0, registry=REGISTRY):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy {policy!r}; expected one of {BACKPRESSURE_POLICIES}")
+        self.decode = decode
+        self.store = store
+        self.policy = policy
+        self.report_interval = report_interval
+        self.raw_queue = asyncio.Queue(maxsize=queue_size)
+        self.decoded_queue = asyncio.Queue(maxsize=decode_inflight)
+        self.metrics = {name: StageMetrics(name) for name in ("receive", "decode", "store")}
+        self.spill = SpillFile(spill_path) if policy == "spill" else None
+        executor_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        self._decode_executor = executor_class(max_workers=decode_workers)
+        self._store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-store")
+        self._tasks = []
+        self._spill_ready = asyncio.Event()
+
+        self.frames_received = registry.counter("ingest_frames_total", "Frames accepted from the websocket")
+        self.frames_dropped = registry.counter("ingest_frames_dropped_total", "Frames dropped by backpressure or errors")
+        self.frames_spilled = registry.counter("ingest_frames_spilled_total", "Frames spilled to disk")
+        self.decode_latency = registry.histogram("ingest_decode_seconds", "Decode submit to result")
+        self.store_latency = registry.histogram("ingest_store_seconds", "Store call duration")
+        self.end_to_end = registry.histogram("ingest_receive_to_store_seconds", "Frame receive to store complete")
+        registry.gauge("ingest_raw_queue_depth", "Frames waiting to decode", fn=self.raw_queue.qsize)
+        registry.gauge("ingest_decoded_queue_depth", "Decoded frames waiting to store", fn=self.decoded_queue.qsize)
+        registry.gauge("ingest_spill_pending", "Frames in the spill file",
+                       fn=lambda: self.spill.pending if self.spill is not None else 0)
+        self.sample_log = SampledLogger("ingest")
+
+    async def put_frame(self, frame):
+        """Hand a raw frame from the receiver to the pipeline, applying backpressure."""
+        received_at = time.perf_counter()
+        receive = self.metrics["receive"]
+        receive.processed += 1
+        self.frames_received.inc()
+
+        if self.policy == "block":
+            await self.raw_queue.put((frame, received_at))
+        elif self.policy == "drop-oldest":
+            if self.raw_queue.full():
+                self.raw_queue.get_nowait()
+                self.raw_queue.task_done()
+                receive.dropped += 1
+                self.frames_dropped.inc()
+            self.raw_queue.put_nowait((frame, received_at))
+        else:
+            # Keep FIFO order: once anything is spilled, new frames queue behind it
+            if self.spill.pending or self.raw_queue.full():
+                self.spill.append(frame, received_at)
+                receive.spilled += 1
+                self.frames_spilled.inc()
+                self._spill_ready.set()
+            else:
+                self.raw_queue.put_nowait((frame, received_at))
+        receive.observe_depth(self.raw_queue.qsize())
+
+    def start(self):
+        """Start the decode, store, spill-replay and reporting tasks."""
+        self._tasks = [
+            asyncio.create_task(self._decode_stage()),
+            asyncio.create_task(self._store_stage())
+        ]
+        if self.spill is not None:
+            self._tasks.append(asyncio.create_task(self._replay_spill()))
+        if self.report_interval:
+            self._tasks.append(asyncio.create_task(self._report_loop()))
+
+    async def drain(self):
+        """Wait until every accepted frame has been decoded and stored."""
+        while self.spill is not None and self.spill.pending:
+            await asyncio.sleep(0.01)
+        await self.raw_queue.join()
+        await self.decoded_queue.join()
+
+    async def close(self):
+        """Drain outstanding frames, then stop tasks and executors."""
+        await self.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._decode_executor.shutdown()
+        self._store_executor.shutdown()
+        if self.spill is not None:
+            self.spill.close()
+        self.report()
+
+    def report(self):
+        """Print per-stage queue depths and counters."""
+        parts = []
+        for name, metrics in self.metrics.items():
+            data = metrics.snapshot()
+            parts.append(
+                f"{name}: depth {data['depth']} (max {data['max_depth']}), "
+                f"{data['processed']} done, {data['dropped']} dropped, "
+                f"{data['spilled']} spilled, {data['avg_ms']:.2f} ms avg"
+            )
+        print("Ingest pipeline | " + " | ".join(parts))
+
+    async def _replay_spill(self):
+        while True:
+            await self._spill_ready.wait()
+            while self.spill.pending:
+                frame, received_at = self.spill.pop()
+                await self.raw_queue.put((frame, received_at))
+            self._spill_ready.clear()
+
+    async def _decode_stage(self):
+        loop = asyncio.get_running_loop()
+        metrics = self.metrics["decode"]
+        while True:
+            frame, received_at = await self.raw_queue.get()
+            future = loop.run_in_executor(self._decode_executor, self.decode, frame)
+            await self.decoded_queue.put((future, received_at, time.perf_counter()))
+            self.raw_queue.task_done()
+            metrics.observe_depth(self.decoded_queue.qsize())
+
+    async def _store_stage(self):
+        loop = asyncio.get_running_loop()
+        decode_metrics = self.metrics["decode"]
+        store_metrics = self.metrics["store"]
+        while True:
+            future, received_at, submitted_at = await self.decoded_queue.get()
+            try:
+                decoded = await future
+                started = time.perf_counter()
+                decode_metrics.processed += 1
+                decode_metrics.busy_seconds += started - submitted_at
+                self.decode_latency.observe(started - submitted_at)
+                await loop.run_in_executor(self._store_executor, self.store, decoded, received_at)
+                finished = time.perf_counter()
+                store_metrics.processed += 1
+                store_metrics.busy_seconds += finished - started
+                self.store_latency.observe(finished - started)
+                self.end_to_end.observe(finished - received_at)
+                self.sample_log.log("frame_stored", receive_to_store_ms=round((finished - received_at) * 1000.0, 3),
+                                    raw_queue=self.raw_queue.qsize())
+            except Exception as e:
+                store_metrics.dropped += 1
+                self.frames_dropped.inc()
+                print(f"Ingest pipeline error: {e}")
+            finally:
+                self.decoded_queue.task_done()
+                store_metrics.observe_depth(self.decoded_queue.qsize())
+
+    async def _report_loop(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.report()
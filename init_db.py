@@ -1,14 +1,7 @@
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-
-# Database connection parameters
-db_params = {
-    "dbname": "prompt_trader",
-    "user": "trader",
-    "password": "secure_password",
-    "host": "localhost",
-    "port": "5432"
-}
+from schema_manager import migrate, storage_settings
+from db import db_params
 
 # Connect to PostgreSQL
 conn = psycopg2.connect(**db_params)
@@ -31,15 +24,73 @@ cursor.execute("""
         option_type TEXT,  -- 'CE' for Call, 'PE' for Put
         open_interest BIGINT,
         expiry_date DATE,
-        PRIMARY KEY (time, instrument_key)
+        PRIMARY KEY (instrument_key, time)  -- also serves per-instrument time-range scans
     );
 """)
 
 # Convert market_data to TimescaleDB hypertable
-cursor.execute("SELECT create_hypertable('market_data', 'time', if_not_exists => TRUE);")
+cursor.execute("""
+    SELECT create_hypertable('market_data', 'time',
+        chunk_time_interval => %s::interval, if_not_exists => TRUE);
+""", (storage_settings["chunk_interval"],))
 
-# Create index for market_data queries
-cursor.execute("CREATE INDEX IF NOT EXISTS idx_instrument_key ON market_data (instrument_key, time DESC);")
+# OHLCV + OI bars as continuous aggregates over market_data. materialized_only = false
+# adds a real-time tail, so buckets not yet refreshed are aggregated from raw ticks at query time.
+# ltp/volume/open_interest are snapshots per tick: volume and OI are the last values in the bucket.
+bar_views = [
+    # (view, bucket width, refresh start_offset, end_offset, schedule_interval)
+    ("market_bars_1s", "1 second", "10 minutes", "2 seconds", "5 seconds"),
+    ("market_bars_1m", "1 minute", "1 hour", "1 minute", "1 minute"),
+    ("market_bars_5m", "5 minutes", "1 day", "5 minutes", "5 minutes")
+]
+for view, bucket, start_offset, end_offset, schedule_interval in bar_views:
+    cursor.execute(f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT time_bucket(INTERVAL '{bucket}', time) AS bucket,
+               instrument_key,
+               first(ltp, time) AS open,
+               max(ltp) AS high,
+               min(ltp) AS low,
+               last(ltp, time) AS close,
+               last(volume, time) AS volume,
+               last(open_interest, time) AS open_interest,
+               count(*) AS ticks
+        FROM market_data
+        GROUP BY bucket, instrument_key
+        WITH NO DATA;
+    """)
+    cursor.execute(f"""
+        SELECT add_continuous_aggregate_policy('{view}',
+            start_offset => INTERVAL '{start_offset}',
+            end_offset => INTERVAL '{end_offset}',
+            schedule_interval => INTERVAL '{schedule_interval}',
+            if_not_exists => TRUE);
+    """)
+    # The policies only look back start_offset; materialize all existing ticks once so history
+    # older than that has bars too (later runs only redo ranges invalidated since)
+    cursor.execute(f"CALL refresh_continuous_aggregate('{view}', NULL, NULL);")
+
+# Registry of instruments seen in market_data, so readers never need a DISTINCT scan
+cursor.execute("""
+    CREATE TABLE IF NOT EXISTS instrument_registry (
+        instrument_id SERIAL PRIMARY KEY,
+        instrument_key TEXT NOT NULL UNIQUE,
+        segment TEXT NOT NULL,  -- e.g. 'NSE_FO', 'NSE_INDEX'
+        first_seen TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+""")
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_instrument_registry_segment ON instrument_registry (segment);")
+
+# Backfill the registry from existing market data (one-time scan on upgrade)
+cursor.execute("""
+    INSERT INTO instrument_registry (instrument_key, segment, first_seen)
+    SELECT instrument_key, split_part(instrument_key, '|', 1), min(time)
+    FROM market_data
+    WHERE NOT EXISTS (SELECT 1 FROM instrument_registry)
+    GROUP BY instrument_key
+    ON CONFLICT (instrument_key) DO NOTHING;
+""")
 
 # Create trading signals table
 cursor.execute("""
@@ -58,6 +109,19 @@ cursor.execute("""
 # Convert trading_signals to TimescaleDB hypertable
 cursor.execute("SELECT create_hypertable('trading_signals', 'signal_time', if_not_exists => TRUE);")
 
+# Monotonic signal id for exactly-once delivery to trade_execution
+cursor.execute("ALTER TABLE trading_signals ADD COLUMN IF NOT EXISTS signal_id BIGSERIAL;")
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_trading_signals_id ON trading_signals (signal_id);")
+
+# Durable per-consumer delivery cursor over trading_signals.signal_id
+cursor.execute("""
+    CREATE TABLE IF NOT EXISTS signal_cursor (
+        consumer TEXT PRIMARY KEY,
+        last_signal_id BIGINT NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+""")
+
 # Create executed orders table
 cursor.execute("""
     CREATE TABLE IF NOT EXISTS executed_orders (
@@ -67,7 +131,7 @@ cursor.execute("""
         quantity INTEGER NOT NULL,
         price DOUBLE PRECISION,
         order_id TEXT,
-        status TEXT,  -- 'PLACED', 'EXECUTED', 'REJECTED'
+        status TEXT,  -- 'PENDING', 'PLACED', 'EXECUTED', 'REJECTED', 'RISK_REJECTED', 'UNKNOWN'
         PRIMARY KEY (order_time, instrument_key)
     );
 """)
@@ -75,6 +139,9 @@ cursor.execute("""
 # Convert executed_orders to TimescaleDB hypertable
 cursor.execute("SELECT create_hypertable('executed_orders', 'order_time', if_not_exists => TRUE);")
 
+# Chunking, compression and retention for market_data (also migrates older databases)
+migrate(cursor)
+
 print("Database schema created successfully")
 cursor.close()
 conn.close()
\ No newline at end of file
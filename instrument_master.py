@@ -0,0 +1,229 @@
+import os
+import csv
+import gzip
+import json
+import threading
+from email.utils import formatdate
+from datetime import date, datetime, timedelta, timezone
+from typing import NamedTuple, Optional
+import requests
+
+# Broker instrument master (refreshed daily by Upstox) and local cache
+INSTRUMENT_MASTER_URL = os.getenv(
+    "INSTRUMENT_MASTER_URL",
+    "https://assets.upstox.com/market-quote/instruments/exchange/complete.csv.gz"
+)
+INSTRUMENT_CACHE_PATH = os.getenv("INSTRUMENT_CACHE_PATH", "instruments.csv.gz")
+
+# The master changes per trading day (new weekly expiries), so a cache from before today is re-downloaded
+IST = timezone(timedelta(hours=5, minutes=30))
+
+# Exchange segments kept in memory; everything else is skipped while loading
+DEFAULT_SEGMENTS = ("NSE_INDEX", "NSE_EQ", "NSE_FO")
+
+# Lot size used when an instrument is missing from the master
+DEFAULT_LOT_SIZE = 25
+
+
+class InstrumentInfo(NamedTuple):
+    instrument_key: str
+    underlying: str
+    instrument_type: str
+    option_type: Optional[str]  # 'CE', 'PE' or None
+    strike: Optional[float]
+    expiry: Optional[date]
+    lot_size: int
+    tick_size: float
+
+
+def _parse_expiry(value):
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):  # JSON master: epoch milliseconds
+        return datetime.fromtimestamp(value / 1000, tz=timezone.utc).date()
+    return date.fromisoformat(str(value)[:10])
+
+
+def _from_csv_row(row):
+    option_type = row.get("option_type") or None
+    strike = float(row["strike"]) if option_type and row.get("strike") else None
+    return InstrumentInfo(
+        instrument_key=row["instrument_key"],
+        underlying=row.get("name") or row.get("tradingsymbol", ""),
+        instrument_type=row.get("instrument_type", ""),
+        option_type=option_type,
+        strike=strike,
+        expiry=_parse_expiry(row.get("expiry")),
+        lot_size=int(float(row.get("lot_size") or 1)),
+        tick_size=float(row.get("tick_size") or 0.05)
+    )
+
+
+def _from_json_record(record):
+    instrument_type = record.get("instrument_type", "")
+    option_type = instrument_type if instrument_type in ("CE", "PE") else None
+    return InstrumentInfo(
+        instrument_key=record["instrument_key"],
+        underlying=record.get("underlying_symbol") or record.get("name", ""),
+        instrument_type=instrument_type,
+        option_type=option_type,
+        strike=float(record["strike_price"]) if option_type else None,
+        expiry=_parse_expiry(record.get("expiry")),
+        lot_size=int(record.get("lot_size") or 1),
+        tick_size=float(record.get("tick_size") or 0.05)
+    )
+
+
+def parse_instrument_file(path, segments=DEFAULT_SEGMENTS):
+    """Parse a (optionally gzipped) CSV or JSON instrument master into InstrumentInfo records."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        if ".json" in path:
+            records = (_from_json_record(record) for record in json.load(f))
+        else:
+            records = (_from_csv_row(row) for row in csv.DictReader(f))
+        return {
+            info.instrument_key: info for info in records
+            if segments is None or info.instrument_key.split("|", 1)[0] in segments
+        }
+
+
+class InstrumentMaster:
+    """In-memory instrument metadata index with O(1) lookups by instrument key.
+
+    The master file is downloaded with a conditional GET, so a refresh only
+    re-parses when the broker published a new file, and then only touches
+    entries that were added, changed or removed.
+    """
+
+    def __init__(self, url=INSTRUMENT_MASTER_URL, cache_path=INSTRUMENT_CACHE_PATH,
+                 segments=DEFAULT_SEGMENTS):
+        self.url = url
+        self.cache_path = cache_path
+        self.segments = segments
+        self._index = {}
+        self._etag = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, instrument_key):
+        return instrument_key in self._index
+
+    def get(self, instrument_key):
+        """Return the InstrumentInfo for a key, or None if unknown."""
+        return self._index.get(instrument_key)
+
+    def option_fields(self, instrument_key):
+        """Return (strike, option_type, expiry) for a key, or Nones if unknown."""
+        info = self._index.get(instrument_key)
+        if info is None:
+            return None, None, None
+        return info.strike, info.option_type, info.expiry
+
+    def lot_size(self, instrument_key, default=DEFAULT_LOT_SIZE):
+        info = self._index.get(instrument_key)
+        return info.lot_size if info is not None else default
+
+    def is_expired(self, instrument_key, today=None):
+        """True if the instrument is a known contract whose expiry is before today."""
+        info = self._index.get(instrument_key)
+        return info is not None and info.expiry is not None and info.expiry < (today or date.today())
+
+    def options(self, underlying=None, expiry=None):
+        """List option InstrumentInfo records, optionally filtered by underlying and expiry."""
+        return [
+            info for info in self._index.values()
+            if info.option_type
+            and (underlying is None or info.underlying == underlying)
+            and (expiry is None or info.expiry == expiry)
+        ]
+
+    def cache_is_stale(self, today=None):
+        """True if the cache is missing or was written before the current trading day (IST)."""
+        if not os.path.exists(self.cache_path):
+            return True
+        written = datetime.fromtimestamp(os.path.getmtime(self.cache_path), IST).date()
+        return written < (today or datetime.now(IST).date())
+
+    def load(self):
+        """Load from the local cache, downloading it first if it is missing or from before today."""
+        if self.cache_is_stale():
+            try:
+                self.download()
+            except Exception as e:
+                if not os.path.exists(self.cache_path):
+                    raise
+                print(f"Error downloading instrument master, using the stale cache: {e}")
+        self._apply(parse_instrument_file(self.cache_path, self.segments))
+        print(f"Loaded {len(self._index)} instruments from {self.cache_path}")
+        return self
+
+    def download(self):
+        """Fetch the master file if it changed since the last download; return True if it did."""
+        if self._etag:
+            headers = {"If-None-Match": self._etag}
+        elif os.path.exists(self.cache_path):
+            headers = {"If-Modified-Since": formatdate(os.path.getmtime(self.cache_path), usegmt=True)}
+        else:
+            headers = {}
+        response = requests.get(self.url, headers=headers, timeout=30)
+        if response.status_code == 304:
+            return False
+        response.raise_for_status()
+        self._etag = response.headers.get("ETag")
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(response.content)
+        os.replace(tmp_path, self.cache_path)
+        return True
+
+    def refresh(self):
+        """Pull a newer master if one was published and apply the differences."""
+        try:
+            if not self.download():
+                return 0
+            return self._apply(parse_instrument_file(self.cache_path, self.segments))
+        except Exception as e:
+            print(f"Error refreshing instrument master: {e}")
+            return 0
+
+    def prune_expired(self, today=None):
+        """Drop contracts that expired before today; return the number removed."""
+        today = today or date.today()
+        with self._lock:
+            expired = [key for key, info in self._index.items() if info.expiry and info.expiry < today]
+            if expired:
+                index = dict(self._index)
+                for key in expired:
+                    del index[key]
+                self._index = index
+        return len(expired)
+
+    def _apply(self, records):
+        # Readers never lock: build the next index and swap the reference
+        with self._lock:
+            index = dict(self._index)
+            changed = 0
+            for key in set(index) - set(records):
+                del index[key]
+                changed += 1
+            for key, info in records.items():
+                if index.get(key) != info:
+                    index[key] = info
+                    changed += 1
+            self._index = index
+        return changed
+
+
+# Process-wide instance, loaded on first use
+_default_master = None
+
+
+def get_instrument_master():
+    """Return the shared InstrumentMaster, loading it on first call."""
+    global _default_master
+    if _default_master is None:
+        _default_master = InstrumentMaster().load()
+    return _default_master
@@ -0,0 +1,262 @@
+import io
+import time
+import threading
+from collections import deque
+from datetime import date, datetime
+from psycopg2.extras import execute_values
+from db import ConnectionPool
+from metrics import REGISTRY
+from spool import open_spool
+
+# Column order shared by the staging table, COPY stream and merge statement
+MARKET_DATA_COLUMNS = (
+    "time", "instrument_key", "ltp", "volume", "last_trade_time", "last_close",
+    "strike_price", "option_type", "open_interest", "expiry_date"
+)
+
+_COLUMN_LIST = ", ".join(MARKET_DATA_COLUMNS)
+_UPDATE_LIST = ",\n        ".join(
+    f"{column} = EXCLUDED.{column}" for column in MARKET_DATA_COLUMNS[2:]
+)
+
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE IF NOT EXISTS market_data_staging
+    (LIKE market_data INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;
+"""
+
+COPY_STAGING_SQL = f"COPY market_data_staging ({_COLUMN_LIST}) FROM STDIN"
+
+MERGE_STAGING_SQL = f"""
+    INSERT INTO market_data ({_COLUMN_LIST})
+    SELECT {_COLUMN_LIST} FROM market_data_staging
+    ON CONFLICT (time, instrument_key) DO UPDATE
+    SET {_UPDATE_LIST};
+"""
+
+REGISTER_INSTRUMENTS_SQL = """
+    INSERT INTO instrument_registry (instrument_key, segment, first_seen)
+    VALUES %s
+    ON CONFLICT (instrument_key) DO NOTHING;
+"""
+
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _copy_value(value):
+    """Render a single value in PostgreSQL COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, str):
+        return value.translate(_COPY_ESCAPES)
+    return str(value)
+
+
+def rows_to_copy_buffer(rows):
+    """Serialize market data rows into an in-memory COPY text stream."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+class WriterStats:
+    """Throughput and tick-to-commit latency counters for the tick writer."""
+
+    def __init__(self, sample_size=4096, registry=REGISTRY):
+        self.lock = threading.Lock()
+        self.committed_counter = registry.counter("tick_rows_committed_total", "market_data rows written")
+        self.dropped_counter = registry.counter("tick_rows_dropped_total", "market_data rows lost to DB errors")
+        self.error_counter = registry.counter("db_errors_total", "Database errors", component="tick_writer")
+        self.commit_latency = registry.histogram("tick_commit_latency_seconds", "Tick receive to DB commit")
+        self.flush_latency = registry.histogram("tick_flush_seconds", "COPY + merge transaction duration")
+        self.rows_committed = 0
+        self.rows_dropped = 0
+        self.batches = 0
+        self.db_errors = 0
+        self.latencies = deque(maxlen=sample_size)  # seconds, one sample per message
+        self._window_start = time.perf_counter()
+        self._window_rows = 0
+
+    def record_commit(self, row_count, received_times, committed_at):
+        with self.lock:
+            self.rows_committed += row_count
+            self._window_rows += row_count
+            self.batches += 1
+            self.latencies.extend(committed_at - received for received in received_times)
+        self.committed_counter.inc(row_count)
+        for received in received_times:
+            self.commit_latency.observe(committed_at - received)
+
+    def record_error(self, row_count):
+        with self.lock:
+            self.db_errors += 1
+            self.rows_dropped += row_count
+        self.error_counter.inc()
+        self.dropped_counter.inc(row_count)
+
+    def snapshot(self):
+        """Return rows/sec since the last snapshot plus p50/p99 latency in ms."""
+        with self.lock:
+            now = time.perf_counter()
+            elapsed = max(now - self._window_start, 1e-9)
+            rows_per_sec = self._window_rows / elapsed
+            self._window_start = now
+            self._window_rows = 0
+            samples = sorted(self.latencies)
+            self.latencies.clear()
+            totals = {
+                "rows_committed": self.rows_committed,
+                "rows_dropped": self.rows_dropped,
+                "batches": self.batches,
+                "db_errors": self.db_errors
+            }
+
+        def percentile(p):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(p * len(samples)))] * 1000.0
+
+        totals.update(rows_per_sec=rows_per_sec, p50_ms=percentile(0.50), p99_ms=percentile(0.99))
+        return totals
+
+
+class TickWriter:
+    """Buffer market data rows and flush them to TimescaleDB in micro-batches.
+
+    Rows are COPY'd into a per-connection temp staging table and merged into
+    ``market_data`` with a single upsert. A flush happens whenever the buffer
+    reaches ``batch_size`` rows or ``flush_interval`` seconds have elapsed.
+
+    With ``spool_name`` rows are appended to that write-ahead spool instead
+    and a drainer thread loads them, so ticks survive database outages and
+    restarts; the staging merge is an upsert, so replays are harmless.
+    """
+
+    def __init__(self, db_params, batch_size=500, flush_interval=0.25, workers=1,
+                 report_interval=10.0, spool_name=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.report_interval = report_interval
+        self.stats = WriterStats()
+        REGISTRY.gauge("tick_writer_buffered_rows", "Rows waiting for the next flush", fn=lambda: len(self._rows))
+        # No connection up front: a database that is down must not stop the writer starting
+        self.pool = ConnectionPool(db_params, maxconn=workers, name="tick_writer")
+
+        self._known_keys = set()  # instruments already in instrument_registry
+        self._rows = {}  # (time, instrument_key) -> row, later rows win
+        self._received = []  # perf_counter timestamp per buffered message
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._last_report = time.perf_counter()
+        self._session = time.time_ns()  # perf_counter stamps are only comparable within this process
+        self.spool, self.drainer = open_spool(spool_name, self._load_spooled) if spool_name else (None, None)
+        self._threads = [
+            threading.Thread(target=self._run, name=f"tick-writer-{i}", daemon=True)
+            for i in range(workers if self.spool is None else 1)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def add_rows(self, rows, received_at=None):
+        """Queue rows from one feed message; never touches the database."""
+        if not rows:
+            return
+        received_at = time.perf_counter() if received_at is None else received_at
+        if self.spool is not None:
+            self.spool.append((rows, received_at, self._session))
+            return
+        with self._lock:
+            for row in rows:
+                self._rows[(row[0], row[1])] = row
+            self._received.append(received_at)
+            full = len(self._rows) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write everything buffered so far in one COPY + merge transaction."""
+        with self._lock:
+            if not self._rows:
+                return 0
+            rows = list(self._rows.values())
+            received = self._received
+            self._rows = {}
+            self._received = []
+
+        try:
+            return self.write_rows(rows, received)
+        except Exception as e:
+            print(f"Database error writing {len(rows)} ticks: {e}")
+            self.stats.record_error(len(rows))
+            return 0
+
+    def write_rows(self, rows, received=()):
+        """COPY + merge rows (unique per time and key) in one transaction; raises on database errors."""
+        new_keys = {}
+        for row in rows:
+            if row[1] not in self._known_keys:
+                new_keys.setdefault(row[1], row[0])
+
+        started = time.perf_counter()
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(CREATE_STAGING_SQL)
+            cursor.copy_expert(COPY_STAGING_SQL, rows_to_copy_buffer(rows))
+            cursor.execute(MERGE_STAGING_SQL)
+            if new_keys:
+                execute_values(cursor, REGISTER_INSTRUMENTS_SQL, [
+                    (key, key.split("|", 1)[0], first_seen) for key, first_seen in new_keys.items()
+                ])
+        self._known_keys.update(new_keys)
+        committed_at = time.perf_counter()
+        self.stats.flush_latency.observe(committed_at - started)
+        self.stats.record_commit(len(rows), received, committed_at)
+        return len(rows)
+
+    def _load_spooled(self, records):
+        """Spool drainer handler: merge a batch of spooled messages and write it."""
+        merged = {}
+        received = []
+        for rows, received_at, session in records:
+            for row in rows:
+                merged[(row[0], row[1])] = row
+            if session == self._session:
+                received.append(received_at)
+        self.write_rows(list(merged.values()), received)
+
+    def report(self):
+        """Print throughput and tick-to-commit latency since the last report."""
+        stats = self.stats.snapshot()
+        print(
+            f"Tick writer: {stats['rows_per_sec']:.0f} rows/s, "
+            f"tick->commit p50 {stats['p50_ms']:.1f} ms p99 {stats['p99_ms']:.1f} ms, "
+            f"{stats['rows_committed']} rows in {stats['batches']} batches, "
+            f"{stats['db_errors']} errors ({stats['rows_dropped']} rows dropped)"
+        )
+        return stats
+
+    def close(self):
+        """Stop the flush threads, write any remaining rows and close the pool."""
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self.flush()
+        if self.spool is not None:
+            self.drainer.close()
+            self.spool.close()
+        self.report()
+        self.pool.close()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if self.report_interval and time.perf_counter() - self._last_report >= self.report_interval:
+                self._last_report = time.perf_counter()
+                self.report()
@@ -0,0 +1,154 @@
+import io
+import struct
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+# PostgreSQL binary COPY framing
+_COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+_COPY_HEADER = struct.Struct("!ii")  # flags, header extension length
+
+# Bar resolutions backed by continuous aggregates created in init_db.py
+BAR_VIEWS = {
+    "1s": ("market_bars_1s", timedelta(seconds=1)),
+    "1m": ("market_bars_1m", timedelta(minutes=1)),
+    "5m": ("market_bars_5m", timedelta(minutes=5))
+}
+
+
+def copy_row_dtype(columns):
+    """Fixed-width binary COPY tuple layout: field count, then (length, value) per column."""
+    fields = [("fields", ">i2")]
+    for name, dtype in columns:
+        fields += [(f"{name}_len", ">i4"), (name, dtype)]
+    return np.dtype(fields)
+
+
+TICK_COLUMNS = [("instrument_id", ">i4"), ("time", ">i8"), ("close", ">f8")]
+BAR_COLUMNS = TICK_COLUMNS[:2] + [
+    ("open", ">f8"), ("high", ">f8"), ("low", ">f8"), ("close", ">f8"),
+    ("volume", ">i8"), ("open_interest", ">i8")
+]
+
+# Columns are COALESCEd so every tuple has the same width and can be viewed as a record array
+CHAIN_TICKS_COPY_SQL = """
+    COPY (
+        SELECT r.instrument_id,
+               (extract(epoch FROM m.time) * 1000000)::int8,
+               COALESCE(m.ltp, 'NaN')::float8
+        FROM market_data m
+        JOIN instrument_registry r ON r.instrument_key = m.instrument_key
+        WHERE r.segment = %(segment)s AND m.time > %(start)s AND m.time <= %(end)s
+        ORDER BY r.instrument_id, m.time
+    ) TO STDOUT WITH (FORMAT binary)
+"""
+
+CHAIN_BARS_COPY_SQL = """
+    COPY (
+        SELECT r.instrument_id,
+               (extract(epoch FROM b.bucket) * 1000000)::int8,
+               COALESCE(b.open, 'NaN')::float8,
+               COALESCE(b.high, 'NaN')::float8,
+               COALESCE(b.low, 'NaN')::float8,
+               COALESCE(b.close, 'NaN')::float8,
+               COALESCE(b.volume, 0)::int8,
+               COALESCE(b.open_interest, 0)::int8
+        FROM {view} b
+        JOIN instrument_registry r ON r.instrument_key = b.instrument_key
+        WHERE r.segment = %(segment)s AND b.bucket > %(start)s AND b.bucket < %(end)s
+        ORDER BY r.instrument_id, b.bucket
+    ) TO STDOUT WITH (FORMAT binary)
+"""
+
+
+def parse_binary_copy(payload, dtype):
+    """View a binary COPY payload of fixed-width tuples as a NumPy structured array."""
+    if bytes(payload[:len(_COPY_SIGNATURE)]) != _COPY_SIGNATURE:
+        raise ValueError("Not a PostgreSQL binary COPY stream")
+    offset = len(_COPY_SIGNATURE)
+    _, extension_length = _COPY_HEADER.unpack_from(payload, offset)
+    offset += _COPY_HEADER.size + extension_length
+    body = memoryview(payload)[offset:len(payload) - 2]  # strip the int16 -1 trailer
+    return np.frombuffer(body, dtype=dtype)
+
+
+def fetch_registry(conn, segment="NSE_FO"):
+    """Return {instrument_id: instrument_key} for a segment from instrument_registry."""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT instrument_id, instrument_key FROM instrument_registry WHERE segment = %s ORDER BY instrument_id;",
+            (segment,)
+        )
+        return dict(cursor.fetchall())
+
+
+def _copy_chain(conn, sql, params, columns, segment):
+    registry = fetch_registry(conn, segment)
+    buffer = io.BytesIO()
+    with conn.cursor() as cursor:
+        # COPY takes no bind parameters, so render them client-side
+        cursor.copy_expert(cursor.mogrify(sql, params).decode(), buffer)
+    rows = parse_binary_copy(buffer.getbuffer(), copy_row_dtype(columns))
+    return split_by_instrument(rows, registry, [name for name, _ in columns[1:]])
+
+
+def load_chain_ticks(conn, start_time, end_time, segment="NSE_FO"):
+    """Fetch a whole chain's ticks in one binary COPY and split them per instrument.
+
+    Returns {instrument_key: {"time": datetime64[us] UTC, "close": float64}}.
+    The COPY payload is reinterpreted in place and converted column-wise, so
+    no per-row Python objects are created.
+    """
+    params = {"segment": segment, "start": start_time, "end": end_time}
+    return _copy_chain(conn, CHAIN_TICKS_COPY_SQL, params, TICK_COLUMNS, segment)
+
+
+def bar_window_end(resolution, now=None):
+    """Start of the bucket still in progress; bars before it are final."""
+    _, interval = BAR_VIEWS[resolution]
+    now = now or datetime.now(timezone.utc)
+    step = interval.total_seconds()
+    return datetime.fromtimestamp(now.timestamp() // step * step, tz=timezone.utc)
+
+
+def load_chain_bars(conn, start_time, resolution="1m", end_time=None, segment="NSE_FO"):
+    """Fetch completed OHLCV + OI bars for a whole chain from a continuous aggregate.
+
+    Same layout as load_chain_ticks plus "open", "high", "low", "volume" and
+    "open_interest". The in-progress bucket is excluded so an incremental
+    consumer never folds in a bar that is still changing.
+    """
+    view, _ = BAR_VIEWS[resolution]
+    params = {"segment": segment, "start": start_time, "end": end_time or bar_window_end(resolution)}
+    return _copy_chain(conn, CHAIN_BARS_COPY_SQL.format(view=view), params, BAR_COLUMNS, segment)
+
+
+def split_by_instrument(rows, registry, columns):
+    """Cut instrument-sorted rows into per-instrument native-endian arrays."""
+    if len(rows) == 0:
+        return {}
+    ids = rows["instrument_id"]
+    boundaries = np.flatnonzero(np.diff(ids)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(rows)]))
+    arrays = {}
+    for name in columns:
+        native = rows[name].astype(rows.dtype[name].newbyteorder("="))
+        arrays[name] = native.view("datetime64[us]") if name == "time" else native
+    history = {}
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        instrument_key = registry.get(int(ids[start]))
+        if instrument_key is not None:
+            history[instrument_key] = {name: array[start:end] for name, array in arrays.items()}
+    return history
+
+
+def as_datetime(value):
+    """Convert a datetime64[us] UTC value to an aware datetime (other values pass through)."""
+    if isinstance(value, np.datetime64):
+        return value.astype("datetime64[us]").astype(datetime).replace(tzinfo=timezone.utc)
+    return value
+
+
+def to_datetime64(value):
+    """Convert an aware datetime to datetime64[us] UTC for comparisons against loaded arrays."""
+    return np.datetime64(value.astimezone(timezone.utc).replace(tzinfo=None), "us")
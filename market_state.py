@@ -0,0 +1,226 @@
+import os
+import time
+import numpy as np
+from multiprocessing import shared_memory
+from tick_decoder import DEPTH_LEVELS
+
+# Name of the shared-memory segment published by websocket_market_data (empty keeps it in-process)
+MARKET_STATE_SHM = os.getenv("MARKET_STATE_SHM", "")
+MARKET_STATE_CAPACITY = int(os.getenv("MARKET_STATE_CAPACITY", "4096"))
+
+# Readers treat an instrument whose last tick is older than this many seconds as unknown
+MARKET_STATE_MAX_AGE = float(os.getenv("MARKET_STATE_MAX_AGE", "60"))
+
+# Attempts a seqlock read makes before giving up, e.g. on a slot left odd by a writer that died mid-update
+SEQLOCK_RETRIES = 1000
+
+KEY_WIDTH = 64  # bytes per instrument key in the shared key table
+_MAGIC = 0x50545354  # "PTST"
+
+# generation identifies one writer's segment (0 once that writer has closed it)
+_HEADER = np.dtype([("magic", "<u4"), ("capacity", "<u4"), ("depth", "<u4"), ("count", "<u4"), ("seq", "<u8"),
+                    ("generation", "<u8"), ("pid", "<u8")])
+
+
+def _fields(capacity, depth):
+    """(name, dtype, shape) of every per-instrument array, in segment order."""
+    return [
+        ("keys", f"S{KEY_WIDTH}", (capacity,)),
+        ("seq", "<u8", (capacity,)),  # per-slot seqlock: odd while a write is in progress
+        ("updated_ns", "<i8", (capacity,)),
+        ("ltp", "<f8", (capacity,)),
+        ("ltt", "<i8", (capacity,)),
+        ("volume", "<i8", (capacity,)),
+        ("last_close", "<f8", (capacity,)),
+        ("oi", "<i8", (capacity,)),
+        ("bid_price", "<f8", (capacity, depth)),
+        ("bid_qty", "<i8", (capacity, depth)),
+        ("ask_price", "<f8", (capacity, depth)),
+        ("ask_qty", "<i8", (capacity, depth))
+    ]
+
+
+def _layout(capacity, depth):
+    offsets, offset = {}, _HEADER.itemsize
+    for name, dtype, shape in _fields(capacity, depth):
+        offset = (offset + 7) // 8 * 8
+        offsets[name] = (offset, np.dtype(dtype), shape)
+        offset += np.dtype(dtype).itemsize * int(np.prod(shape))
+    return offsets, offset
+
+
+# Columns copied from a TickBatch on update
+_TICK_COLUMNS = ("ltp", "ltt", "volume", "last_close", "oi", "bid_price", "bid_qty", "ask_price", "ask_qty")
+
+
+class MarketStateStore:
+    """Latest tick per instrument (LTP, LTT, volume, OI, depth) in fixed arrays.
+
+    There is one writer, the ingest store stage, which applies decoded
+    batches in arrival order. Readers never lock: every slot carries a
+    seqlock counter and the store a global one, and a read retries until it
+    sees the same even counter before and after copying, up to
+    SEQLOCK_RETRIES times. With ``shm_name`` the arrays live in a
+    shared-memory segment that other processes open with
+    ``MarketStateStore.attach``; a restarted writer creates a new segment,
+    which attached readers detect with ``replaced``.
+    """
+
+    def __init__(self, capacity=MARKET_STATE_CAPACITY, depth=DEPTH_LEVELS, shm_name=None, _attach=False):
+        self.shm = None
+        self.shm_name = shm_name
+        if shm_name and _attach:
+            self.shm = shared_memory.SharedMemory(name=shm_name)
+            header = np.ndarray((), dtype=_HEADER, buffer=self.shm.buf)
+            if int(header["magic"]) != _MAGIC:
+                raise ValueError(f"Shared memory {shm_name!r} is not a market state segment")
+            capacity, depth = int(header["capacity"]), int(header["depth"])
+        offsets, size = _layout(capacity, depth)
+        if shm_name and not _attach:
+            try:
+                stale = shared_memory.SharedMemory(name=shm_name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+            self.shm = shared_memory.SharedMemory(name=shm_name, create=True, size=size)
+        buffer = self.shm.buf if self.shm is not None else bytearray(size)
+        self.capacity = capacity
+        self.depth = depth
+        self.header = np.ndarray((), dtype=_HEADER, buffer=buffer)
+        self.arrays = {
+            name: np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+            for name, (offset, dtype, shape) in offsets.items()
+        }
+        self._owner = not _attach
+        if self._owner:
+            self.header["magic"] = _MAGIC
+            self.header["capacity"] = capacity
+            self.header["depth"] = depth
+            self.header["count"] = 0
+            self.header["seq"] = 0
+            self.header["generation"] = time.time_ns()
+            self.header["pid"] = os.getpid()
+        self.generation = int(self.header["generation"])
+        self._slots = {}
+        self._refresh_slots()
+
+    @classmethod
+    def attach(cls, shm_name=MARKET_STATE_SHM):
+        """Open a segment published by another process read-only (by convention)."""
+        return cls(shm_name=shm_name, _attach=True)
+
+    def replaced(self):
+        """True for a reader whose writer has since closed or recreated the segment."""
+        if self._owner or self.shm is None:
+            return False
+        if int(self.header["generation"]) != self.generation:
+            return True
+        try:
+            current = shared_memory.SharedMemory(name=self.shm_name)
+        except FileNotFoundError:
+            return True
+        try:
+            header = np.frombuffer(bytes(current.buf[:_HEADER.itemsize]), dtype=_HEADER)[0]
+        finally:
+            current.close()
+        return int(header["generation"]) != self.generation
+
+    def _refresh_slots(self):
+        count = int(self.header["count"])
+        if count != len(self._slots):
+            keys = self.arrays["keys"]
+            for slot in range(len(self._slots), count):
+                self._slots[keys[slot].decode()] = slot
+
+    def _slot_for(self, instrument_key):
+        slot = self._slots.get(instrument_key)
+        if slot is None:
+            slot = len(self._slots)
+            if slot >= self.capacity:
+                return None
+            self.arrays["keys"][slot] = instrument_key.encode()[:KEY_WIDTH]
+            self._slots[instrument_key] = slot
+            self.header["count"] = slot + 1  # publish the key after it is written
+        return slot
+
+    def update(self, batch, updated_ns):
+        """Apply a TickBatch; only the writer calls this."""
+        slots = [self._slot_for(key) for key in batch.keys]
+        present = [i for i, slot in enumerate(slots) if slot is not None]
+        if not present:
+            return
+        rows = np.asarray(present)
+        slots = np.asarray([slots[i] for i in present])
+        arrays = self.arrays
+        depth = min(self.depth, batch.bid_price.shape[1])
+        self.header["seq"] += 1
+        arrays["seq"][slots] += 1
+        for name in _TICK_COLUMNS:
+            source = getattr(batch, name)[rows]
+            if source.ndim == 2:
+                arrays[name][slots, :depth] = source[:, :depth]
+            else:
+                arrays[name][slots] = source
+        arrays["updated_ns"][slots] = updated_ns
+        arrays["seq"][slots] += 1
+        self.header["seq"] += 1
+
+    def get(self, instrument_key, max_age=None):
+        """Consistent copy of one instrument's latest state.
+
+        None if the instrument was never seen, its last tick is older than
+        ``max_age`` seconds, or no consistent copy could be read.
+        """
+        slot = self._slots.get(instrument_key)
+        if slot is None:
+            self._refresh_slots()
+            slot = self._slots.get(instrument_key)
+            if slot is None:
+                return None
+        arrays = self.arrays
+        seq = arrays["seq"]
+        for _ in range(SEQLOCK_RETRIES):
+            before = int(seq[slot])
+            if not before & 1:
+                state = {name: arrays[name][slot].copy() for name in _TICK_COLUMNS + ("updated_ns",)}
+                if int(seq[slot]) == before:
+                    break
+            time.sleep(0)  # yield to the writer
+        else:
+            return None
+        if max_age is not None and time.time_ns() - int(state["updated_ns"]) > max_age * 1e9:
+            return None
+        state = {name: value.item() if value.ndim == 0 else value for name, value in state.items()}
+        state["instrument_key"] = instrument_key
+        return state
+
+    def ltp(self, instrument_key, max_age=None):
+        state = self.get(instrument_key, max_age)
+        return state["ltp"] if state is not None else None
+
+    def snapshot(self, columns=("ltp", "ltt", "volume", "oi", "updated_ns")):
+        """Consistent copy of the whole store: (keys, {column: array}) in slot order, or None."""
+        header = self.header
+        for _ in range(SEQLOCK_RETRIES):
+            before = int(header["seq"])
+            if not before & 1:
+                self._refresh_slots()
+                count = len(self._slots)
+                data = {name: self.arrays[name][:count].copy() for name in columns}
+                if int(header["seq"]) == before:
+                    return list(self._slots), data
+            time.sleep(0)
+        return None
+
+    def close(self):
+        if self.shm is None:
+            return
+        if self._owner:
+            self.header["generation"] = 0  # tells attached readers the writer is gone
+        self.header = None
+        self.arrays = {}
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+        self.shm = None
@@ -0,0 +1,301 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Exporters are off unless configured: METRICS_PORT serves /metrics, METRICS_SNAPSHOT_PATH writes JSON
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_SNAPSHOT_PATH = os.getenv("METRICS_SNAPSHOT_PATH", "")
+METRICS_SNAPSHOT_INTERVAL = float(os.getenv("METRICS_SNAPSHOT_INTERVAL", "10"))
+
+# Directory for the application log files
+LOG_DIR = os.getenv("PROMPT_TRADER_LOG_DIR", "logs")
+
+# 10 us .. ~100 s, four buckets per decade
+DEFAULT_BUCKETS = [10 ** (e / 4) for e in range(-20, 9)]
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+
+class Counter:
+    """Monotonic count, safe to increment from any thread."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text="", labels=None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+
+class Gauge:
+    """Point-in-time value, either set explicitly or read from ``fn`` on collection."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text="", labels=None, fn=None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.fn = fn
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        if self.fn is not None:
+            try:
+                return self.fn()
+            except Exception:
+                return float("nan")
+        return self._value
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+
+class Histogram:
+    """Log-spaced latency histogram (seconds) with percentile estimates."""
+
+    kind = "histogram"
+
+    def __init__(self, name="latency_seconds", help_text="", labels=None, bounds=None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.bounds = bounds or DEFAULT_BUCKETS
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+            self.total += 1
+            self.sum += seconds
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def percentile(self, p):
+        """Upper bucket bound containing the p-th percentile (0 < p <= 1)."""
+        with self.lock:
+            if not self.total:
+                return 0.0
+            target = p * self.total
+            running = 0
+            for i, count in enumerate(self.counts):
+                running += count
+                if running >= target:
+                    return self.bounds[min(i, len(self.bounds) - 1)]
+        return self.bounds[-1]
+
+    def summary(self):
+        return (
+            f"n={self.total} p50={self.percentile(0.50) * 1000:.2f} ms "
+            f"p90={self.percentile(0.90) * 1000:.2f} ms p99={self.percentile(0.99) * 1000:.2f} ms"
+        )
+
+    def samples(self):
+        with self.lock:
+            counts, total, total_sum = list(self.counts), self.total, self.sum
+        samples = []
+        running = 0
+        for bound, count in zip(self.bounds + [float("inf")], counts):
+            running += count
+            samples.append((f"{self.name}_bucket", dict(self.labels, le=f"{bound:.6g}" if bound != float("inf") else "+Inf"), running))
+        samples.append((f"{self.name}_sum", self.labels, total_sum))
+        samples.append((f"{self.name}_count", self.labels, total))
+        return samples
+
+
+class MetricsRegistry:
+    """Process-wide set of named metrics; asking for an existing name returns the same object."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = cls(name, help_text, labels, **kwargs)
+            return metric
+
+    def counter(self, name, help_text="", **labels):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text="", fn=None, **labels):
+        gauge = self._get(Gauge, name, help_text, labels)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name, help_text="", bounds=None, **labels):
+        return self._get(Histogram, name, help_text, labels, bounds=bounds)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render_prometheus(self):
+        """Prometheus text exposition of every metric."""
+        lines = []
+        described = set()
+        for metric in sorted(self.metrics(), key=lambda m: m.name):
+            if metric.name not in described:
+                described.add(metric.name)
+                if metric.help:
+                    lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """JSON-friendly values; histograms as count, mean, p50 and p99 in milliseconds."""
+        data = {}
+        for metric in self.metrics():
+            key = metric.name + _label_text(metric.labels)
+            if metric.kind == "histogram":
+                data[key] = {
+                    "count": metric.total,
+                    "mean_ms": metric.sum / metric.total * 1000.0 if metric.total else 0.0,
+                    "p50_ms": metric.percentile(0.50) * 1000.0,
+                    "p99_ms": metric.percentile(0.99) * 1000.0
+                }
+            else:
+                data[key] = metric.value
+        return data
+
+
+REGISTRY = MetricsRegistry()
+
+
+class MetricsServer:
+    """Serve ``/metrics`` in Prometheus text format from a daemon thread."""
+
+    def __init__(self, registry=REGISTRY, port=METRICS_PORT, host="127.0.0.1"):
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry_ref.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SnapshotWriter:
+    """Periodically replace ``path`` with a JSON snapshot of the registry; writes a final one on close."""
+
+    def __init__(self, path=METRICS_SNAPSHOT_PATH, registry=REGISTRY, interval=METRICS_SNAPSHOT_INTERVAL):
+        self.path = path
+        self.registry = registry
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+        self._thread.start()
+
+    def write(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"at": time.time(), "pid": os.getpid(), "metrics": self.registry.snapshot()}, f)
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+        self.write()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Error writing metrics snapshot: {e}")
+
+
+def start_exporters(registry=REGISTRY, port=METRICS_PORT, snapshot_path=METRICS_SNAPSHOT_PATH):
+    """Start whichever exporters are configured; returns them so callers can close() them."""
+    exporters = []
+    if port:
+        exporters.append(MetricsServer(registry, port))
+        print(f"Metrics on http://127.0.0.1:{port}/metrics")
+    if snapshot_path:
+        exporters.append(SnapshotWriter(snapshot_path, registry))
+    return exporters
+
+
+def configure_logging(filename, level=logging.INFO):
+    """Log to ``filename`` under LOG_DIR (PROMPT_TRADER_LOG_DIR)."""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logging.basicConfig(filename=os.path.join(LOG_DIR, filename), level=level,
+                        format='%(asctime)s - %(message)s')
+
+
+class SampledLogger:
+    """Structured JSON log lines for high-volume events, one in every ``every`` events.
+
+    Each emitted line carries how many events it stands for, so rates can
+    still be reconstructed from the log.
+    """
+
+    def __init__(self, name, every=1000, logger=None):
+        self.name = name
+        self.every = every
+        self.logger = logger or logging.getLogger(name)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def log(self, event, **fields):
+        with self._lock:
+            self._count += 1
+            if self._count < self.every:
+                return
+            sampled, self._count = self._count, 0
+        self.logger.info(json.dumps({"event": event, "sampled": sampled, "ts": time.time(), **fields}, default=str))
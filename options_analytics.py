@@ -0,0 +1,348 @@
+import os
+import sys
+import time
+import math
+import argparse
+from datetime import datetime, time as dt_time
+import numpy as np
+import pytz
+
+# Annualised risk-free rate and dividend yield used for NIFTY options (European, cash settled)
+RISK_FREE_RATE = float(os.getenv("OPTIONS_RISK_FREE_RATE", "0.065"))
+DIVIDEND_YIELD = float(os.getenv("OPTIONS_DIVIDEND_YIELD", "0.0"))
+
+# Contracts expire at the close on expiry day
+EXPIRY_TIME = dt_time(15, 30)
+IST = pytz.timezone("Asia/Kolkata")
+SECONDS_PER_YEAR = 365.0 * 24 * 3600
+
+# Solver settings
+IV_LOWER, IV_UPPER = 1e-4, 5.0
+NEWTON_ITERATIONS = 8
+BISECTION_ITERATIONS = 60
+IV_TOLERANCE = 1e-6  # Newton stops once the price error is below this much IV (price error / vega)
+
+# NSE option tick: a price below one tick, or a vega so small that the whole IV range moves the
+# price by less than one tick, does not pin down an IV
+PRICE_TICK = 0.05
+MIN_VEGA = PRICE_TICK
+
+# Recompute every strike when the underlying has moved by more than this fraction
+SPOT_TOLERANCE = float(os.getenv("OPTIONS_SPOT_TOLERANCE", "0.0005"))
+
+_SQRT_2PI = math.sqrt(2.0 * math.pi)
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / _SQRT_2PI
+
+
+def norm_cdf(x):
+    """Standard normal CDF (Abramowitz & Stegun 26.2.17, |error| < 7.5e-8)."""
+    z = np.abs(x)
+    t = 1.0 / (1.0 + 0.2316419 * z)
+    poly = t * (0.319381530 + t * (-0.356563782 + t * (1.781477937 + t * (-1.821255978 + t * 1.330274429))))
+    upper = norm_pdf(z) * poly
+    return np.where(x >= 0, 1.0 - upper, upper)
+
+
+def _d1_d2(spot, strike, years, sigma, rate, dividend):
+    sqrt_t = np.sqrt(years)
+    d1 = (np.log(spot / strike) + (rate - dividend + 0.5 * sigma * sigma) * years) / (sigma * sqrt_t)
+    return d1, d1 - sigma * sqrt_t
+
+
+def bs_price(spot, strike, years, sigma, is_call, rate=RISK_FREE_RATE, dividend=DIVIDEND_YIELD):
+    """Black-Scholes price for arrays of calls (is_call True) and puts."""
+    d1, d2 = _d1_d2(spot, strike, years, sigma, rate, dividend)
+    spot_df = spot * np.exp(-dividend * years)
+    strike_df = strike * np.exp(-rate * years)
+    call = spot_df * norm_cdf(d1) - strike_df * norm_cdf(d2)
+    put = strike_df * norm_cdf(-d2) - spot_df * norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def bs_vega(spot, strike, years, sigma, rate=RISK_FREE_RATE, dividend=DIVIDEND_YIELD):
+    d1, _ = _d1_d2(spot, strike, years, sigma, rate, dividend)
+    return spot * np.exp(-dividend * years) * norm_pdf(d1) * np.sqrt(years)
+
+
+def implied_volatility(price, spot, strike, years, is_call, rate=RISK_FREE_RATE, dividend=DIVIDEND_YIELD):
+    """Solve Black-Scholes IV for whole arrays at once.
+
+    Vectorized Newton steps from the Brenner-Subrahmanyam guess, then a
+    bisection on [IV_LOWER, IV_UPPER] for any option Newton left unconverged
+    or pushed out of bounds. Newton converges on the IV error (price error
+    over vega), not the price error, so cheap options are solved as tightly
+    as ATM ones. Prices outside the no-arbitrage range, below one tick, with
+    no time left, or whose vega at the solution is below MIN_VEGA give NaN.
+    """
+    price, spot, strike, years = (np.asarray(a, dtype=np.float64) for a in (price, spot, strike, years))
+    is_call = np.asarray(is_call, dtype=bool)
+    spot, years = np.broadcast_to(spot, price.shape), np.broadcast_to(years, price.shape)
+    spot_df = spot * np.exp(-dividend * years)
+    strike_df = strike * np.exp(-rate * years)
+    intrinsic = np.where(is_call, np.maximum(spot_df - strike_df, 0.0), np.maximum(strike_df - spot_df, 0.0))
+    upper_bound = np.where(is_call, spot_df, strike_df)
+    valid = ((years > 0) & (price > intrinsic) & (price < upper_bound) & (price >= PRICE_TICK)
+             & (spot > 0) & (strike > 0))
+
+    sigma = np.full(price.shape, np.nan)
+    if not valid.any():
+        return sigma
+    p, s, k, t, c = price[valid], spot[valid], strike[valid], years[valid], is_call[valid]
+    guess = np.clip(np.sqrt(2.0 * np.pi / t) * p / s, 0.05, 1.0)
+    converged = np.zeros(len(p), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for _ in range(NEWTON_ITERATIONS):
+            diff = bs_price(s, k, t, guess, c, rate, dividend) - p
+            vega = bs_vega(s, k, t, guess, rate, dividend)
+            converged = np.abs(diff) < IV_TOLERANCE * vega
+            if converged.all():
+                break
+            step = np.where(converged, 0.0, diff / vega)
+            guess = guess - step
+        guess_ok = converged & np.isfinite(guess) & (guess > IV_LOWER) & (guess < IV_UPPER)
+
+        # Bisection only for the options Newton could not settle
+        todo = ~guess_ok
+        if todo.any():
+            lo = np.full(todo.sum(), IV_LOWER)
+            hi = np.full(todo.sum(), IV_UPPER)
+            ps, ss, ks, ts, cs = p[todo], s[todo], k[todo], t[todo], c[todo]
+            for _ in range(BISECTION_ITERATIONS):
+                mid = 0.5 * (lo + hi)
+                above = bs_price(ss, ks, ts, mid, cs, rate, dividend) > ps
+                hi = np.where(above, mid, hi)
+                lo = np.where(above, lo, mid)
+            guess[todo] = 0.5 * (lo + hi)
+        guess[bs_vega(s, k, t, guess, rate, dividend) < MIN_VEGA] = np.nan
+    sigma[valid] = guess
+    return sigma
+
+
+def greeks(spot, strike, years, sigma, is_call, rate=RISK_FREE_RATE, dividend=DIVIDEND_YIELD):
+    """Delta, gamma, vega (per 1 vol point) and theta (per calendar day) for arrays of options."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d1, d2 = _d1_d2(spot, strike, years, sigma, rate, dividend)
+        sqrt_t = np.sqrt(years)
+        div_df = np.exp(-dividend * years)
+        rate_df = np.exp(-rate * years)
+        pdf = norm_pdf(d1)
+        delta = np.where(is_call, div_df * norm_cdf(d1), div_df * (norm_cdf(d1) - 1.0))
+        gamma = div_df * pdf / (spot * sigma * sqrt_t)
+        vega = spot * div_df * pdf * sqrt_t / 100.0
+        decay = -spot * div_df * pdf * sigma / (2.0 * sqrt_t)
+        call_theta = decay - rate * strike * rate_df * norm_cdf(d2) + dividend * spot * div_df * norm_cdf(d1)
+        put_theta = decay + rate * strike * rate_df * norm_cdf(-d2) - dividend * spot * div_df * norm_cdf(-d1)
+        theta = np.where(is_call, call_theta, put_theta) / 365.0
+    return delta, gamma, vega, theta
+
+
+def years_to_expiry(expiry, now):
+    """Year fraction from ``now`` (aware) to the close on ``expiry`` (a date)."""
+    close = IST.localize(datetime.combine(expiry, EXPIRY_TIME))
+    return max((close - now).total_seconds(), 0.0) / SECONDS_PER_YEAR
+
+
+class ChainAnalytics:
+    """IV and Greeks for an option chain, cached per contract and recomputed incrementally.
+
+    Contracts are registered on first sight with their strike, type and
+    expiry from the instrument master. ``update`` recomputes only contracts
+    whose LTP changed since their last solve, plus every contract once the
+    underlying has moved more than ``spot_tolerance`` from the spot they were
+    solved against.
+    """
+
+    COLUMNS = ("ltp", "solved_ltp", "spot", "years", "iv", "delta", "gamma", "vega", "theta")
+
+    def __init__(self, instruments, underlying_key="NSE_INDEX|Nifty 50", spot_tolerance=SPOT_TOLERANCE,
+                 capacity=1024):
+        self.instruments = instruments
+        self.underlying_key = underlying_key
+        self.spot_tolerance = spot_tolerance
+        self.spot = None
+        self.keys = []
+        self.expiry = []
+        self.arrays = {}
+        self.strike = np.empty(0)
+        self.is_call = np.empty(0, dtype=bool)
+        self._slots = {}
+        self._allocate(capacity)
+        self.recomputed = 0
+
+    def _allocate(self, capacity):
+        n = len(self.keys)
+        arrays = {name: np.full(capacity, np.nan) for name in self.COLUMNS}
+        strike = np.full(capacity, np.nan)
+        is_call = np.zeros(capacity, dtype=bool)
+        for name in self.arrays:
+            arrays[name][:n] = self.arrays[name][:n]
+        strike[:n] = self.strike[:n]
+        is_call[:n] = self.is_call[:n]
+        self.arrays, self.strike, self.is_call = arrays, strike, is_call
+
+    def _slot(self, instrument_key):
+        slot = self._slots.get(instrument_key)
+        if slot is not None:
+            return slot
+        strike, option_type, expiry = self.instruments.option_fields(instrument_key)
+        if strike is None or option_type not in ("CE", "PE") or expiry is None:
+            self._slots[instrument_key] = -1
+            return -1
+        slot = len(self.keys)
+        if slot >= len(self.strike):
+            self._allocate(len(self.strike) * 2)
+        self.keys.append(instrument_key)
+        self.strike[slot] = strike
+        self.is_call[slot] = option_type == "CE"
+        self.expiry.append(expiry)
+        self._slots[instrument_key] = slot
+        return slot
+
+    def update(self, keys, ltps, spot=None, now=None):
+        """Fold new option LTPs (and optionally a new spot) in; return the number of contracts re-solved."""
+        now = now or datetime.now(IST)
+        if spot is not None and spot > 0:
+            self.spot = float(spot)
+        if self.spot is None:
+            return 0
+        slots, prices = [], []
+        for key, ltp in zip(keys, ltps):
+            slot = self._slot(key)
+            if slot >= 0:
+                slots.append(slot)
+                prices.append(ltp)
+        n = len(self.keys)
+        arrays = self.arrays
+        if slots:
+            arrays["ltp"][np.asarray(slots)] = prices
+        with np.errstate(invalid="ignore"):
+            stale = arrays["ltp"][:n] != arrays["solved_ltp"][:n]
+            moved = np.abs(arrays["spot"][:n] - self.spot) > self.spot_tolerance * self.spot
+        todo = np.flatnonzero((stale | moved | np.isnan(arrays["spot"][:n])) & ~np.isnan(arrays["ltp"][:n]))
+        if not len(todo):
+            return 0
+
+        years = np.array([years_to_expiry(self.expiry[i], now) for i in todo.tolist()])
+        strike, is_call, price = self.strike[todo], self.is_call[todo], arrays["ltp"][todo]
+        iv = implied_volatility(price, self.spot, strike, years, is_call)
+        delta, gamma, vega, theta = greeks(self.spot, strike, years, iv, is_call)
+        for name, values in (("iv", iv), ("delta", delta), ("gamma", gamma), ("vega", vega), ("theta", theta),
+                             ("years", years)):
+            arrays[name][todo] = values
+        arrays["spot"][todo] = self.spot
+        arrays["solved_ltp"][todo] = price
+        self.recomputed += len(todo)
+        return len(todo)
+
+    def update_from_batch(self, batch, now=None):
+        """Update from a decoded TickBatch; the underlying's LTP in the same frame is used first."""
+        spot = None
+        option_keys, option_ltps = [], []
+        ltps = batch.ltp.tolist()
+        for key, ltp in zip(batch.keys, ltps):
+            if key == self.underlying_key:
+                spot = ltp
+            elif key.startswith("NSE_FO|"):
+                option_keys.append(key)
+                option_ltps.append(ltp)
+        return self.update(option_keys, option_ltps, spot, now)
+
+    def table(self):
+        """{instrument_key, strike, option_type, expiry, iv, delta, gamma, vega, theta} columns for the chain."""
+        n = len(self.keys)
+        data = {name: self.arrays[name][:n].copy() for name in self.COLUMNS if name != "solved_ltp"}
+        data.update(instrument_key=list(self.keys), strike=self.strike[:n].copy(),
+                    option_type=np.where(self.is_call[:n], "CE", "PE"), expiry=list(self.expiry[:n]))
+        return data
+
+
+def _scalar_iv(price, spot, strike, years, is_call):
+    """Reference per-option Newton/bisection solve, used by the benchmark."""
+    return float(implied_volatility(np.array([price]), spot, np.array([strike]), np.array([years]),
+                                    np.array([is_call]))[0])
+
+
+def benchmark(strikes=200, ticks=50, seed=5):
+    """Compare batched vs per-option solves on a synthetic chain and check the round trip."""
+    rng = np.random.default_rng(seed)
+    spot = 23000.0
+    strike = np.repeat(spot + (np.arange(strikes) - strikes // 2) * 50.0, 2)
+    is_call = np.tile([True, False], strikes)
+    years = np.full(len(strike), 7 / 365.0)
+    true_iv = 0.12 + 0.0000004 * (strike - spot) ** 2 / 100 + rng.uniform(0, 0.02, len(strike))
+    price = bs_price(spot, strike, years, true_iv, is_call)
+
+    started = time.perf_counter()
+    for _ in range(ticks):
+        iv = implied_volatility(price, spot, strike, years, is_call)
+    batched = (time.perf_counter() - started) / ticks
+
+    started = time.perf_counter()
+    for i in range(len(price)):
+        _scalar_iv(price[i], spot, strike[i], years[i], is_call[i])
+    scalar = time.perf_counter() - started
+
+    solvable = ~np.isnan(iv)
+    error = np.nanmax(np.abs(iv[solvable] - true_iv[solvable]))
+    print(f"{len(price)} options: batched {batched * 1000:.2f} ms/chain, per-option {scalar * 1000:.1f} ms/chain "
+          f"({scalar / batched:.0f}x), {solvable.sum()} solved, max IV error {error:.2e}")
+    return error
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Option chain IV and Greeks")
+    parser.add_argument("command", choices=("bench", "watch"))
+    parser.add_argument("--strikes", type=int, default=200, help="Synthetic strikes for bench")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between refreshes for watch")
+    args = parser.parse_args(argv)
+
+    if args.command == "bench":
+        benchmark(args.strikes)
+        return 0
+
+    # Read the live chain from websocket_market_data's shared state store
+    from market_state import MARKET_STATE_SHM, MarketStateStore
+    from instrument_master import get_instrument_master
+    if not MARKET_STATE_SHM:
+        print("Set MARKET_STATE_SHM to the segment published by websocket_market_data")
+        return 1
+    store = MarketStateStore.attach(MARKET_STATE_SHM)
+    analytics = ChainAnalytics(get_instrument_master())
+    try:
+        while True:
+            snapshot = store.snapshot(("ltp",))
+            if snapshot is None or store.replaced():
+                print("Market state segment is stale or gone; re-attaching")
+                time.sleep(args.interval)
+                try:
+                    replacement = MarketStateStore.attach(MARKET_STATE_SHM)
+                except (FileNotFoundError, ValueError):
+                    continue
+                store.close()
+                store = replacement
+                continue
+            keys, data = snapshot
+            ltp = dict(zip(keys, data["ltp"].tolist()))
+            option_keys = [key for key in keys if key.startswith("NSE_FO|")]
+            started = time.perf_counter()
+            solved = analytics.update(option_keys, [ltp[key] for key in option_keys], ltp.get(analytics.underlying_key))
+            elapsed = (time.perf_counter() - started) * 1000
+            table = analytics.table()
+            order = np.argsort(table["strike"], kind="stable")
+            print(f"Spot {analytics.spot}: re-solved {solved} of {len(analytics.keys)} contracts in {elapsed:.2f} ms")
+            for i in order.tolist():
+                print(f"  {table['instrument_key'][i]:<28} IV {table['iv'][i] * 100:6.2f}%  "
+                      f"delta {table['delta'][i]:+.3f}  gamma {table['gamma'][i]:.5f}  "
+                      f"vega {table['vega'][i]:.2f}  theta {table['theta'][i]:.2f}")
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
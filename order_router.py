@@ -0,0 +1,223 @@
+import time
+import logging
+import queue
+import asyncio
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import urllib3
+from psycopg2.extras import execute_values
+from metrics import REGISTRY
+from spool import open_spool
+
+# Upstox order API limits: (requests, per seconds)
+ORDER_RATE_LIMITS = ((50, 1.0), (500, 60.0))
+
+# HTTP statuses worth retrying; anything else is a definitive rejection
+TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+
+STORE_ORDERS_SQL = """
+    INSERT INTO executed_orders (order_time, instrument_key, order_type, quantity, price, order_id, status)
+    VALUES %s
+    ON CONFLICT (order_time, instrument_key) DO UPDATE
+    SET order_id = EXCLUDED.order_id, status = EXCLUDED.status;
+"""
+
+
+def order_payload(instrument_key, signal_type, quantity, tag="PromptTrader"):
+    """Market order request body for the Upstox place-order API."""
+    return {
+        "quantity": quantity,
+        "product": "I",  # Intraday
+        "validity": "DAY",
+        "price": 0,  # Market order
+        "tag": tag,
+        "instrument_token": instrument_key,
+        "order_type": "MARKET",
+        "transaction_type": signal_type,  # BUY or SELL
+        "disclosed_quantity": 0,
+        "trigger_price": 0,
+        "is_amo": False
+    }
+
+
+def order_tag(signal_id):
+    """Idempotency tag for the order placed for a signal."""
+    return f"PT{signal_id}"
+
+
+def is_transient(error):
+    """True for errors where the order may or may not have reached the broker."""
+    status = getattr(error, "status", None)
+    if status:
+        return status in TRANSIENT_STATUSES
+    return isinstance(error, (urllib3.exceptions.HTTPError, OSError))
+
+
+class TokenBucket:
+    """Asyncio token bucket: ``rate`` tokens per second, up to ``capacity`` banked."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OrderRouter:
+    """Submit orders concurrently through one SDK client under the broker's rate limits.
+
+    The SDK client's urllib3 pool is shared by ``concurrency`` worker threads,
+    so connections are reused across orders. Transient failures are retried
+    with backoff, but only after checking the order book for the order's tag
+    so a request that did reach the broker is never placed twice.
+    """
+
+    def __init__(self, order_api, limits=ORDER_RATE_LIMITS, concurrency=16, max_retries=3, backoff=0.2):
+        self.order_api = order_api
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.buckets = [TokenBucket(count / period, count) for count, period in limits]
+        self.place_latency = REGISTRY.histogram("order_place_seconds", "Order placement including retries")
+        self.throttle_wait = REGISTRY.histogram("order_throttle_wait_seconds", "Time spent waiting on rate limits")
+        self.retries = REGISTRY.counter("order_retries_total", "Transient order errors retried")
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="order-router")
+
+    async def _call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    async def _throttle(self):
+        started = time.perf_counter()
+        for bucket in self.buckets:
+            await bucket.acquire()
+        self.throttle_wait.observe(time.perf_counter() - started)
+
+    async def find_by_tag(self, tag):
+        """Return (order_id, status) of an order already carrying tag, or None."""
+        await self._throttle()
+        response = await self._call(self.order_api.get_order_book, api_version="2.0")
+        for order in response.data or []:
+            if order.tag == tag:
+                return order.order_id, order.status
+        return None
+
+    async def place(self, order_data, tag):
+        """Place one order; returns (order_id, status), (None, 'REJECTED') on failure.
+
+        (None, 'UNKNOWN') means transient errors ran out the retries and the
+        order book did not show the tag: the order may still be live.
+        """
+        started = time.perf_counter()
+        order_id, status = await self._place(dict(order_data, tag=tag), tag)
+        self.place_latency.observe(time.perf_counter() - started)
+        REGISTRY.counter("orders_total", "Orders by final status", status=status or "UNKNOWN").inc()
+        return order_id, status
+
+    async def _place(self, order_data, tag):
+        for attempt in range(self.max_retries + 1):
+            await self._throttle()
+            try:
+                response = await self._call(self.order_api.place_order, order_data, api_version="2.0")
+                return response.data.order_id, response.data.status
+            except Exception as e:
+                if not is_transient(e):
+                    log_msg = f"Error placing order {tag} for {order_data['instrument_token']}: {e}"
+                    print(log_msg)
+                    logging.error(log_msg)
+                    return None, "REJECTED"
+                print(f"Transient error placing order {tag} (attempt {attempt + 1}): {e}")
+            # The failed request may still have reached the broker: look for it before retrying or giving up
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+            try:
+                existing = await self.find_by_tag(tag)
+            except Exception as e:
+                print(f"Error checking order book for {tag}: {e}")
+                existing = None
+            if existing is not None:
+                return existing
+            if attempt < self.max_retries:
+                self.retries.inc()
+        log_msg = f"Order {tag} for {order_data['instrument_token']} not confirmed after {self.max_retries + 1} attempts"
+        print(log_msg)
+        logging.error(log_msg)
+        return None, "UNKNOWN"
+
+    def close(self):
+        self._executor.shutdown()
+
+
+class OrderRecorder:
+    """Persist order results from a background thread in batched upserts.
+
+    With ``spool_name`` each result is appended to that write-ahead spool and
+    its drainer does the upserts, retrying until the database accepts them;
+    otherwise results are queued in memory and dropped on database errors.
+    """
+
+    def __init__(self, pool, batch_size=100, flush_interval=0.2, spool_name=None):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self.errors = REGISTRY.counter("db_errors_total", "Database errors", component="order_recorder")
+        REGISTRY.gauge("order_recorder_queue_depth", "Order results waiting to be stored", fn=self._queue.qsize)
+        self.spool, self.drainer = open_spool(spool_name, self._store) if spool_name else (None, None)
+        self._thread = threading.Thread(target=self._run, name="order-recorder", daemon=True)
+        if self.spool is None:
+            self._thread.start()
+
+    def record(self, row):
+        """Queue an executed_orders row; returns immediately."""
+        if self.spool is not None:
+            self.spool.append(row)
+        else:
+            self._queue.put(row)
+
+    def close(self):
+        if self.spool is not None:
+            self.drainer.close()
+            self.spool.close()
+        else:
+            self._queue.put(None)
+            self._thread.join()
+
+    def _store(self, rows):
+        """Upsert rows in one statement (the last row per order wins); raises on database errors."""
+        rows = list({(row[0], row[1]): row for row in rows}.values())
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            execute_values(cursor, STORE_ORDERS_SQL, rows)
+
+    def _write(self, rows):
+        try:
+            self._store(rows)
+        except Exception as e:
+            self.errors.inc()
+            print(f"Database error storing {len(rows)} orders: {e}")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            rows = []
+            try:
+                row = self._queue.get(timeout=self.flush_interval)
+                while row is not None:
+                    rows.append(row)
+                    if len(rows) >= self.batch_size:
+                        break
+                    row = self._queue.get_nowait()
+                stopping = row is None
+            except queue.Empty:
+                pass
+            if rows:
+                self._write(rows)
@@ -0,0 +1,351 @@
+import os
+import sys
+import time
+import argparse
+import threading
+from collections import deque
+from types import SimpleNamespace
+from datetime import date, datetime, timedelta
+import numpy as np
+from metrics import REGISTRY
+from options_analytics import IST, bs_price, implied_volatility, greeks, years_to_expiry
+
+# Pre-trade limits; an order that reduces an existing exposure is always allowed
+RISK_MAX_LOTS_PER_INSTRUMENT = int(os.getenv("RISK_MAX_LOTS_PER_INSTRUMENT", "10"))
+RISK_MAX_NET_DELTA = float(os.getenv("RISK_MAX_NET_DELTA", "1500"))  # in units of the underlying
+
+# Order-rate caps: orders per RISK_RATE_WINDOW seconds, across the book and per instrument
+RISK_RATE_WINDOW = float(os.getenv("RISK_RATE_WINDOW", "60"))
+RISK_MAX_ORDERS_PER_WINDOW = int(os.getenv("RISK_MAX_ORDERS_PER_WINDOW", "200"))
+RISK_MAX_INSTRUMENT_ORDERS_PER_WINDOW = int(os.getenv("RISK_MAX_INSTRUMENT_ORDERS_PER_WINDOW", "5"))
+
+# Seconds between background re-solves of the per-unit delta of every open position
+RISK_DELTA_REFRESH = float(os.getenv("RISK_DELTA_REFRESH", "1.0"))
+
+# A signal repeating the same instrument and side within this many seconds is suppressed
+RISK_DUPLICATE_WINDOW = float(os.getenv("RISK_DUPLICATE_WINDOW", "300"))
+
+# executed_orders statuses that never reached a position
+INACTIVE_STATUSES = ("REJECTED", "RISK_REJECTED", "CANCELLED")
+
+SEED_POSITIONS_SQL = """
+    SELECT instrument_key, SUM(CASE WHEN order_type = 'BUY' THEN quantity ELSE -quantity END)
+    FROM executed_orders
+    WHERE order_time >= %s AND UPPER(COALESCE(status, 'PENDING')) NOT IN %s
+    GROUP BY instrument_key;
+"""
+
+
+class RiskLimits:
+    """Limits checked by RiskEngine; defaults come from the RISK_* environment variables."""
+
+    def __init__(self, max_lots=RISK_MAX_LOTS_PER_INSTRUMENT, max_net_delta=RISK_MAX_NET_DELTA,
+                 rate_window=RISK_RATE_WINDOW, max_orders=RISK_MAX_ORDERS_PER_WINDOW,
+                 max_instrument_orders=RISK_MAX_INSTRUMENT_ORDERS_PER_WINDOW,
+                 duplicate_window=RISK_DUPLICATE_WINDOW):
+        self.max_lots = max_lots
+        self.max_net_delta = max_net_delta
+        self.rate_window = rate_window
+        self.max_orders = max_orders
+        self.max_instrument_orders = max_instrument_orders
+        self.duplicate_window = duplicate_window
+
+
+class MarketDelta:
+    """Per-unit option deltas from the shared market state, solved for a whole chain in one batch.
+
+    IV is solved from each contract's and the underlying's latest LTPs, so
+    there is no database or broker call. ``store_fn`` returns the current
+    MarketStateStore (or None), so a re-attached store is picked up.
+    Contracts without metadata, or whose price (or the underlying's) is
+    missing or older than ``max_age`` seconds, are left out of the result.
+    """
+
+    def __init__(self, store_fn, instruments, underlying_key="NSE_INDEX|Nifty 50", max_age=None):
+        from market_state import MARKET_STATE_MAX_AGE
+        self.store_fn = store_fn
+        self.instruments = instruments
+        self.underlying_key = underlying_key
+        self.max_age = MARKET_STATE_MAX_AGE if max_age is None else max_age
+
+    def __call__(self, instrument_keys=None):
+        """{instrument_key: per-unit delta} for the given contracts (default: every one in the store)."""
+        store = self.store_fn()
+        snapshot = store.snapshot(("ltp", "updated_ns")) if store is not None else None
+        if snapshot is None:
+            return {}
+        keys, data = snapshot
+        fresh = (data["updated_ns"] >= time.time_ns() - self.max_age * 1e9) & (data["ltp"] > 0)
+        ltp = {key: price for key, price, ok in zip(keys, data["ltp"].tolist(), fresh.tolist()) if ok}
+        spot = ltp.get(self.underlying_key)
+        if not spot:
+            return {}
+        now = datetime.now(IST)
+        contracts = []
+        for key in (ltp if instrument_keys is None else instrument_keys):
+            price = ltp.get(key)
+            strike, option_type, expiry = self.instruments.option_fields(key)
+            if price and option_type in ("CE", "PE") and expiry is not None:
+                contracts.append((key, price, strike, years_to_expiry(expiry, now), option_type == "CE"))
+        if not contracts:
+            return {}
+        keys, price, strike, years, is_call = zip(*contracts)
+        strike, years, is_call = np.array(strike, dtype=np.float64), np.array(years), np.array(is_call)
+        iv = implied_volatility(np.array(price, dtype=np.float64), spot, strike, years, is_call)
+        delta = greeks(spot, strike, years, iv, is_call)[0]
+        return {key: float(d) for key, d in zip(keys, delta.tolist()) if not np.isnan(d)}
+
+
+class RiskEngine:
+    """In-memory position book with pre-trade checks on the order hot path.
+
+    Positions are signed quantities per instrument. They are seeded once from
+    today's executed_orders and then kept current by ``reserve`` (an order is
+    about to be sent) and ``release`` (it was rejected). Market orders are
+    assumed to fill in full. Every check reads only in-memory state.
+
+    Limits are checked in order: duplicate signal, order rate, lots per
+    instrument, then net delta. The net delta is kept as a running sum of
+    per-unit delta times position, so a check costs the same however many
+    positions are open. Per-unit deltas for the whole chain come from
+    ``delta_fn()`` (see MarketDelta), called by a background thread every
+    ``refresh_interval`` seconds and never on the order path. Where it has
+    no delta, options count as +1 (CE) or -1 (PE) per unit, which is the
+    most an option can contribute.
+    """
+
+    def __init__(self, instruments, limits=None, delta_fn=None, refresh_interval=RISK_DELTA_REFRESH):
+        self.instruments = instruments
+        self.limits = limits or RiskLimits()
+        self.delta_fn = delta_fn
+        self.refresh_interval = refresh_interval
+        self.positions = {}
+        self._unit_delta = {}  # per-unit delta by instrument, from the last refresh
+        self._net_delta = 0.0
+        self._orders = deque()
+        self._instrument_orders = {}
+        self._last_signal = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.check_latency = REGISTRY.histogram("risk_check_seconds", "Pre-trade risk check")
+        self.refresh_latency = REGISTRY.histogram("risk_delta_refresh_seconds", "Re-solving open position deltas")
+        REGISTRY.gauge("risk_net_delta", "Net delta of the position book", fn=self.net_delta)
+
+    def seed(self, conn, since):
+        """Load net positions from executed_orders rows at or after ``since``; returns the instrument count."""
+        with conn.cursor() as cursor:
+            cursor.execute(SEED_POSITIONS_SQL, (since, INACTIVE_STATUSES))
+            rows = cursor.fetchall()
+        with self._lock:
+            self.positions = {key: int(quantity) for key, quantity in rows if quantity}
+            self._unit_delta = {}
+        self.refresh_deltas()
+        return len(self.positions)
+
+    def _fallback_delta(self, instrument_key):
+        option_type = self.instruments.option_fields(instrument_key)[1]
+        return -1.0 if option_type == "PE" else 1.0
+
+    def _delta(self, instrument_key):
+        delta = self._unit_delta.get(instrument_key)
+        return delta if delta is not None else self._fallback_delta(instrument_key)
+
+    def net_delta(self):
+        return self._net_delta
+
+    def refresh_deltas(self):
+        """Re-solve per-unit deltas for the chain and rebuild the net delta from them."""
+        started = time.perf_counter()
+        unit = self.delta_fn() if self.delta_fn is not None else {}
+        with self._lock:
+            previous = self._unit_delta
+            for key in self.positions:
+                # An open position that could not be priced this time keeps its last delta
+                if key not in unit and key in previous:
+                    unit[key] = previous[key]
+            self._unit_delta = unit
+            self._net_delta = sum(self._delta(key) * quantity for key, quantity in self.positions.items())
+        self.refresh_latency.observe(time.perf_counter() - started)
+
+    def start(self):
+        """Refresh position deltas from a background thread until ``close``."""
+        if self.delta_fn is not None and self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, name="risk-deltas", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _refresh_loop(self):
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                self.refresh_deltas()
+            except Exception as e:
+                print(f"Error refreshing position deltas: {e}")
+
+    def _expire(self, now):
+        window = self.limits.rate_window
+        orders = self._orders
+        while orders and now - orders[0][0] >= window:
+            _, key = orders.popleft()
+            recent = self._instrument_orders[key]
+            recent.popleft()
+            if not recent:
+                del self._instrument_orders[key]
+
+    def _reason(self, instrument_key, side, quantity, now):
+        limits = self.limits
+        last = self._last_signal.get((instrument_key, side))
+        if last is not None and now - last < limits.duplicate_window:
+            return "duplicate"
+        self._expire(now)
+        if len(self._orders) >= limits.max_orders:
+            return "order_rate"
+        if len(self._instrument_orders.get(instrument_key, ())) >= limits.max_instrument_orders:
+            return "instrument_order_rate"
+
+        signed = quantity if side == "BUY" else -quantity
+        current = self.positions.get(instrument_key, 0)
+        after = current + signed
+        if abs(after) > abs(current):
+            lot_size = self.instruments.lot_size(instrument_key)
+            if abs(after) > limits.max_lots * lot_size:
+                return "max_lots"
+            delta = self._net_delta
+            new_delta = delta + self._delta(instrument_key) * signed
+            if abs(new_delta) > limits.max_net_delta and abs(new_delta) > abs(delta):
+                return "net_delta"
+        return None
+
+    def _move(self, instrument_key, signed):
+        remaining = self.positions.get(instrument_key, 0) + signed
+        if remaining:
+            self.positions[instrument_key] = remaining
+        else:
+            self.positions.pop(instrument_key, None)
+        self._net_delta += self._delta(instrument_key) * signed
+
+    def check(self, instrument_key, side, quantity, now=None):
+        """Reason the order would be refused, or None; does not change the book."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return self._reason(instrument_key, side, quantity, now)
+
+    def reserve(self, instrument_key, side, quantity, now=None):
+        """Check an order and, if allowed, add it to the book; returns the refusal reason or None."""
+        started = time.perf_counter()
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            reason = self._reason(instrument_key, side, quantity, now)
+            if reason is None:
+                self._move(instrument_key, quantity if side == "BUY" else -quantity)
+                self._orders.append((now, instrument_key))
+                self._instrument_orders.setdefault(instrument_key, deque()).append(now)
+                self._last_signal[(instrument_key, side)] = now
+        self.check_latency.observe(time.perf_counter() - started)
+        if reason is not None:
+            REGISTRY.counter("risk_rejections_total", "Orders refused by pre-trade checks", reason=reason).inc()
+        return reason
+
+    def release(self, instrument_key, side, quantity):
+        """Take a reserved order that the broker rejected back out of the position book."""
+        with self._lock:
+            self._move(instrument_key, -quantity if side == "BUY" else quantity)
+
+
+class _SyntheticChain:
+    """Lot sizes and option fields for the benchmark's made-up weekly chain around ``spot``."""
+
+    def __init__(self, keys, spot, expiry, lot_size=75):
+        self.lot = lot_size
+        self.fields = {
+            key: (spot + (i // 2 - len(keys) // 4) * 50.0, "CE" if i % 2 == 0 else "PE", expiry)
+            for i, key in enumerate(keys)
+        }
+
+    def lot_size(self, instrument_key):
+        return self.lot
+
+    def option_fields(self, instrument_key):
+        return self.fields.get(instrument_key, (None, None, None))
+
+
+def _chain_state(chain, spot, seed):
+    """In-process MarketStateStore holding priced ticks for the synthetic chain and its index."""
+    from market_state import MarketStateStore
+    rng = np.random.default_rng(seed)
+    keys = list(chain.fields)
+    strike = np.array([chain.fields[key][0] for key in keys])
+    is_call = np.array([chain.fields[key][1] == "CE" for key in keys])
+    years = np.full(len(keys), years_to_expiry(chain.fields[keys[0]][2], datetime.now(IST)))
+    price = np.maximum(bs_price(spot, strike, years, rng.uniform(0.11, 0.16, len(keys)), is_call), 0.05)
+    store = MarketStateStore(capacity=len(keys) + 1)
+    count, depth = len(keys) + 1, store.depth
+    ltp = np.append(price, spot)
+    counts, levels = np.zeros(count, dtype=np.int64), np.zeros((count, depth))
+    store.update(SimpleNamespace(
+        keys=keys + ["NSE_INDEX|Nifty 50"], ltp=ltp, ltt=counts, volume=counts, last_close=ltp, oi=counts,
+        bid_price=levels, bid_qty=levels.astype(np.int64), ask_price=levels, ask_qty=levels.astype(np.int64)
+    ), time.time_ns())
+    return store
+
+
+def benchmark(orders=100000, instruments=400, positions=50, seed=11):
+    """Time reserve() for a burst of orders against a book with open positions.
+
+    Deltas come from MarketDelta over a populated MarketStateStore, and the
+    background refresh runs during the burst as it does in trade_execution.
+    """
+    rng = np.random.default_rng(seed)
+    spot = 23000.0
+    keys = [f"NSE_FO|{40000 + i}" for i in range(instruments)]
+    chain = _SyntheticChain(keys, spot, date.today() + timedelta(days=7))
+    store = _chain_state(chain, spot, seed)
+    # Rate and duplicate limits are opened up so every order runs the full lots and net delta checks
+    limits = RiskLimits(max_orders=orders, max_instrument_orders=orders, duplicate_window=0.0)
+    engine = RiskEngine(chain, limits, delta_fn=MarketDelta(lambda: store, chain), refresh_interval=0.05)
+    engine.positions = {key: 75 * int(rng.integers(-5, 6)) for key in keys[:positions]}
+    engine.positions = {key: quantity for key, quantity in engine.positions.items() if quantity}
+    engine.refresh_deltas()
+    engine.start()
+
+    picks = rng.integers(0, instruments, orders).tolist()
+    sides = rng.integers(0, 2, orders).tolist()
+    latencies = np.empty(orders, dtype=np.int64)
+    reasons = {}
+    now = 1000.0
+    for i in range(orders):
+        started = time.perf_counter_ns()
+        reason = engine.reserve(keys[picks[i]], "BUY" if sides[i] else "SELL", 75, now=now)
+        latencies[i] = time.perf_counter_ns() - started
+        reasons[reason] = reasons.get(reason, 0) + 1
+        now += 1e-5  # 100k orders/s
+    engine.close()
+    store.close()
+    p50, p99, p999 = np.percentile(latencies, (50, 99, 99.9)) / 1000.0
+    print(
+        f"{orders} orders over {instruments} instruments ({len(engine.positions)} open positions): "
+        f"p50 {p50:.2f} us, p99 {p99:.2f} us, p99.9 {p999:.2f} us, max {latencies.max() / 1000.0:.1f} us"
+    )
+    print(f"Background delta refresh: {engine.refresh_latency.summary()}")
+    print("Outcomes: " + ", ".join(f"{reason or 'allowed'} {count}" for reason, count in sorted(
+        reasons.items(), key=lambda item: -item[1])))
+    return p99
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-trade risk check benchmark")
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--instruments", type=int, default=400)
+    parser.add_argument("--positions", type=int, default=50, help="Open positions at the start of the burst")
+    args = parser.parse_args(argv)
+    benchmark(args.orders, args.instruments, args.positions)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
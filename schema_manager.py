@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import time
+import argparse
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from db import db_params
+
+# Storage settings for the market_data hypertable (PostgreSQL interval strings; empty disables)
+storage_settings = {
+    "chunk_interval": os.getenv("MARKET_DATA_CHUNK_INTERVAL", "1 day"),
+    "compress_after": os.getenv("MARKET_DATA_COMPRESS_AFTER", "2 days"),
+    "retention": os.getenv("MARKET_DATA_RETENTION", ""),  # opt-in: a policy permanently drops old ticks
+    "tiering_after": os.getenv("MARKET_DATA_TIERING_AFTER", "")  # Timescale Cloud tiered storage only
+}
+
+# Continuous aggregates read raw ticks this far back on refresh; retention must keep them
+LONGEST_REFRESH_WINDOW = "1 day"
+
+
+def _scalar(cursor, sql, params=None):
+    cursor.execute(sql, params)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def primary_key_columns(cursor, table="market_data"):
+    """Return the primary key columns of a table in index order."""
+    cursor.execute("""
+        SELECT a.attname
+        FROM pg_index i
+        JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord) ON TRUE
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+        ORDER BY k.ord;
+    """, (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def compression_enabled(cursor, table="market_data"):
+    return bool(_scalar(cursor, """
+        SELECT compression_enabled FROM timescaledb_information.hypertables
+        WHERE hypertable_name = %s;
+    """, (table,)))
+
+
+def storage_report(cursor, table="market_data"):
+    """Size, chunk and compression figures for a hypertable."""
+    cursor.execute("""
+        SELECT table_bytes, index_bytes, toast_bytes, total_bytes
+        FROM hypertable_detailed_size(%s);
+    """, (table,))
+    table_bytes, index_bytes, toast_bytes, total_bytes = cursor.fetchone()
+    report = {
+        "table": table,
+        "table_bytes": table_bytes,
+        "index_bytes": index_bytes,
+        "toast_bytes": toast_bytes,
+        "total_bytes": total_bytes,
+        "chunks": _scalar(cursor, """
+            SELECT count(*) FROM timescaledb_information.chunks WHERE hypertable_name = %s;
+        """, (table,)),
+        "compressed_chunks": _scalar(cursor, """
+            SELECT count(*) FROM timescaledb_information.chunks
+            WHERE hypertable_name = %s AND is_compressed;
+        """, (table,)),
+        "primary_key": primary_key_columns(cursor, table)
+    }
+    if compression_enabled(cursor, table):
+        cursor.execute("""
+            SELECT before_compression_total_bytes, after_compression_total_bytes
+            FROM hypertable_compression_stats(%s);
+        """, (table,))
+        before, after = cursor.fetchone()
+        report["compression_ratio"] = before / after if before and after else None
+    return report
+
+
+def print_report(label, report):
+    mb = 1024 * 1024
+    ratio = report.get("compression_ratio")
+    print(
+        f"{label}: {report['total_bytes'] / mb:.1f} MB total "
+        f"({report['table_bytes'] / mb:.1f} MB heap, {report['index_bytes'] / mb:.1f} MB indexes), "
+        f"{report['chunks']} chunks ({report['compressed_chunks']} compressed"
+        f"{f', {ratio:.1f}x' if ratio else ''}), primary key {tuple(report['primary_key'])}"
+    )
+
+
+def migrate(cursor, settings=storage_settings):
+    """Bring market_data to the configured layout; safe to run repeatedly."""
+    # Per-instrument scans and the tick upsert share one (instrument_key, time) primary key,
+    # which makes the separate idx_instrument_key redundant
+    if primary_key_columns(cursor) != ["instrument_key", "time"]:
+        if compression_enabled(cursor):
+            print("Skipping primary key change: compression is already enabled on market_data")
+        else:
+            print("Rebuilding market_data primary key as (instrument_key, time)")
+            cursor.execute("""
+                ALTER TABLE market_data DROP CONSTRAINT IF EXISTS market_data_pkey;
+                ALTER TABLE market_data ADD CONSTRAINT market_data_pkey PRIMARY KEY (instrument_key, time);
+            """)
+    cursor.execute("DROP INDEX IF EXISTS idx_instrument_key;")
+
+    if settings["chunk_interval"]:
+        cursor.execute("SELECT set_chunk_time_interval('market_data', %s::interval);", (settings["chunk_interval"],))
+
+    if settings["compress_after"]:
+        if not compression_enabled(cursor):
+            cursor.execute("""
+                ALTER TABLE market_data SET (
+                    timescaledb.compress,
+                    timescaledb.compress_segmentby = 'instrument_key',
+                    timescaledb.compress_orderby = 'time DESC'
+                );
+            """)
+        cursor.execute("SELECT remove_compression_policy('market_data', if_exists => TRUE);")
+        cursor.execute(
+            "SELECT add_compression_policy('market_data', compress_after => %s::interval);",
+            (settings["compress_after"],)
+        )
+        # Compress chunks that are already old enough instead of waiting for the policy job
+        cursor.execute("""
+            SELECT compress_chunk(chunk, if_not_compressed => TRUE)
+            FROM show_chunks('market_data', older_than => %s::interval) AS chunk;
+        """, (settings["compress_after"],))
+
+    # Without a configured retention any existing policy is left as it is
+    if settings["retention"]:
+        too_short = _scalar(cursor, "SELECT %s::interval <= %s::interval;", (settings["retention"], LONGEST_REFRESH_WINDOW))
+        if too_short:
+            raise ValueError(f"Retention {settings['retention']} must exceed the aggregate refresh window {LONGEST_REFRESH_WINDOW}")
+        cursor.execute("SELECT remove_retention_policy('market_data', if_exists => TRUE);")
+        cursor.execute(
+            "SELECT add_retention_policy('market_data', drop_after => %s::interval);",
+            (settings["retention"],)
+        )
+
+    if settings["tiering_after"]:
+        cursor.execute("SELECT remove_tiering_policy('market_data', if_exists => TRUE);")
+        cursor.execute(
+            "SELECT add_tiering_policy('market_data', move_after => %s::interval);",
+            (settings["tiering_after"],)
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage market_data chunking, compression and retention")
+    parser.add_argument("--report-only", action="store_true", help="Print the storage report without migrating")
+    parser.add_argument("--report-file", help="Append before/after reports as JSON lines")
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(**db_params)
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    cursor = conn.cursor()
+
+    reports = [("before", storage_report(cursor))]
+    print_report("Before", reports[0][1])
+    if not args.report_only:
+        started = time.perf_counter()
+        migrate(cursor)
+        print(f"Migration finished in {time.perf_counter() - started:.1f} s")
+        reports.append(("after", storage_report(cursor)))
+        print_report("After", reports[1][1])
+
+    if args.report_file:
+        with open(args.report_file, "a") as f:
+            for label, report in reports:
+                f.write(json.dumps({"label": label, "at": time.time(), "settings": storage_settings, **report}) + "\n")
+
+    cursor.close()
+    conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import select
+from datetime import timedelta
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from metrics import REGISTRY
+from market_history import BAR_VIEWS
+
+# LISTEN/NOTIFY channel raised by store_signals when new signals commit
+SIGNAL_CHANNEL = "trading_signals"
+
+# Fallback poll so a missed notification delays delivery by at most this long
+IDLE_RECHECK_SECONDS = 5.0
+
+NOTIFY_SQL = "SELECT pg_notify(%s, %s);"
+
+# Every transaction inserting trading_signals takes this advisory lock first (held until commit),
+# so signal ids commit in increasing order and the consumer's high-water mark never skips one
+SIGNAL_WRITER_LOCK = 0x50545347  # "PTSG"
+SIGNAL_WRITER_LOCK_SQL = "SELECT pg_advisory_xact_lock(%s);"
+
+# Signals whose bar started longer ago than this are claimed but never executed: one bar for
+# the bar to complete plus one bar of grace. Cold starts and spool replays store old signals too.
+SIGNAL_MAX_AGE = timedelta(seconds=float(os.getenv(
+    "SIGNAL_MAX_AGE_SECONDS", 2 * BAR_VIEWS[os.getenv("BAR_RESOLUTION", "1m")][1].total_seconds()
+)))
+
+FETCH_SIGNALS_SQL = """
+    SELECT signal_id, signal_time, instrument_key, signal_type, ltp
+    FROM trading_signals
+    WHERE signal_id > %s AND instrument_key LIKE 'NSE_FO%%'
+    ORDER BY signal_id ASC
+    LIMIT %s;
+"""
+
+# New consumers start from signals written in the last five minutes, like the old poller
+INIT_CURSOR_SQL = """
+    INSERT INTO signal_cursor (consumer, last_signal_id)
+    SELECT %s, COALESCE(max(signal_id), 0) FROM trading_signals
+    WHERE signal_time <= now() - INTERVAL '5 minutes'
+    ON CONFLICT (consumer) DO NOTHING;
+"""
+
+ADVANCE_CURSOR_SQL = """
+    UPDATE signal_cursor SET last_signal_id = %s, updated_at = now()
+    WHERE consumer = %s AND last_signal_id < %s;
+"""
+
+
+def notify_payload(max_signal_id):
+    """NOTIFY payload carrying the newest signal id and the publish wall-clock time."""
+    return json.dumps({"max_id": max_signal_id, "published_at": time.time()})
+
+
+class SignalConsumer:
+    """Deliver each committed signal exactly once to a named consumer.
+
+    Signals are read by ``signal_id`` above a durable cursor in
+    ``signal_cursor``. LISTEN/NOTIFY only wakes the consumer; the cursor
+    decides what is new, so late or missed notifications cannot lose or
+    duplicate a signal. This relies on signal ids committing in increasing
+    order: a lower id committing after a higher one was read would be
+    skipped. Writers guarantee it by inserting under SIGNAL_WRITER_LOCK.
+    """
+
+    def __init__(self, db_params, consumer="trade_execution", batch_size=500):
+        self.db_params = db_params
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.latency = REGISTRY.histogram(
+            "signal_submit_latency_seconds", "Signal publish to order submit", consumer=consumer
+        )
+        self.delivered = REGISTRY.counter("signals_delivered_total", "Signals fetched above the cursor", consumer=consumer)
+        self.expired = REGISTRY.counter("signals_expired_total", "Signals claimed too old to execute", consumer=consumer)
+        self.conn = psycopg2.connect(**db_params)
+        with self.conn.cursor() as cursor:
+            cursor.execute(INIT_CURSOR_SQL, (consumer,))
+        self.conn.commit()
+        self._listen_conn = psycopg2.connect(**db_params)
+        self._listen_conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with self._listen_conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {SIGNAL_CHANNEL};")
+
+    def cursor_position(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT last_signal_id FROM signal_cursor WHERE consumer = %s;", (self.consumer,))
+            return cursor.fetchone()[0]
+
+    def fetch_pending(self):
+        """Signals above the cursor, oldest first."""
+        with self.conn.cursor() as cursor:
+            cursor.execute(FETCH_SIGNALS_SQL, (self.cursor_position(), self.batch_size))
+            rows = cursor.fetchall()
+        self.conn.commit()
+        self.delivered.inc(len(rows))
+        return rows
+
+    def claim(self, signal_id, cursor):
+        """Advance the cursor past signal_id inside the caller's transaction.
+
+        Returns False if another run already claimed it, in which case the
+        signal must not be executed.
+        """
+        cursor.execute(ADVANCE_CURSOR_SQL, (signal_id, self.consumer, signal_id))
+        return cursor.rowcount == 1
+
+    def wait(self, timeout=IDLE_RECHECK_SECONDS):
+        """Block until new signals are announced; return their publish time or None."""
+        conn = self._listen_conn
+        if not conn.notifies and select.select([conn], [], [], timeout) == ([], [], []):
+            return None
+        conn.poll()
+        published = None
+        while conn.notifies:
+            payload = conn.notifies.pop(0).payload
+            try:
+                sent = json.loads(payload)["published_at"]
+            except (ValueError, KeyError, TypeError):
+                continue
+            published = sent if published is None else min(published, sent)
+        return published or time.time()
+
+    def signals(self):
+        """Yield (signal_row, published_at) forever, waking on notifications."""
+        published_at = None
+        while True:
+            rows = self.fetch_pending()
+            for row in rows:
+                yield row, published_at
+            published_at = None
+            if len(rows) < self.batch_size:
+                published_at = self.wait()
+
+    def observe_submit(self, published_at):
+        """Record signal-publish to order-submit latency."""
+        if published_at is not None:
+            self.latency.observe(max(time.time() - published_at, 0.0))
+
+    def close(self):
+        self.conn.close()
+        self._listen_conn.close()
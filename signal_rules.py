@@ -0,0 +1,83 @@
+import numpy as np
+from market_history import as_datetime
+
+# Signal thresholds
+RSI_OVERSOLD = 30
+RSI_OVERBOUGHT = 70
+MEDIAN_ATR_WINDOW = 14
+
+
+def compute_indicators(prices, highs, lows, rsi_period=14, macd_fast=12, macd_slow=26, macd_signal=9,
+                       atr_period=14):
+    """Compute RSI, MACD, and ATR indicators using TA-Lib."""
+    if prices is None or len(prices) < 14:
+        return None, None, None, None
+    import talib  # only cold starts and backtests need it; warm runs use IndicatorEngine
+
+    # Compute RSI (14-period by default)
+    rsi = talib.RSI(prices, timeperiod=rsi_period)
+
+    # Compute MACD (12, 26, 9 by default)
+    macd, signal, _ = talib.MACD(prices, fastperiod=macd_fast, slowperiod=macd_slow, signalperiod=macd_signal)
+
+    # Compute ATR (14-period by default)
+    atr = talib.ATR(highs, lows, prices, timeperiod=atr_period)
+
+    return rsi, macd, signal, atr
+
+
+def rolling_median_atr(atr, window=MEDIAN_ATR_WINDOW):
+    """Median of the ``window`` ATR values ending at each bar, 0 until the window fills.
+
+    Matches IndicatorState.median_atr in the streaming path: warm-up NaNs are
+    skipped and the current bar's ATR is part of its own window.
+    """
+    median = np.zeros(len(atr))
+    valid = np.flatnonzero(~np.isnan(atr))
+    if len(valid) >= window:
+        windows = np.lib.stride_tricks.sliding_window_view(atr[valid], window)
+        median[valid[window - 1:]] = np.median(windows, axis=1)
+    return median
+
+
+def detect_signals(rsi, macd, signal, atr, rsi_oversold=RSI_OVERSOLD, rsi_overbought=RSI_OVERBOUGHT,
+                   median_window=MEDIAN_ATR_WINDOW, rolling=False):
+    """Return (buy_indices, sell_indices) of bars that trigger a signal.
+
+    Vectorized form of the per-bar rules: the bar's ATR must exceed the median
+    of the last ``median_window`` ATR values, then BUY needs RSI below the
+    oversold level with MACD crossing above its signal line, and SELL needs RSI
+    above the overbought level with MACD crossing below it. NaN warm-up values
+    compare False exactly as they did in the loop. With ``rolling`` the median
+    trails each bar instead of covering the end of the series, so no bar sees
+    later data (used by the backtester).
+    """
+    if rolling:
+        median_atr = rolling_median_atr(atr, median_window)[1:]
+    else:
+        median_atr = np.median(atr[-median_window:]) if len(atr) >= median_window else 0
+    cur_macd, prev_macd = macd[1:], macd[:-1]
+    cur_signal, prev_signal = signal[1:], signal[:-1]
+    with np.errstate(invalid="ignore"):
+        volatile = ~(atr[1:] <= median_atr)
+        buy = volatile & (rsi[1:] < rsi_oversold) & (cur_macd > cur_signal) & (prev_macd <= prev_signal)
+        sell = volatile & ~buy & (rsi[1:] > rsi_overbought) & (cur_macd < cur_signal) & (prev_macd >= prev_signal)
+    return np.flatnonzero(buy) + 1, np.flatnonzero(sell) + 1
+
+
+def signal_rows(instrument_key, prices, rsi, macd, atr, times, buy_idx, sell_idx):
+    """Build trading_signals rows (in bar order) for the detected indices."""
+    indices = np.concatenate((buy_idx, sell_idx))
+    types = ["BUY"] * len(buy_idx) + ["SELL"] * len(sell_idx)
+    order = np.argsort(indices, kind="stable")
+    idx = indices[order].tolist()
+    return [
+        (as_datetime(times[i]), instrument_key, types[j], float(prices[i]), float(rsi[i]), float(macd[i]), float(atr[i]))
+        for i, j in zip(idx, order.tolist())
+    ]
+
+
+def format_signal(row):
+    """Human-readable log line for a trading_signals row."""
+    _, instrument_key, signal_type, ltp, rsi, macd, atr = row
+    return f"{signal_type} {instrument_key} at {ltp:.2f} (RSI: {rsi:.2f}, MACD: {macd:.2f}, ATR: {atr:.2f})"
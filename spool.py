@@ -0,0 +1,452 @@
+import os
+import sys
+import time
+import zlib
+import pickle
+import struct
+import argparse
+import threading
+from metrics import REGISTRY
+
+# Errors that mean "try again later"; anything else is a problem with the records themselves
+try:
+    from psycopg2 import InterfaceError, OperationalError
+    from db import PoolTimeout
+    TRANSIENT_ERRORS = (OperationalError, InterfaceError, PoolTimeout, OSError)
+except ImportError:
+    TRANSIENT_ERRORS = (OSError,)
+
+# Root of the write-ahead spools (one subdirectory per writer); empty disables spooling
+SPOOL_DIR = os.getenv("SPOOL_DIR", "spool")
+
+# Segment files roll over at this size; drained segments are deleted whole
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+
+# Appends are fsynced together at most this often (seconds)
+SPOOL_FSYNC_INTERVAL = float(os.getenv("SPOOL_FSYNC_INTERVAL", "0.05"))
+
+# Records per bulk load, and the retry backoff while the database is unavailable
+SPOOL_DRAIN_BATCH = int(os.getenv("SPOOL_DRAIN_BATCH", "200"))
+DRAIN_RETRY_MIN_DELAY = 0.5
+DRAIN_RETRY_MAX_DELAY = 30.0
+
+# How long close() keeps draining before leaving the rest for the next start
+SPOOL_CLOSE_TIMEOUT = float(os.getenv("SPOOL_CLOSE_TIMEOUT", "10"))
+
+# Record header: sequence number, payload length, CRC32 of the payload
+_RECORD_HEADER = struct.Struct("<QII")
+
+SEGMENT_SUFFIX = ".seg"
+CURSOR_NAME = "drained"
+
+# Subdirectory of a spool holding records its handler rejected permanently
+DEAD_LETTER_NAME = "dead"
+
+
+def _segment_name(first_seq):
+    return f"{first_seq:020d}{SEGMENT_SUFFIX}"
+
+
+def list_segments(directory):
+    """First sequence number of every segment file in a spool directory, oldest first."""
+    return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+
+def read_cursor(directory):
+    """Last sequence number committed as drained in a spool directory (0 if none)."""
+    try:
+        with open(os.path.join(directory, CURSOR_NAME)) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def last_record_seq(path, first_seq):
+    """Sequence number of the last complete record in a segment, reading record headers only.
+
+    Never modifies the file, so a record a live writer is still appending is
+    simply not counted. Checksums are not verified.
+    """
+    last_seq, offset, size = first_seq - 1, 0, os.path.getsize(path)
+    with open(path, "rb") as f:
+        while offset + _RECORD_HEADER.size <= size:
+            f.seek(offset)
+            seq, length, _ = _RECORD_HEADER.unpack(f.read(_RECORD_HEADER.size))
+            offset += _RECORD_HEADER.size + length
+            if offset > size:
+                break
+            last_seq = seq
+    return last_seq
+
+
+def spool_status(directory):
+    """Segment count, bytes and written/drained sequence numbers of a spool, read-only.
+
+    Safe to run next to the process that owns the spool: unlike opening a
+    ``Spool``, nothing is recovered, truncated or created.
+    """
+    segments = list_segments(directory)
+    drained_seq = read_cursor(directory)
+    written_seq = drained_seq
+    if segments:
+        written_seq = max(written_seq, last_record_seq(os.path.join(directory, _segment_name(segments[-1])),
+                                                        segments[-1]))
+    return {
+        "segments": len(segments),
+        "bytes": sum(os.path.getsize(os.path.join(directory, _segment_name(first))) for first in segments),
+        "written_seq": written_seq,
+        "drained_seq": drained_seq
+    }
+
+
+def scan_segment(path, start=0):
+    """Yield (seq, payload bytes, end offset) for each intact record from ``start``.
+
+    Stops at the first torn (short) record; a checksum mismatch raises ValueError.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return
+            seq, length, crc = _RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            if zlib.crc32(payload) != crc:
+                raise ValueError(f"Checksum mismatch for record {seq} at {path}:{offset}")
+            offset += _RECORD_HEADER.size + length
+            yield seq, payload, offset
+
+
+class Spool:
+    """Append-only, checksummed write-ahead log in numbered segment files.
+
+    ``append`` pickles a record and writes it to the current segment without
+    waiting for the disk; a background thread fsyncs every
+    ``fsync_interval`` so many appends share one fsync. Readers only see
+    records that have been fsynced, in sequence order, and ``commit`` records
+    how far they have been applied so restarts resume there. On open, a torn
+    record at the end of the last segment (a crash mid-write) is cut off.
+    """
+
+    def __init__(self, directory, segment_bytes=SPOOL_SEGMENT_BYTES, fsync_interval=SPOOL_FSYNC_INTERVAL):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = os.path.basename(os.path.normpath(directory))
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+
+        self.drained_seq = read_cursor(directory)
+        last_seq = self.drained_seq
+        segments = self.segments()
+        if segments:
+            last_seq = max(last_seq, self._recover(segments[-1]))
+        self.recovered_seq = last_seq  # records up to here were written by an earlier process
+        self.next_seq = last_seq + 1
+        self.written_seq = last_seq
+        self.synced_seq = last_seq
+
+        if segments and os.path.getsize(self._path(segments[-1])) < segment_bytes:
+            self._file_first = segments[-1]
+            self._file = open(self._path(segments[-1]), "ab")
+            self._file_size = self._file.tell()
+        else:
+            self._file = None
+            self._open_segment(self.next_seq)
+        self._read_segment = None
+        self._read_offset = 0
+        self.read_seq = self.drained_seq  # last record the reader has passed
+
+        labels = {"spool": self.name}
+        self.appended = REGISTRY.counter("spool_records_appended_total", "Records written to the spool", **labels)
+        self.corrupt = REGISTRY.counter("spool_corrupt_records_total", "Spooled records failing their checksum",
+                                        **labels)
+        self.fsync_latency = REGISTRY.histogram("spool_fsync_seconds", "Spool group fsync", **labels)
+        REGISTRY.gauge("spool_pending_records", "Spooled records not yet loaded into the database",
+                       fn=lambda: self.written_seq - self.drained_seq, **labels)
+
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._sync_loop, name=f"spool-{self.name}", daemon=True)
+        self._thread.start()
+
+    def _path(self, first_seq):
+        return os.path.join(self.directory, _segment_name(first_seq))
+
+    def segments(self):
+        """First sequence number of every segment file, oldest first."""
+        return list_segments(self.directory)
+
+    def _recover(self, first_seq):
+        """Truncate a torn tail off a segment; return its last intact sequence number."""
+        path = self._path(first_seq)
+        last_seq, end = first_seq - 1, 0
+        try:
+            for seq, _, offset in scan_segment(path):
+                last_seq, end = seq, offset
+        except ValueError as e:
+            print(f"Spool {self.name}: {e}; truncating the segment there")
+        if end < os.path.getsize(path):
+            with open(path, "r+b") as f:
+                f.truncate(end)
+                os.fsync(f.fileno())
+        return last_seq
+
+    def _open_segment(self, first_seq):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self._file_first = first_seq
+        self._file = open(self._path(first_seq), "ab")
+        self._file_size = 0
+
+    def append(self, record):
+        """Write one record (any picklable object); returns its sequence number."""
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        header_fields = (len(payload), zlib.crc32(payload))
+        with self._lock:
+            seq = self.next_seq
+            self.next_seq += 1
+            if self._file_size >= self.segment_bytes:
+                # The previous segment is fsynced on roll, so everything before seq is durable
+                self._open_segment(seq)
+                self.synced_seq = seq - 1
+                self._synced.notify_all()
+            self._file.write(_RECORD_HEADER.pack(seq, *header_fields))
+            self._file.write(payload)
+            self._file_size += _RECORD_HEADER.size + len(payload)
+            self.written_seq = seq
+        self.appended.inc()
+        return seq
+
+    def sync(self):
+        """Flush and fsync everything appended so far; wakes waiting readers."""
+        with self._lock:
+            target = self.written_seq
+            if target <= self.synced_seq:
+                return
+            self._file.flush()
+            file = self._file
+        started = time.perf_counter()
+        try:
+            os.fsync(file.fileno())
+        except (ValueError, OSError):
+            pass  # rolled (and fsynced) meanwhile
+        self.fsync_latency.observe(time.perf_counter() - started)
+        with self._lock:
+            self.synced_seq = max(self.synced_seq, target)
+            self._synced.notify_all()
+
+    def _sync_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            try:
+                self.sync()
+            except OSError as e:
+                print(f"Spool {self.name}: error syncing: {e}")
+
+    def wait_synced(self, after_seq, timeout):
+        """Block until records after ``after_seq`` are durable or ``timeout`` passes."""
+        with self._lock:
+            if self.synced_seq <= after_seq:
+                self._synced.wait(timeout)
+            return self.synced_seq > after_seq
+
+    def read(self, after_seq, limit):
+        """Up to ``limit`` durable records after ``after_seq`` as (seq, record) pairs.
+
+        Reads continue from where the previous call stopped, so callers must
+        ask for consecutive ranges (retrying a batch means keeping it).
+        """
+        synced = self.synced_seq
+        if synced <= self.read_seq:
+            return []
+        if self._read_segment is None:
+            self._seek(after_seq)
+        records = []
+        while self._read_segment is not None:
+            path = self._path(self._read_segment)
+            exhausted = True
+            try:
+                for seq, payload, offset in scan_segment(path, self._read_offset):
+                    if seq > synced or len(records) >= limit:
+                        exhausted = False
+                        break
+                    self._read_offset = offset
+                    self.read_seq = seq
+                    if seq > after_seq:
+                        records.append((seq, pickle.loads(payload)))
+            except ValueError as e:
+                self.corrupt.inc()
+                print(f"Spool {self.name}: {e}; skipping the rest of the segment")
+                self._read_offset = os.path.getsize(path)
+                self.read_seq = max(self.read_seq, synced)
+            if not exhausted:
+                break
+            later = [first for first in self.segments() if first > self._read_segment]
+            if not later:
+                break
+            self._read_segment, self._read_offset = later[0], 0
+        return records
+
+    def _seek(self, after_seq):
+        segments = self.segments()
+        earlier = [first for first in segments if first <= after_seq + 1]
+        self._read_segment = earlier[-1] if earlier else (segments[0] if segments else None)
+        self._read_offset = 0
+
+    def commit(self, seq):
+        """Record that everything up to ``seq`` is applied; delete segments that are fully drained."""
+        tmp_path = os.path.join(self.directory, CURSOR_NAME + ".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(str(seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.directory, CURSOR_NAME))
+        self.drained_seq = seq
+        segments = self.segments()
+        for first, following in zip(segments, segments[1:]):
+            if following - 1 <= seq and first != self._file_first and first != self._read_segment:
+                os.remove(self._path(first))
+
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+        self.sync()
+        with self._lock:
+            self._file.close()
+
+
+class SpoolDrainer:
+    """Bulk-load spooled records into the database from a background thread.
+
+    ``handler`` receives a list of records and must either apply all of them
+    or raise. On a ``transient`` error (the database is unreachable) the same
+    batch is retried with backoff until the database is back. On any other
+    error the batch is retried one record at a time, and the records that
+    still fail are moved to the spool's dead-letter subdirectory so they do
+    not block the ones behind them. Handlers must be idempotent (upserts),
+    because a crash between the database commit and the cursor update
+    replays the batch.
+    """
+
+    def __init__(self, spool, handler, batch_size=SPOOL_DRAIN_BATCH, name=None, transient=TRANSIENT_ERRORS):
+        self.spool = spool
+        self.handler = handler
+        self.batch_size = batch_size
+        self.name = name or spool.name
+        self.transient = transient
+        self.dead_letters = None  # Spool, opened on the first permanent failure
+        self.errors = REGISTRY.counter("db_errors_total", "Database errors", component=f"spool_{self.name}")
+        self.dead_lettered = REGISTRY.counter("spool_dead_letter_records_total",
+                                              "Spooled records moved aside after a permanent error", spool=self.name)
+        self.load_latency = REGISTRY.histogram("spool_drain_seconds", "Bulk load of one spool batch",
+                                               spool=self.name)
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"spool-drain-{self.name}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        spool = self.spool
+        batch = []
+        delay = DRAIN_RETRY_MIN_DELAY
+        while True:
+            if not batch:
+                batch = spool.read(spool.drained_seq, self.batch_size)
+            if not batch:
+                if self._closing.is_set() and spool.read_seq >= spool.written_seq:
+                    return
+                spool.wait_synced(spool.read_seq, spool.fsync_interval * 4)
+                continue
+            started = time.perf_counter()
+            try:
+                self._load(batch)
+            except self.transient as e:
+                self.errors.inc()
+                print(f"Spool {self.name}: error loading {len(batch)} records, retrying in {delay:.1f} s: {e}")
+                if self._closing.wait(delay):
+                    return
+                delay = min(delay * 2, DRAIN_RETRY_MAX_DELAY)
+                continue
+            self.load_latency.observe(time.perf_counter() - started)
+            spool.commit(batch[-1][0])
+            batch = []
+            delay = DRAIN_RETRY_MIN_DELAY
+
+    def _load(self, batch):
+        """Apply a batch of (seq, record); dead-letter records that fail permanently, raise transient errors."""
+        try:
+            self.handler([record for _, record in batch])
+            return
+        except self.transient:
+            raise
+        except Exception as e:
+            self.errors.inc()
+            if len(batch) == 1:
+                self._dead_letter(batch[0], e)
+                return
+            print(f"Spool {self.name}: batch of {len(batch)} records failed ({e}); loading them one at a time")
+        for item in batch:
+            try:
+                self.handler([item[1]])
+            except self.transient:
+                raise
+            except Exception as e:
+                self._dead_letter(item, e)
+
+    def _dead_letter(self, item, error):
+        seq, record = item
+        if self.dead_letters is None:
+            self.dead_letters = Spool(os.path.join(self.spool.directory, DEAD_LETTER_NAME))
+        self.dead_letters.append((seq, record, repr(error)))
+        self.dead_letters.sync()
+        self.dead_lettered.inc()
+        print(f"Spool {self.name}: record {seq} failed permanently, moved to {self.dead_letters.directory}: {error}")
+
+    def close(self, timeout=SPOOL_CLOSE_TIMEOUT):
+        """Drain what is left (giving up on the first error) for up to ``timeout`` seconds."""
+        self.spool.sync()
+        self._closing.set()
+        self._thread.join(timeout)
+        pending = self.spool.written_seq - self.spool.drained_seq
+        if pending:
+            print(f"Spool {self.name}: {pending} records left for the next start")
+        if self.dead_letters is not None:
+            self.dead_letters.close()
+
+
+def open_spool(name, handler, root=SPOOL_DIR):
+    """Spool and drainer for one writer under ``root``, or (None, None) when spooling is disabled."""
+    if not root:
+        return None, None
+    spool = Spool(os.path.join(root, name))
+    return spool, SpoolDrainer(spool, handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the write-ahead spools (read-only; safe while writers run)")
+    parser.add_argument("--root", default=SPOOL_DIR)
+    args = parser.parse_args(argv)
+    if not args.root or not os.path.isdir(args.root):
+        print(f"No spool directory at {args.root!r}")
+        return 1
+    for name in sorted(os.listdir(args.root)):
+        directory = os.path.join(args.root, name)
+        if not os.path.isdir(directory):
+            continue
+        status = spool_status(directory)
+        print(f"{name}: {status['segments']} segments, {status['bytes'] / 1024 / 1024:.1f} MiB, "
+              f"written up to {status['written_seq']}, drained up to {status['drained_seq']} "
+              f"({status['written_seq'] - status['drained_seq']} pending)")
+        dead_directory = os.path.join(directory, DEAD_LETTER_NAME)
+        if os.path.isdir(dead_directory):
+            print(f"  {spool_status(dead_directory)['written_seq']} dead-lettered records in {dead_directory}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from indicator_engine import IndicatorEngine
+from market_history import BAR_VIEWS
+from metrics import REGISTRY, start_exporters
+import trading_strategy
+
+# Bar columns the strategy reads; time is shared as int64 epoch microseconds
+SHARED_COLUMNS = {"time": "int64", "close": "float64", "high": "float64", "low": "float64"}
+
+
+class SharedHistory:
+    """A chain's bar history packed into one shared-memory block per column.
+
+    Workers attach by name and slice per-instrument views from ``offsets``,
+    so the arrays are never pickled or copied into the pool.
+    """
+
+    def __init__(self, history, keys):
+        self.keys = keys
+        lengths = [len(history[key]["close"]) for key in keys]
+        self.offsets = np.concatenate(([0], np.cumsum(lengths))).astype(int).tolist()
+        total = self.offsets[-1]
+        self.blocks = {}
+        for column, dtype in SHARED_COLUMNS.items():
+            size = max(total * np.dtype(dtype).itemsize, 1)
+            block = shared_memory.SharedMemory(create=True, size=size)
+            self.blocks[column] = block
+            target = np.ndarray(total, dtype=dtype, buffer=block.buf)
+            for key, start, end in zip(keys, self.offsets, self.offsets[1:]):
+                values = history[key][column]
+                target[start:end] = values.view("int64") if column == "time" else values
+
+    def spec(self):
+        """Picklable description workers use to attach."""
+        return {
+            "names": {column: block.name for column, block in self.blocks.items()},
+            "total": self.offsets[-1]
+        }
+
+    def close(self):
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+
+
+def attach(spec):
+    """Map shared columns in a worker; returns (blocks, arrays). Close the blocks when done."""
+    blocks, arrays = {}, {}
+    for column, name in spec["names"].items():
+        block = shared_memory.SharedMemory(name=name)
+        blocks[column] = block
+        array = np.ndarray(spec["total"], dtype=SHARED_COLUMNS[column], buffer=block.buf)
+        arrays[column] = array.view("datetime64[us]") if column == "time" else array
+    return blocks, arrays
+
+
+def make_shards(tasks, lengths, workers):
+    """Split tasks into ``workers`` shards of roughly equal bar counts (largest first)."""
+    shards = [[] for _ in range(workers)]
+    loads = [0] * workers
+    for task, length in sorted(zip(tasks, lengths), key=lambda item: -item[1]):
+        target = loads.index(min(loads))
+        shards[target].append(task)
+        loads[target] += length
+    return [shard for shard in shards if shard]
+
+
+def run_shard(shard_id, spec, tasks):
+    """Evaluate one shard; tasks are (instrument_key, start, end, since, state)."""
+    started = time.perf_counter()
+    blocks, arrays = attach(spec)
+    try:
+        engine = IndicatorEngine()
+        results = []
+        bars = 0
+        series = None
+        for instrument_key, start, end, since, state in tasks:
+            if state is not None:
+                engine.states[instrument_key] = state
+            series = {column: array[start:end] for column, array in arrays.items()}
+            rows = trading_strategy.evaluate_instrument(instrument_key, series, since, engine)
+            results.append((instrument_key, rows, engine.states.get(instrument_key)))
+            bars += end - start
+        # Drop views before closing the mappings
+        del series, arrays
+        return shard_id, results, bars, time.perf_counter() - started
+    finally:
+        for block in blocks.values():
+            block.close()
+
+
+def run(workers=None):
+    """Evaluate the whole chain across a process pool and store the merged signals once."""
+    workers = workers or os.cpu_count() or 1
+    run_started = time.perf_counter()
+    inputs = trading_strategy.load_run_inputs()
+    if inputs is None:
+        return []
+    engine, instruments, watermarks, history, snapshot = inputs
+    fetched = time.perf_counter()
+
+    keys = [key for key in instruments if key in history]
+    for key in instruments:
+        if key not in history:
+            print(f"No data found for {key}")
+    if not keys:
+        return []
+    shared = SharedHistory(history, keys)
+    since_by_key = dict(zip(instruments, watermarks))
+    tasks = [
+        (key, start, end, since_by_key[key], engine.states.get(key))
+        for key, start, end in zip(keys, shared.offsets, shared.offsets[1:])
+    ]
+    shards = make_shards(tasks, [end - start for _, start, end, _, _ in tasks], workers)
+
+    try:
+        if len(shards) == 1:
+            outcomes = [run_shard(0, shared.spec(), shards[0])]
+        else:
+            with ProcessPoolExecutor(max_workers=len(shards)) as pool:
+                futures = [pool.submit(run_shard, i, shared.spec(), shard) for i, shard in enumerate(shards)]
+                outcomes = [future.result() for future in futures]
+    finally:
+        shared.close()
+    evaluated = time.perf_counter()
+
+    # Deterministic merge: independent of shard layout and completion order
+    rows = []
+    for _, results, _, _ in outcomes:
+        for instrument_key, instrument_rows, state in results:
+            rows.extend(instrument_rows)
+            if state is not None:
+                engine.states[instrument_key] = state
+    rows.sort(key=lambda row: (row[0], row[1], row[2]))
+    for signal_msg in trading_strategy.record_signals(rows):
+        print(signal_msg)
+    trading_strategy.save_run_state(engine, snapshot)
+    finished = time.perf_counter()
+
+    shard_latency = REGISTRY.histogram("strategy_shard_seconds", "Wall time per strategy shard")
+    for shard_id, results, bars, elapsed in sorted(outcomes):
+        shard_latency.observe(elapsed)
+        print(f"Shard {shard_id}: {len(results)} instruments, {bars} bars in {elapsed:.3f} s")
+    interval = BAR_VIEWS[trading_strategy.BAR_RESOLUTION][1].total_seconds()
+    total = finished - run_started
+    print(
+        f"{len(keys)} instruments on {len(shards)} workers: fetch {fetched - run_started:.2f} s, "
+        f"evaluate {evaluated - fetched:.2f} s, store {finished - evaluated:.2f} s, total {total:.2f} s "
+        f"({'within' if total < interval else 'over'} the {interval:.0f} s bar interval), {len(rows)} signals"
+    )
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the trading strategy across CPU cores")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+    exporters = start_exporters()
+    trading_strategy.open_signal_spool()
+    try:
+        run(args.workers)
+    finally:
+        trading_strategy.close_signal_spool()
+        for exporter in exporters:
+            exporter.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+import os
+import json
+import random
+import asyncio
+import bisect
+from datetime import date
+import websockets
+from metrics import REGISTRY
+
+# Upstox market data feed limits; override if the account's limits differ
+FEED_MAX_CONNECTIONS = int(os.getenv("FEED_MAX_CONNECTIONS", "2"))
+FEED_KEYS_PER_CONNECTION = int(os.getenv("FEED_KEYS_PER_CONNECTION", "1500"))
+
+# Keys per sub/unsub message, and how long deltas are collected before sending
+SUBSCRIBE_BATCH_SIZE = 500
+DELTA_FLUSH_INTERVAL = 0.5
+
+# Reconnect backoff bounds (seconds)
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+
+
+def subscription_message(method, keys, mode="full"):
+    return json.dumps({
+        "guid": "market-data-feed",
+        "method": method,
+        "data": {"mode": mode, "instrumentKeys": list(keys)}
+    })
+
+
+class StrikeWindow:
+    """Option keys for the ATM +/- ``width`` strikes of the nearest expiry of an underlying.
+
+    The ATM strike only moves once the index has travelled ``hysteresis``
+    of a strike step past the midpoint, so a price oscillating between two
+    strikes does not churn subscriptions.
+    """
+
+    def __init__(self, instruments, underlying="NIFTY", width=10, hysteresis=0.25):
+        self.instruments = instruments
+        self.underlying = underlying
+        self.width = width
+        self.hysteresis = hysteresis
+        self.atm = None
+        self._expiry = None
+        self._strikes = []
+        self._keys_by_strike = {}
+
+    def _load_chain(self, today):
+        options = [
+            info for info in self.instruments.options(self.underlying)
+            if info.expiry is not None and info.expiry >= today and info.strike is not None
+        ]
+        if not options:
+            self._expiry, self._strikes, self._keys_by_strike = None, [], {}
+            return
+        self._expiry = min(info.expiry for info in options)
+        self._keys_by_strike = {}
+        for info in options:
+            if info.expiry == self._expiry:
+                self._keys_by_strike.setdefault(info.strike, []).append(info.instrument_key)
+        self._strikes = sorted(self._keys_by_strike)
+
+    def reload(self):
+        """Rebuild the chain from the instrument master on the next update (after a refresh)."""
+        self._expiry = None
+
+    def update(self, index_ltp, today=None):
+        """Return the window's key set if the ATM strike moved (or the expiry rolled), else None."""
+        today = today or date.today()
+        if self._expiry is None or self._expiry < today:
+            self._load_chain(today)
+            self.atm = None
+        if not self._strikes:
+            return None
+        i = bisect.bisect_left(self._strikes, index_ltp)
+        candidates = self._strikes[max(i - 1, 0):i + 1]
+        nearest = min(candidates, key=lambda strike: abs(strike - index_ltp))
+        if self.atm is not None and nearest != self.atm:
+            step = abs(nearest - self.atm)
+            if abs(index_ltp - self.atm) < step / 2 + step * self.hysteresis:
+                return None
+        if nearest == self.atm:
+            return None
+        self.atm = nearest
+        centre = self._strikes.index(nearest)
+        window = self._strikes[max(centre - self.width, 0):centre + self.width + 1]
+        return {key for strike in window for key in self._keys_by_strike[strike]}
+
+
+class FeedConnection:
+    """One feed websocket that reconnects with backoff and resubscribes its keys."""
+
+    def __init__(self, name, url_factory, on_frame, ssl_context=None, mode="full"):
+        self.name = name
+        self.url_factory = url_factory
+        self.on_frame = on_frame
+        self.ssl_context = ssl_context
+        self.mode = mode
+        self.keys = set()
+        self.websocket = None
+        self.reconnects = REGISTRY.counter("websocket_reconnects_total", "Feed reconnect attempts", connection=name)
+
+    async def send(self, method, keys):
+        """Send sub/unsub for keys in batches; a no-op while disconnected (keys resubscribe on connect)."""
+        websocket = self.websocket
+        if websocket is None or not keys:
+            return
+        keys = sorted(keys)
+        try:
+            for i in range(0, len(keys), SUBSCRIBE_BATCH_SIZE):
+                await websocket.send(subscription_message(method, keys[i:i + SUBSCRIBE_BATCH_SIZE], self.mode))
+        except Exception as e:
+            print(f"Feed {self.name}: error sending {method}: {e}")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            try:
+                url = await loop.run_in_executor(None, self.url_factory)
+                ssl_context = None if url.startswith("ws://") else self.ssl_context
+                async with websockets.connect(url, ssl=ssl_context, max_size=None) as websocket:
+                    self.websocket = websocket
+                    print(f"Feed {self.name}: connected, subscribing {len(self.keys)} keys")
+                    await self.send("sub", self.keys)
+                    async for message in websocket:
+                        delay = RECONNECT_MIN_DELAY
+                        await self.on_frame(message)
+                print(f"Feed {self.name}: connection closed by server")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                REGISTRY.counter("websocket_errors_total", "Feed connection errors").inc()
+                print(f"Feed {self.name}: websocket error: {e}")
+            finally:
+                self.websocket = None
+            self.reconnects.inc()
+            wait = delay * (0.5 + random.random() / 2)
+            print(f"Feed {self.name}: reconnecting in {wait:.1f} s")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+
+class SubscriptionManager:
+    """Keep a target key set subscribed across up to ``max_connections`` feed connections.
+
+    Keys are placed on the connection with the most room and new connections
+    are opened only when the existing ones are full. Changes to the target
+    set are collected and sent as batched sub/unsub deltas every
+    ``flush_interval`` seconds, so moving the strike window only touches the
+    strikes that entered or left it.
+    """
+
+    def __init__(self, url_factory, on_frame, fixed_keys=(), window=None, index_key="NSE_INDEX|Nifty 50",
+                 ssl_context=None, max_connections=FEED_MAX_CONNECTIONS,
+                 keys_per_connection=FEED_KEYS_PER_CONNECTION, flush_interval=DELTA_FLUSH_INTERVAL):
+        self.url_factory = url_factory
+        self.on_frame = on_frame
+        self.fixed_keys = set(fixed_keys) | {index_key}
+        self.window = window
+        self.index_key = index_key
+        self.ssl_context = ssl_context
+        self.max_connections = max_connections
+        self.keys_per_connection = keys_per_connection
+        self.flush_interval = flush_interval
+        self.connections = []
+        self.window_keys = set()
+        self._owner = {}  # key -> FeedConnection
+        self._pending_sub = {}  # FeedConnection -> keys
+        self._pending_unsub = {}
+        self._tasks = []
+        self._loop = None
+        self._dirty = asyncio.Event()
+        REGISTRY.gauge("feed_subscribed_keys", "Instrument keys subscribed", fn=lambda: len(self._owner))
+        REGISTRY.gauge("feed_connections", "Open feed connections", fn=lambda: len(self.connections))
+        self.unplaced = REGISTRY.counter("feed_keys_over_limit_total", "Keys not subscribed: all connections full")
+
+    def target_keys(self):
+        return self.fixed_keys | self.window_keys
+
+    def _connection_with_room(self):
+        best = min(self.connections, key=lambda c: len(c.keys), default=None)
+        if best is not None and len(best.keys) < self.keys_per_connection:
+            return best
+        if len(self.connections) < self.max_connections:
+            connection = FeedConnection(f"feed-{len(self.connections)}", self.url_factory, self.on_frame, self.ssl_context)
+            self.connections.append(connection)
+            if self._loop is not None:
+                self._tasks.append(self._loop.create_task(connection.run()))
+            return connection
+        return None
+
+    def set_targets(self):
+        """Diff the target set against current ownership and queue the deltas."""
+        target = self.target_keys()
+        for key in [key for key in self._owner if key not in target]:
+            connection = self._owner.pop(key)
+            connection.keys.discard(key)
+            if key in self._pending_sub.get(connection, ()):
+                self._pending_sub[connection].discard(key)
+            else:
+                self._pending_unsub.setdefault(connection, set()).add(key)
+        for key in sorted(target - self._owner.keys()):
+            connection = self._connection_with_room()
+            if connection is None:
+                self.unplaced.inc()
+                continue
+            self._owner[key] = connection
+            connection.keys.add(key)
+            if key in self._pending_unsub.get(connection, ()):
+                self._pending_unsub[connection].discard(key)
+            else:
+                self._pending_sub.setdefault(connection, set()).add(key)
+        self._dirty.set()
+
+    def on_index_ltp(self, ltp):
+        """Move the strike window for a new index price (call from the event loop)."""
+        if self.window is None:
+            return
+        keys = self.window.update(ltp)
+        if keys is not None:
+            print(f"Strike window centred on {self.window.atm}: {len(keys)} option keys")
+            self.window_keys = keys
+            self.set_targets()
+
+    def on_index_ltp_threadsafe(self, ltp):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self.on_index_ltp, ltp)
+
+    async def _flush_deltas(self):
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(self.flush_interval)
+            self._dirty.clear()
+            unsub, self._pending_unsub = self._pending_unsub, {}
+            sub, self._pending_sub = self._pending_sub, {}
+            for connection, keys in unsub.items():
+                await connection.send("unsub", keys)
+            for connection, keys in sub.items():
+                await connection.send("sub", keys)
+
+    async def run(self):
+        """Subscribe the fixed keys and keep every connection alive until cancelled."""
+        self.set_targets()
+        self._pending_sub.clear()  # connections subscribe their full key set on connect
+        # Set only now: with a loop, _connection_with_room starts the connections it creates itself
+        self._loop = asyncio.get_running_loop()
+        self._tasks += [self._loop.create_task(c.run()) for c in self.connections]
+        self._tasks.append(self._loop.create_task(self._flush_deltas()))
+        try:
+            await asyncio.Future()
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,107 @@
+import pytest
+from risk_engine import RiskEngine, RiskLimits
+
+LOT = 75
+
+
+class Chain:
+    """Lot sizes and option types for made-up contracts: keys ending in CE or PE."""
+
+    def lot_size(self, instrument_key):
+        return LOT
+
+    def option_fields(self, instrument_key):
+        option_type = instrument_key[-2:] if instrument_key[-2:] in ("CE", "PE") else None
+        return None, option_type, None
+
+
+def make_engine(deltas=None, **limits):
+    settings = dict(max_lots=2, max_net_delta=1e9, rate_window=60.0, max_orders=100,
+                    max_instrument_orders=100, duplicate_window=0.0)
+    settings.update(limits)
+    engine = RiskEngine(Chain(), RiskLimits(**settings), delta_fn=(lambda: dict(deltas)) if deltas else None)
+    engine.refresh_deltas()
+    return engine
+
+
+def test_reserve_and_release_track_positions():
+    engine = make_engine()
+    assert engine.reserve("A CE", "BUY", LOT, now=0.0) is None
+    assert engine.reserve("A CE", "BUY", LOT, now=1.0) is None
+    assert engine.positions == {"A CE": 2 * LOT}
+    engine.release("A CE", "BUY", LOT)
+    assert engine.positions == {"A CE": LOT}
+    engine.release("A CE", "BUY", LOT)
+    assert engine.positions == {}
+
+
+def test_max_lots_refuses_growth_but_allows_reduction():
+    engine = make_engine()
+    engine.reserve("A CE", "BUY", 2 * LOT, now=0.0)
+    assert engine.reserve("A CE", "BUY", LOT, now=1.0) == "max_lots"
+    assert engine.reserve("A CE", "SELL", LOT, now=2.0) is None
+    assert engine.positions == {"A CE": LOT}
+
+
+def test_duplicate_signal_is_refused_within_the_window():
+    engine = make_engine(duplicate_window=300.0)
+    assert engine.reserve("A CE", "BUY", LOT, now=0.0) is None
+    assert engine.reserve("A CE", "BUY", LOT, now=299.0) == "duplicate"
+    assert engine.reserve("A CE", "SELL", LOT, now=299.0) is None  # other side is not a duplicate
+    assert engine.reserve("A CE", "BUY", LOT, now=300.0) is None
+
+
+def test_order_rate_window_expires():
+    engine = make_engine(max_orders=2, rate_window=10.0)
+    assert engine.reserve("A CE", "BUY", LOT, now=0.0) is None
+    assert engine.reserve("B CE", "BUY", LOT, now=1.0) is None
+    assert engine.reserve("C CE", "BUY", LOT, now=2.0) == "order_rate"
+    assert engine.reserve("C CE", "BUY", LOT, now=10.0) is None  # the first order left the window
+
+
+def test_instrument_order_rate_is_per_instrument():
+    engine = make_engine(max_lots=10, max_instrument_orders=2, rate_window=10.0)
+    engine.reserve("A CE", "BUY", LOT, now=0.0)
+    engine.reserve("A CE", "BUY", LOT, now=1.0)
+    assert engine.reserve("A CE", "BUY", LOT, now=2.0) == "instrument_order_rate"
+    assert engine.reserve("B CE", "BUY", LOT, now=2.0) is None
+    assert engine.reserve("A CE", "BUY", LOT, now=10.5) is None
+
+
+def test_refused_orders_do_not_change_the_book():
+    engine = make_engine(max_orders=1)
+    engine.reserve("A CE", "BUY", LOT, now=0.0)
+    assert engine.reserve("B CE", "BUY", LOT, now=1.0) == "order_rate"
+    assert engine.positions == {"A CE": LOT}
+    assert engine.net_delta() == LOT
+
+
+def test_net_delta_limit_uses_refreshed_deltas():
+    engine = make_engine({"A CE": 0.5, "B PE": -0.4}, max_lots=10, max_net_delta=100.0)
+    assert engine.reserve("A CE", "BUY", 2 * LOT, now=0.0) is None  # +75
+    assert engine.net_delta() == pytest.approx(75.0)
+    assert engine.reserve("A CE", "BUY", LOT, now=1.0) == "net_delta"  # would be 112.5
+    assert engine.reserve("B PE", "SELL", LOT, now=2.0) == "net_delta"  # short put adds delta
+    assert engine.reserve("B PE", "BUY", LOT, now=3.0) is None  # long put reduces it
+    assert engine.net_delta() == pytest.approx(45.0)
+
+
+def test_contracts_without_a_delta_count_as_one_per_unit():
+    engine = make_engine()
+    engine.reserve("A CE", "BUY", LOT, now=0.0)
+    engine.reserve("B PE", "BUY", 2 * LOT, now=1.0)
+    assert engine.net_delta() == pytest.approx(LOT - 2 * LOT)
+
+
+def test_refresh_rebuilds_net_delta_from_new_deltas():
+    deltas = {"A CE": 0.5}
+    engine = RiskEngine(Chain(), RiskLimits(max_lots=10, duplicate_window=0.0), delta_fn=lambda: dict(deltas))
+    engine.refresh_deltas()
+    engine.reserve("A CE", "BUY", 2 * LOT, now=0.0)
+    assert engine.net_delta() == pytest.approx(75.0)
+    deltas["A CE"] = 0.8
+    engine.refresh_deltas()
+    assert engine.net_delta() == pytest.approx(120.0)
+    deltas.clear()  # the contract could not be priced this time: its last delta is kept
+    engine.refresh_deltas()
+    assert engine.net_delta() == pytest.approx(120.0)
@@ -0,0 +1,179 @@
+import os
+import time
+import pytest
+import spool as spool_module
+from spool import Spool, SpoolDrainer, DEAD_LETTER_NAME, spool_status
+
+
+@pytest.fixture
+def open_spools():
+    """Close every spool a test opened, even when it fails."""
+    opened = []
+    yield opened
+    for spool in opened:
+        spool.close()
+
+
+def make_spool(directory, opened, **kwargs):
+    spool = Spool(str(directory), fsync_interval=3600, **kwargs)
+    opened.append(spool)
+    return spool
+
+
+def segment_path(spool, first_seq):
+    return os.path.join(spool.directory, spool_module._segment_name(first_seq))
+
+
+def test_records_become_readable_once_synced(tmp_path, open_spools):
+    spool = make_spool(tmp_path / "s", open_spools)
+    assert [spool.append({"n": n}) for n in range(3)] == [1, 2, 3]
+    assert spool.read(0, 10) == []
+    spool.sync()
+    assert spool.read(0, 10) == [(1, {"n": 0}), (2, {"n": 1}), (3, {"n": 2})]
+
+
+def test_read_continues_from_the_previous_batch(tmp_path, open_spools):
+    spool = make_spool(tmp_path / "s", open_spools, segment_bytes=1)  # one record per segment
+    for n in range(5):
+        spool.append(n)
+    spool.sync()
+    assert [record for _, record in spool.read(0, 2)] == [0, 1]
+    assert [record for _, record in spool.read(0, 2)] == [2, 3]
+    assert [record for _, record in spool.read(0, 2)] == [4]
+
+
+def test_commit_deletes_fully_drained_segments(tmp_path, open_spools):
+    spool = make_spool(tmp_path / "s", open_spools, segment_bytes=1)
+    for n in range(4):
+        spool.append(n)
+    spool.sync()
+    assert spool.segments() == [1, 2, 3, 4]
+    records = spool.read(0, 2)
+    spool.commit(records[-1][0])
+    assert spool.segments() == [3, 4]
+    spool.read(2, 10)
+    spool.commit(4)
+    assert spool.segments() == [4]  # the segment being written is kept
+    assert spool.drained_seq == 4
+
+
+def test_cursor_survives_a_restart(tmp_path, open_spools):
+    spool = make_spool(tmp_path / "s", open_spools)
+    for n in range(3):
+        spool.append(n)
+    spool.sync()
+    spool.read(0, 2)
+    spool.commit(2)
+    spool.close()
+    open_spools.remove(spool)
+
+    reopened = make_spool(tmp_path / "s", open_spools)
+    assert reopened.drained_seq == 2
+    assert reopened.read(reopened.drained_seq, 10) == [(3, 2)]
+    assert reopened.append("next") == 4
+
+
+def test_torn_tail_is_truncated_on_open(tmp_path, open_spools):
+    spool = make_spool(tmp_path / "s", open_spools)
+    for n in range(3):
+        spool.append(n)
+    spool.close()
+    open_spools.remove(spool)
+    path = segment_path(spool, 1)
+    intact_size = os.path.getsize(path)
+    with open(path, "ab") as f:
+        # A crash mid-append: a full header announcing more payload than was written
+        f.write(spool_module._RECORD_HEADER.pack(4, 100, 0) + b"partial")
+
+    reopened = make_spool(tmp_path / "s", open_spools)
+    assert os.path.getsize(path) == intact_size
+    assert reopened.recovered_seq == 3
+    assert reopened.append("after") == 4
+    reopened.sync()
+    assert [record for _, record in reopened.read(0, 10)] == [0, 1, 2, "after"]
+
+
+def test_corrupt_record_is_skipped_with_the_rest_of_its_segment(tmp_path, open_spools):
+    spool = make_spool(tmp_path / "s", open_spools, segment_bytes=1)
+    for n in range(3):
+        spool.append(n)
+    spool.sync()
+    path = segment_path(spool, 2)
+    with open(path, "r+b") as f:
+        f.seek(os.path.getsize(path) - 1)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([last[0] ^ 0xFF]))
+
+    corrupt_before = spool.corrupt.value
+    assert spool.read(0, 10) == [(1, 0), (3, 2)]
+    assert spool.corrupt.value == corrupt_before + 1
+
+
+def test_status_is_read_only_and_ignores_a_record_being_written(tmp_path, open_spools):
+    spool = make_spool(tmp_path / "s", open_spools)
+    for n in range(3):
+        spool.append(n)
+    spool.sync()
+    spool.read(0, 1)
+    spool.commit(1)
+    path = segment_path(spool, 1)
+    with open(path, "ab") as f:
+        # A live writer part-way through its next record
+        f.write(spool_module._RECORD_HEADER.pack(4, 100, 0) + b"partial")
+    size = os.path.getsize(path)
+
+    status = spool_status(spool.directory)
+    assert (status["segments"], status["written_seq"], status["drained_seq"]) == (1, 3, 1)
+    assert status["bytes"] == size
+    assert os.path.getsize(path) == size
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_drainer_retries_transient_errors(tmp_path, open_spools, monkeypatch):
+    monkeypatch.setattr(spool_module, "DRAIN_RETRY_MIN_DELAY", 0.01)
+    spool = Spool(str(tmp_path / "s"), fsync_interval=0.01)
+    open_spools.append(spool)
+    applied, failures = [], [OSError("database down"), OSError("still down")]
+
+    def handler(records):
+        if failures:
+            raise failures.pop(0)
+        applied.extend(records)
+
+    drainer = SpoolDrainer(spool, handler, batch_size=10)
+    for n in range(3):
+        spool.append(n)
+    wait_for(lambda: spool.drained_seq == 3)
+    drainer.close()
+    assert applied == [0, 1, 2]
+    assert drainer.dead_letters is None
+
+
+def test_drainer_moves_permanent_failures_to_the_dead_letter_spool(tmp_path, open_spools):
+    spool = Spool(str(tmp_path / "s"), fsync_interval=0.01)
+    open_spools.append(spool)
+    applied = []
+
+    def handler(records):
+        if "bad" in records:
+            raise ValueError("violates a constraint")
+        applied.extend(records)
+
+    drainer = SpoolDrainer(spool, handler, batch_size=10)
+    for record in ("a", "bad", "b"):
+        spool.append(record)
+    wait_for(lambda: spool.drained_seq == 3)
+    drainer.close()
+    assert applied == ["a", "b"]
+
+    dead = make_spool(tmp_path / "s" / DEAD_LETTER_NAME, open_spools)
+    (_, (seq, record, error)), = dead.read(0, 10)
+    assert (seq, record) == (2, "bad")
+    assert "violates a constraint" in error
@@ -0,0 +1,315 @@
+import io
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import date, datetime, timedelta, timezone
+import numpy as np
+import psycopg2
+import pytz
+from db import db_params
+
+# pyarrow is optional and slow to import, so it is loaded on first use by _require_pyarrow
+pa = pc = pa_csv = pa_ipc = pq = None
+
+# Root of the archive: <root>/date=YYYY-MM-DD/underlying=NAME/expiry=YYYY-MM-DD/ticks.arrow
+TICK_ARCHIVE_DIR = os.getenv("TICK_ARCHIVE_DIR", "tick_archive")
+
+# Written last in each date directory, so a day without it is incomplete
+MANIFEST_NAME = "_manifest.json"
+
+IST = pytz.timezone("Asia/Kolkata")
+
+# export also fills up to this many missing days since the last archived one (weekends, holidays,
+# missed runs), writing empty manifests for days without ticks so coverage has no holes
+GAP_FILL_DAYS = int(os.getenv("TICK_ARCHIVE_GAP_FILL_DAYS", "31"))
+
+# Numeric market_data columns; NULLs are exported as NaN / 0 so every column maps zero-copy to NumPy
+NUMERIC_COLUMNS = ("time", "ltp", "volume", "last_trade_time", "last_close", "strike_price", "open_interest")
+
+EXPORT_DAY_SQL = """
+    COPY (
+        SELECT (extract(epoch FROM time) * 1000000)::int8 AS time,
+               instrument_key,
+               COALESCE(ltp, 'NaN')::float8 AS ltp,
+               COALESCE(volume, 0) AS volume,
+               COALESCE(last_trade_time, 0) AS last_trade_time,
+               COALESCE(last_close, 'NaN')::float8 AS last_close,
+               COALESCE(strike_price, 'NaN')::float8 AS strike_price,
+               option_type,
+               COALESCE(open_interest, 0) AS open_interest,
+               expiry_date
+        FROM market_data
+        WHERE time >= %(start)s AND time < %(end)s
+        ORDER BY instrument_key, time
+    ) TO STDOUT WITH (FORMAT csv, HEADER)
+"""
+
+
+def _require_pyarrow():
+    global pa, pc, pa_csv, pa_ipc, pq
+    if pa is not None:
+        return
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.csv
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("The tick archive needs pyarrow: pip install pyarrow")
+    pc, pa_csv, pa_ipc, pq = pyarrow.compute, pyarrow.csv, pyarrow.ipc, pyarrow.parquet
+    pa = pyarrow
+
+
+def _column_types():
+    return {
+        "time": pa.int64(), "instrument_key": pa.string(), "ltp": pa.float64(), "volume": pa.int64(),
+        "last_trade_time": pa.int64(), "last_close": pa.float64(), "strike_price": pa.float64(),
+        "option_type": pa.string(), "open_interest": pa.int64(), "expiry_date": pa.date32()
+    }
+
+
+def day_bounds(day):
+    """UTC [start, end) of an IST trading day."""
+    start = IST.localize(datetime.combine(day, datetime.min.time()))
+    return start.astimezone(timezone.utc), (start + timedelta(days=1)).astimezone(timezone.utc)
+
+
+def underlying_of(instrument_key, master=None):
+    info = master.get(instrument_key) if master is not None else None
+    name = info.underlying if info is not None and info.underlying else instrument_key.split("|", 1)[-1]
+    return name.replace(" ", "_").replace("/", "_")
+
+
+def _instrument_ranges(keys):
+    """[(key, start, end)] runs of a sorted key column."""
+    keys = keys.dictionary_encode().combine_chunks()
+    codes = keys.indices.to_numpy(zero_copy_only=False)
+    dictionary = keys.dictionary.to_pylist()
+    if len(codes) == 0:
+        return []
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(codes)) + 1))
+    ends = np.concatenate((starts[1:], [len(codes)]))
+    return [(dictionary[codes[s]], int(s), int(e)) for s, e in zip(starts.tolist(), ends.tolist())]
+
+
+def export_day(conn, day, root=TICK_ARCHIVE_DIR, file_format="arrow", master=None):
+    """Archive one IST day of market_data as per-underlying, per-expiry columnar files.
+
+    The day is pulled with a single COPY and parsed by Arrow's CSV reader, so
+    no per-row Python objects are built. Each file is sorted by
+    (instrument_key, time) and carries the row range of every instrument in
+    its schema metadata, which lets readers slice instruments without
+    scanning the key column.
+    """
+    _require_pyarrow()
+    start, end = day_bounds(day)
+    buffer = io.BytesIO()
+    with conn.cursor() as cursor:
+        cursor.copy_expert(cursor.mogrify(EXPORT_DAY_SQL, {"start": start, "end": end}).decode(), buffer)
+    buffer.seek(0)
+    table = pa_csv.read_csv(buffer, convert_options=pa_csv.ConvertOptions(column_types=_column_types()))
+    table = table.set_column(0, "time", pc.cast(table["time"], pa.timestamp("us", tz="UTC")))
+
+    partitions = {}
+    for key, row_start, row_end in _instrument_ranges(table["instrument_key"]):
+        expiry = table["expiry_date"][row_start].as_py()
+        partition = (underlying_of(key, master), expiry.isoformat() if expiry else "none")
+        partitions.setdefault(partition, []).append((key, row_start, row_end))
+
+    day_dir = os.path.join(root, f"date={day.isoformat()}")
+    files = []
+    for (underlying, expiry), ranges in sorted(partitions.items()):
+        pieces, index, offset = [], [], 0
+        for key, row_start, row_end in ranges:
+            pieces.append(table.slice(row_start, row_end - row_start))
+            index.append([key, offset, offset + row_end - row_start])
+            offset += row_end - row_start
+        part = pa.concat_tables(pieces).combine_chunks()
+        part = part.replace_schema_metadata({"instruments": json.dumps(index)})
+        part_dir = os.path.join(day_dir, f"underlying={underlying}", f"expiry={expiry}")
+        os.makedirs(part_dir, exist_ok=True)
+        path = os.path.join(part_dir, "ticks.parquet" if file_format == "parquet" else "ticks.arrow")
+        tmp_path = path + ".tmp"
+        if file_format == "parquet":
+            pq.write_table(part, tmp_path, compression="zstd")
+        else:
+            # Uncompressed IPC so readers can map the buffers straight into NumPy
+            with pa_ipc.new_file(tmp_path, part.schema) as writer:
+                writer.write_table(part, max_chunksize=len(part) or None)
+        os.replace(tmp_path, path)
+        files.append({"path": os.path.relpath(path, day_dir), "rows": len(part), "instruments": len(index)})
+
+    os.makedirs(day_dir, exist_ok=True)
+    with open(os.path.join(day_dir, MANIFEST_NAME), "w") as f:
+        json.dump({"date": day.isoformat(), "rows": table.num_rows, "files": files, "exported_at": time.time()}, f)
+    return table.num_rows, files
+
+
+def ticks_to_bars(series, interval):
+    """Aggregate one instrument's time-sorted ticks into OHLCV + OI bars like the continuous aggregates."""
+    step = int(interval.total_seconds() * 1_000_000)
+    micros = series["time"].view("int64")
+    buckets = micros // step * step
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    ends = np.concatenate((starts[1:], [len(buckets)])) - 1
+    ltp = series["ltp"]
+    return {
+        "time": buckets[starts].view("datetime64[us]"),
+        "open": ltp[starts],
+        "high": np.fmax.reduceat(ltp, starts),
+        "low": np.fmin.reduceat(ltp, starts),
+        "close": ltp[ends],
+        "volume": series["volume"][ends],
+        "open_interest": series["open_interest"][ends]
+    }
+
+
+class TickArchive:
+    """Reader for the archive written by export_day.
+
+    Arrow IPC files are memory-mapped and their columns viewed as NumPy
+    arrays without copying; per-instrument arrays are slices of those views.
+    Parquet partitions are decoded on read. Data spanning several days is
+    concatenated, which copies.
+    """
+
+    def __init__(self, root=TICK_ARCHIVE_DIR):
+        self.root = root
+
+    def archived_days(self):
+        """Dates with a complete export, oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        days = []
+        for name in os.listdir(self.root):
+            if name.startswith("date=") and os.path.exists(os.path.join(self.root, name, MANIFEST_NAME)):
+                days.append(date.fromisoformat(name[len("date="):]))
+        return sorted(days)
+
+    def covered_until(self, start_date, end_date):
+        """Last day D such that every day from start_date to D is archived, or None.
+
+        Days without ticks count only if they were exported (with an empty
+        manifest); ``export`` fills such gaps since the previous archived day.
+        """
+        archived = set(self.archived_days())
+        covered = None
+        day = start_date
+        while day <= end_date and day in archived:
+            covered = day
+            day += timedelta(days=1)
+        return covered
+
+    def partitions(self, day, underlying=None, expiry=None):
+        """Paths of a day's files, optionally filtered by underlying and expiry (date or 'none')."""
+        day_dir = os.path.join(self.root, f"date={day.isoformat()}")
+        manifest_path = os.path.join(day_dir, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            return []
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        wanted_expiry = expiry.isoformat() if isinstance(expiry, date) else expiry
+        paths = []
+        for entry in manifest["files"]:
+            parts = dict(p.split("=", 1) for p in entry["path"].split(os.sep)[:-1])
+            if underlying is not None and parts["underlying"] != underlying:
+                continue
+            if wanted_expiry is not None and parts["expiry"] != wanted_expiry:
+                continue
+            paths.append(os.path.join(day_dir, entry["path"]))
+        return paths
+
+    @staticmethod
+    def read_table(path, columns=None):
+        _require_pyarrow()
+        if path.endswith(".parquet"):
+            return pq.read_table(path, columns=columns, memory_map=True)
+        table = pa_ipc.open_file(pa.memory_map(path, "r")).read_all()
+        return table.select(columns) if columns else table
+
+    def read_file(self, path, columns=NUMERIC_COLUMNS):
+        """{instrument_key: {column: ndarray}} for one file; views into the mapping for Arrow IPC."""
+        table = self.read_table(path)
+        index = json.loads(table.schema.metadata[b"instruments"])
+        arrays = {}
+        for column in columns:
+            chunked = table[column]
+            if chunked.num_chunks == 1:
+                array = chunked.chunk(0).to_numpy(zero_copy_only=False)
+            else:
+                array = chunked.to_numpy()
+            arrays[column] = array.astype("datetime64[us]", copy=False) if column == "time" else array
+        return {key: {column: array[start:end] for column, array in arrays.items()} for key, start, end in index}
+
+    def load_ticks(self, start_date, end_date, underlying=None, expiry=None, columns=NUMERIC_COLUMNS):
+        """Ticks for [start_date, end_date] per instrument, in time order."""
+        pieces = {}
+        day = start_date
+        while day <= end_date:
+            for path in self.partitions(day, underlying, expiry):
+                for key, series in self.read_file(path, columns).items():
+                    pieces.setdefault(key, []).append(series)
+            day += timedelta(days=1)
+        return {
+            key: parts[0] if len(parts) == 1 else {c: np.concatenate([p[c] for p in parts]) for c in columns}
+            for key, parts in pieces.items()
+        }
+
+    def load_bars(self, start_date, end_date, interval, after=None, underlying=None, segment="NSE_FO"):
+        """Bars in load_chain_bars layout built from archived ticks, optionally only buckets after ``after``."""
+        columns = ("time", "ltp", "volume", "open_interest")
+        history = {}
+        for key, series in self.load_ticks(start_date, end_date, underlying, columns=columns).items():
+            if segment is not None and not key.startswith(segment + "|"):
+                continue
+            bars = ticks_to_bars(series, interval)
+            if after is not None:
+                keep = bars["time"] > np.datetime64(after.astimezone(timezone.utc).replace(tzinfo=None), "us")
+                bars = {name: array[keep] for name, array in bars.items()}
+            if len(bars["time"]):
+                history[key] = bars
+        return history
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive market_data days to local columnar files")
+    parser.add_argument("command", choices=("export", "list"))
+    parser.add_argument("--date", type=date.fromisoformat, help="IST day to export (default: yesterday)")
+    parser.add_argument("--days", type=int, default=1, help="Export this many days ending at --date")
+    parser.add_argument("--root", default=TICK_ARCHIVE_DIR)
+    parser.add_argument("--format", choices=("arrow", "parquet"), default="arrow",
+                        help="arrow (IPC, memory-mappable) or parquet (zstd, smaller)")
+    args = parser.parse_args(argv)
+    _require_pyarrow()
+
+    if args.command == "list":
+        for day in TickArchive(args.root).archived_days():
+            with open(os.path.join(args.root, f"date={day.isoformat()}", MANIFEST_NAME)) as f:
+                manifest = json.load(f)
+            print(f"{day}: {manifest['rows']} ticks in {len(manifest['files'])} files")
+        return 0
+
+    from instrument_master import get_instrument_master
+    master = get_instrument_master()
+    last_day = args.date or datetime.now(IST).date() - timedelta(days=1)
+    first_day = last_day - timedelta(days=args.days - 1)
+    earlier = [day for day in TickArchive(args.root).archived_days() if day < first_day]
+    if earlier and (first_day - earlier[-1]).days - 1 <= GAP_FILL_DAYS:
+        first_day = earlier[-1] + timedelta(days=1)
+    conn = psycopg2.connect(**db_params)
+    try:
+        for offset in range((last_day - first_day).days, -1, -1):
+            day = last_day - timedelta(days=offset)
+            started = time.perf_counter()
+            rows, files = export_day(conn, day, args.root, args.format, master)
+            print(f"Archived {day}: {rows} ticks in {len(files)} files ({time.perf_counter() - started:.1f} s)")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
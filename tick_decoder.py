@@ -0,0 +1,205 @@
+import numpy as np
+from google.protobuf.json_format import MessageToDict
+import MarketDataFeed_pb2 as pb
+
+# Number of market depth levels kept per instrument
+DEPTH_LEVELS = 5
+
+
+def _equity_feed_fields():
+    feed = pb.FeedResponse.DESCRIPTOR.fields_by_name["feeds"].message_type.fields_by_name["value"].message_type
+    return feed.fields_by_name["ff"].message_type.fields_by_name["equity_ff"].message_type.fields_by_name
+
+
+# Open interest is only available when the feed schema carries an ``oi`` field
+HAS_OI_FIELD = "oi" in _equity_feed_fields()
+
+
+# Decode protobuf message
+def decode_protobuf(buffer):
+    feed_response = pb.FeedResponse()
+    feed_response.ParseFromString(buffer)
+    return MessageToDict(feed_response)
+
+
+def parse_option_key(instrument_key):
+    """Derive (strike_price, option_type, expiry_date) from an NSE_FO instrument key."""
+    parts = instrument_key.split("|")[1].split("NIFTY")
+    if len(parts) > 1:
+        option_part = parts[1]
+        if "CE" in option_part or "PE" in option_part:
+            option_type = "CE" if "CE" in option_part else "PE"
+            strike_price = float(option_part[:-2])  # e.g., "23000"
+            return strike_price, option_type, None  # the key carries no reliable expiry
+    return None, None, None
+
+
+def option_fields(instrument_key, instruments=None):
+    """Resolve (strike_price, option_type, expiry_date) via the instrument master when available."""
+    if instruments is not None:
+        info = instruments.get(instrument_key)
+        if info is not None:
+            return info.strike, info.option_type, info.expiry
+    return parse_option_key(instrument_key)
+
+
+def build_market_rows(data, current_time, instruments=None):
+    """Convert a MessageToDict feed message into market_data rows."""
+    rows = []
+    for instrument_key, feed in data.get("feeds", {}).items():
+        ltpc = feed.get("ff", {}).get("indexFf", {}).get("ltpc", {}) or \
+               feed.get("ff", {}).get("equityFf", {}).get("ltpc", {})
+        volume = feed.get("ff", {}).get("indexFf", {}).get("marketOhlc", {}).get("ohlc", [{}])[0].get("volume", 0) or \
+                 feed.get("ff", {}).get("equityFf", {}).get("marketOhlc", {}).get("ohlc", [{}])[0].get("volume", 0)
+        last_close = feed.get("ff", {}).get("indexFf", {}).get("lastClose", 0) or \
+                     feed.get("ff", {}).get("equityFf", {}).get("lastClose", 0)
+
+        # Extract options-specific fields
+        strike_price = None
+        option_type = None
+        open_interest = None
+        expiry_date = None
+        if "NSE_FO" in instrument_key:
+            strike_price, option_type, expiry_date = option_fields(instrument_key, instruments)
+            if HAS_OI_FIELD:
+                open_interest = feed.get("ff", {}).get("equityFf", {}).get("oi", 0)
+
+        rows.append((
+            current_time,
+            instrument_key,
+            ltpc.get("ltp", 0.0),
+            volume,
+            ltpc.get("ltt", 0),
+            last_close,
+            strike_price,
+            option_type,
+            open_interest,
+            expiry_date
+        ))
+    return rows
+
+
+class TickBatch:
+    """Column views over one decoded message; valid until the next decode call."""
+
+    def __init__(self, keys, columns, size):
+        self.keys = keys
+        self.size = size
+        self.ltp = columns["ltp"][:size]
+        self.ltt = columns["ltt"][:size]
+        self.volume = columns["volume"][:size]
+        self.last_close = columns["last_close"][:size]
+        self.oi = columns["oi"][:size]
+        self.is_index = columns["is_index"][:size]
+        self.bid_price = columns["bid_price"][:size]
+        self.bid_qty = columns["bid_qty"][:size]
+        self.ask_price = columns["ask_price"][:size]
+        self.ask_qty = columns["ask_qty"][:size]
+
+    def copy(self):
+        """Detached copy that stays valid after the decoder is reused (and can be pickled)."""
+        columns = {
+            name: getattr(self, name).copy()
+            for name in ("ltp", "ltt", "volume", "last_close", "oi", "is_index",
+                         "bid_price", "bid_qty", "ask_price", "ask_qty")
+        }
+        return TickBatch(list(self.keys), columns, self.size)
+
+    def to_rows(self, current_time, instruments=None):
+        """Build market_data rows matching build_market_rows for the same message."""
+        rows = []
+        ltp = self.ltp.tolist()
+        ltt = self.ltt.tolist()
+        volume = self.volume.tolist()
+        last_close = self.last_close.tolist()
+        oi = self.oi.tolist()
+        for i, instrument_key in enumerate(self.keys):
+            strike_price = option_type = open_interest = expiry_date = None
+            if "NSE_FO" in instrument_key:
+                strike_price, option_type, expiry_date = option_fields(instrument_key, instruments)
+                if HAS_OI_FIELD:
+                    open_interest = oi[i]
+            rows.append((
+                current_time, instrument_key, ltp[i], volume[i], ltt[i], last_close[i],
+                strike_price, option_type, open_interest, expiry_date
+            ))
+        return rows
+
+
+class ColumnarTickDecoder:
+    """Decode FeedResponse frames straight into reusable struct-of-arrays buffers.
+
+    Fields are read from the protobuf objects directly, skipping MessageToDict
+    and the nested dict lookups. Buffers grow geometrically and are reused, so
+    an instance must not be shared between threads.
+    """
+
+    def __init__(self, capacity=256, depth=DEPTH_LEVELS):
+        self.depth = depth
+        self._message = pb.FeedResponse()
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.columns = {
+            "ltp": np.zeros(capacity, dtype=np.float64),
+            "ltt": np.zeros(capacity, dtype=np.int64),
+            "volume": np.zeros(capacity, dtype=np.int64),
+            "last_close": np.zeros(capacity, dtype=np.float64),
+            "oi": np.zeros(capacity, dtype=np.int64),
+            "is_index": np.zeros(capacity, dtype=np.bool_),
+            "bid_price": np.zeros((capacity, self.depth), dtype=np.float64),
+            "bid_qty": np.zeros((capacity, self.depth), dtype=np.int64),
+            "ask_price": np.zeros((capacity, self.depth), dtype=np.float64),
+            "ask_qty": np.zeros((capacity, self.depth), dtype=np.int64)
+        }
+
+    def decode(self, buffer):
+        """Parse one frame and return a TickBatch of column views."""
+        message = self._message
+        message.ParseFromString(buffer)
+        size = len(message.feeds)
+        if size > self.capacity:
+            self._allocate(max(size, self.capacity * 2))
+
+        columns = self.columns
+        ltp = columns["ltp"]
+        ltt = columns["ltt"]
+        volume = columns["volume"]
+        last_close = columns["last_close"]
+        oi = columns["oi"]
+        is_index = columns["is_index"]
+        bid_price = columns["bid_price"]
+        bid_qty = columns["bid_qty"]
+        ask_price = columns["ask_price"]
+        ask_qty = columns["ask_qty"]
+        bid_price[:size] = 0.0
+        bid_qty[:size] = 0
+        ask_price[:size] = 0.0
+        ask_qty[:size] = 0
+        depth = self.depth
+
+        keys = []
+        for i, (instrument_key, feed) in enumerate(message.feeds.items()):
+            keys.append(instrument_key)
+            ff = feed.ff
+            index = ff.HasField("index_ff")
+            full = ff.index_ff if index else ff.equity_ff
+            ltpc = full.ltpc
+            ohlc = full.market_ohlc.ohlc
+            ltp[i] = ltpc.ltp
+            ltt[i] = ltpc.ltt
+            volume[i] = ohlc[0].volume if ohlc else 0
+            last_close[i] = full.last_close
+            is_index[i] = index
+            oi[i] = full.oi if HAS_OI_FIELD and not index else 0
+            if not index:
+                level = full.market_level
+                for j, quote in enumerate(level.bids.bids_asks[:depth]):
+                    bid_price[i, j] = quote.price
+                    bid_qty[i, j] = quote.quantity
+                for j, quote in enumerate(level.asks.bids_asks[:depth]):
+                    ask_price[i, j] = quote.price
+                    ask_qty[i, j] = quote.quantity
+
+        return TickBatch(keys, columns, size)
@@ -0,0 +1,223 @@
+import sys
+import time
+import json
+import struct
+import asyncio
+import argparse
+from collections import deque
+import websockets
+import MarketDataFeed_pb2 as pb
+
+# Recording layout: magic header, then (receive time ns, frame length, frame bytes) records
+RECORDING_MAGIC = b"PTFEED1\n"
+_RECORD_HEADER = struct.Struct("<qI")
+
+
+class FrameRecorder:
+    """Append raw FeedResponse frames with their receive timestamps to a compact binary log."""
+
+    def __init__(self, path, buffer_size=1 << 20):
+        self.path = path
+        self.frames = 0
+        self._file = open(path, "ab", buffering=buffer_size)
+        if self._file.tell() == 0:
+            self._file.write(RECORDING_MAGIC)
+
+    def record(self, frame, received_ns=None):
+        received_ns = time.time_ns() if received_ns is None else received_ns
+        self._file.write(_RECORD_HEADER.pack(received_ns, len(frame)))
+        self._file.write(frame)
+        self.frames += 1
+
+    def close(self):
+        self._file.close()
+
+
+def read_recording(path):
+    """Yield (received_ns, frame) pairs from a FrameRecorder log."""
+    with open(path, "rb") as f:
+        if f.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise ValueError(f"{path} is not a feed recording")
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                return
+            received_ns, length = _RECORD_HEADER.unpack(header)
+            yield received_ns, f.read(length)
+
+
+def synthesize_chain_frames(count, strikes, depth=5, interval_ns=100_000_000):
+    """Build (timestamp ns, frame) pairs for the Nifty index plus a CE/PE chain of ``strikes`` strikes."""
+    frames = []
+    start_ns = time.time_ns()
+    for n in range(count):
+        message = pb.FeedResponse()
+        index = message.feeds["NSE_INDEX|Nifty 50"].ff.index_ff
+        index.ltpc.ltp = 23000.0 + n * 0.05
+        index.ltpc.ltt = 1716800000000 + n
+        index.last_close = 22950.0
+        for k in range(strikes):
+            strike = 23000 + (k - strikes // 2) * 50
+            for option_type in ("CE", "PE"):
+                full = message.feeds[f"NSE_FO|NIFTY25MAY{strike}{option_type}"].ff.equity_ff
+                full.ltpc.ltp = 100.0 + k + n * 0.05
+                full.ltpc.ltt = 1716800000000 + n
+                full.last_close = 95.0 + k
+                full.market_ohlc.ohlc.add().volume = 1000 + n
+                for level in range(depth):
+                    bid = full.market_level.bids.bids_asks.add()
+                    bid.price = full.ltpc.ltp - 0.05 * (level + 1)
+                    bid.quantity = 75 * (level + 1)
+                    ask = full.market_level.asks.bids_asks.add()
+                    ask.price = full.ltpc.ltp + 0.05 * (level + 1)
+                    ask.quantity = 75 * (level + 1)
+        frames.append((start_ns + n * interval_ns, message.SerializeToString()))
+    return frames
+
+
+class NullTickWriter:
+    """Stand-in for TickWriter that counts rows instead of writing them."""
+
+    def __init__(self):
+        self.rows = 0
+
+    def add_rows(self, rows, received_at=None):
+        self.rows += len(rows)
+
+    def close(self):
+        pass
+
+
+class ReplayServer:
+    """Local stand-in for the Upstox feed websocket that replays frames at 1x, Nx or max speed.
+
+    ``speed`` of 0 means as fast as possible. Frames are sent to every client
+    after it sends its subscription message; ``loops`` > 1 repeats the set.
+    With ``record_send_times`` each send is timestamped for an in-process
+    client to pop (``run_benchmark``); a served replay leaves it off so
+    nothing accumulates.
+    """
+
+    def __init__(self, frames, speed=1.0, loops=1, record_send_times=False):
+        self.frames = frames
+        self.speed = speed
+        self.loops = loops
+        self.sent = 0
+        self.max_lag = 0.0
+        self.send_times = deque() if record_send_times else None  # perf_counter per frame
+
+    async def handler(self, websocket, *_):
+        subscription = json.loads(await websocket.recv())
+        print(f"Replay client subscribed ({subscription.get('method')}, "
+              f"{len(subscription.get('data', {}).get('instrumentKeys', []))} keys)")
+        first_ns = self.frames[0][0]
+        span_ns = self.frames[-1][0] - first_ns
+        started = time.perf_counter()
+        for loop in range(self.loops):
+            for timestamp_ns, frame in self.frames:
+                if self.speed:
+                    due = started + (loop * span_ns + timestamp_ns - first_ns) / 1e9 / self.speed
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        self.max_lag = max(self.max_lag, -delay)
+                if self.send_times is not None:
+                    self.send_times.append(time.perf_counter())
+                await websocket.send(frame)
+                self.sent += 1
+        elapsed = time.perf_counter() - started
+        print(f"Replayed {self.sent} frames in {elapsed:.2f} s ({self.sent / elapsed:.0f} frames/s), "
+              f"max lag behind schedule {self.max_lag * 1000:.1f} ms")
+
+    async def serve(self, host="localhost", port=8765):
+        async with websockets.serve(self.handler, host, port, max_size=None):
+            print(f"Replaying {len(self.frames)} frames on ws://{host}:{port} at "
+                  f"{'max' if not self.speed else f'{self.speed:g}x'} speed")
+            await asyncio.Future()
+
+
+async def run_benchmark(server, decode, store, port=8765, **pipeline_settings):
+    """Replay through a real local websocket into an IngestPipeline and report per-stage throughput and latency.
+
+    ``server`` must record send times. Receive latency is send to
+    ``recv()``; decode and store latencies come from the pipeline's own
+    histograms, and receive-to-stored covers the whole path.
+    """
+    from metrics import MetricsRegistry
+    from ingest_pipeline import IngestPipeline
+
+    registry = MetricsRegistry()
+    pipeline = IngestPipeline(decode, store, report_interval=0, registry=registry, **pipeline_settings)
+    receive_latency = registry.histogram("replay_receive_seconds", "Replay send to websocket recv")
+    received = 0
+    async with websockets.serve(server.handler, "localhost", port, max_size=None):
+        async with websockets.connect(f"ws://localhost:{port}", max_size=None) as websocket:
+            await websocket.send(json.dumps({"method": "sub", "data": {"instrumentKeys": []}}))
+            total = len(server.frames) * server.loops
+            pipeline.start()
+            started = time.perf_counter()
+            while received < total:
+                frame = await websocket.recv()
+                receive_latency.observe(time.perf_counter() - server.send_times.popleft())
+                await pipeline.put_frame(frame)
+                received += 1
+            await pipeline.drain()
+            elapsed = time.perf_counter() - started
+    await pipeline.close()
+
+    results = {}
+    for stage, histogram in (("receive", receive_latency), ("decode", pipeline.decode_latency),
+                             ("store", pipeline.store_latency), ("receive_to_store", pipeline.end_to_end)):
+        results[stage] = {
+            "frames_per_sec": histogram.total / elapsed,
+            "p50_ms": histogram.percentile(0.50) * 1000,
+            "p99_ms": histogram.percentile(0.99) * 1000
+        }
+        print(f"{stage:>16}: {histogram.total / elapsed:.0f} frames/s, {histogram.summary()}")
+    print(f"Received {received} frames in {elapsed:.2f} s, {pipeline.metrics['store'].dropped} failed to store")
+    return results
+
+
+def load_frames(args):
+    if args.recording:
+        frames = list(read_recording(args.recording))
+        if not frames:
+            raise SystemExit(f"No frames in {args.recording}")
+        return frames
+    return synthesize_chain_frames(args.frames, args.instruments // 2, interval_ns=int(1e9 / args.rate))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded or synthetic market data feeds locally")
+    parser.add_argument("command", choices=("serve", "bench"))
+    parser.add_argument("--recording", help="FrameRecorder log (set FEED_RECORD_PATH on websocket_market_data to capture one)")
+    parser.add_argument("--instruments", type=int, default=2000, help="Synthetic option instruments per frame")
+    parser.add_argument("--frames", type=int, default=200, help="Synthetic frames to generate")
+    parser.add_argument("--rate", type=float, default=10.0, help="Synthetic frames per second at 1x")
+    parser.add_argument("--speed", default="1", help="Replay speed multiplier, or 'max'")
+    parser.add_argument("--loops", type=int, default=1, help="Replay the frame set this many times")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    speed = 0.0 if args.speed == "max" else float(args.speed)
+    server = ReplayServer(load_frames(args), speed=speed, loops=args.loops, record_send_times=args.command == "bench")
+    if args.command == "serve":
+        print("Point websocket_market_data at it with FEED_WS_URL=ws://localhost:%d" % args.port)
+        asyncio.run(server.serve(port=args.port))
+        return 0
+
+    # The feed's own decode and store stages, with rows counted instead of written to the database
+    import websocket_market_data as feed
+    from market_state import MarketStateStore
+    writer = feed.tick_writer = NullTickWriter()
+    feed.market_state = MarketStateStore()
+    asyncio.run(run_benchmark(server, feed.decode_market_rows, feed.store_market_rows, port=args.port,
+                              **feed.ingest_settings))
+    print(f"Stored {writer.rows} rows")
+    feed.market_state.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,119 +1,217 @@
-import psycopg2
-import keyring
-import time
-from datetime import datetime
-import pytz
+import asyncio
 import logging
-from upstox_client.api_client import ApiClient
-from upstox_client.configuration import Configuration
-from upstox_client.api import OrderApi
+import time
+from datetime import datetime, timezone
+from psycopg2.extras import execute_values
+from instrument_master import get_instrument_master
+from signal_bus import SIGNAL_MAX_AGE, SignalConsumer
+from order_router import OrderRouter, OrderRecorder, order_payload, order_tag
+from metrics import configure_logging, start_exporters
+from market_state import MARKET_STATE_SHM, MARKET_STATE_MAX_AGE, MarketStateStore
+from warm_start import StartupTimer
+from risk_engine import RiskEngine, MarketDelta
+from options_analytics import IST
+from db import db_params, get_pool
+
+# Print the signal -> order latency histogram every N orders
+LATENCY_REPORT_EVERY = 50
+
+# Orders in flight at once; also the size of the SDK's HTTP connection pool
+ORDER_CONCURRENCY = 16
 
 # Set up logging
-logging.basicConfig(filename='/home/rahul/Documents/prompt_trader/trade_execution.log', level=logging.INFO, 
-                    format='%(asctime)s - %(message)s')
-
-# Database connection parameters
-db_params = {
-    "dbname": "prompt_trader",
-    "user": "trader",
-    "password": "secure_password",
-    "host": "localhost",
-    "port": "5432"
-}
-
-# Upstox API setup
+configure_logging("trade_execution.log")
+
+# Upstox API setup; the keyring and SDK are only touched when the client is first needed
 service_name = "prompt_trader_upstox"
-access_token = keyring.get_password(service_name, "access_token")
-if not access_token:
-    print("Error: No access_token found in keyring. Run test_upstox_auth.py first.")
-    exit(1)
-
-configuration = Configuration()
-configuration.access_token = access_token
-configuration.host = "https://api.upstox.com/v2"
-client = ApiClient(configuration)
-order_api = OrderApi(client)
-
-def fetch_new_signals(last_checked):
-    """Fetch new trading signals since last_checked time."""
-    try:
-        conn = psycopg2.connect(**db_params)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT signal_time, instrument_key, signal_type, ltp
-            FROM trading_signals
-            WHERE signal_time > %s AND instrument_key LIKE 'NSE_FO%'
-            ORDER BY signal_time ASC;
-        """, (last_checked,))
-        signals = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        return signals
-    except Exception as e:
-        print(f"Database error fetching signals: {e}")
-        return []
+order_api = None
 
-def place_order(instrument_key, signal_type, ltp):
-    """Place a market order via Upstox API."""
-    try:
-        order_data = {
-            "quantity": 25,  # NIFTY lot size
-            "product": "I",  # Intraday
-            "validity": "DAY",
-            "price": 0,  # Market order
-            "tag": "PromptTrader",
-            "instrument_token": instrument_key,
-            "order_type": "MARKET",
-            "transaction_type": signal_type,  # BUY or SELL
-            "disclosed_quantity": 0,
-            "trigger_price": 0,
-            "is_amo": False
-        }
-        response = order_api.place_order(order_data, api_version="2.0")
-        order_id = response.data.order_id
-        status = response.data.status
-        log_msg = f"Placed {signal_type} order for {instrument_key} at {ltp:.2f}, Order ID: {order_id}, Status: {status}"
+def get_order_api():
+    """OrderApi authorized with the keyring's access token (created on first use)."""
+    global order_api
+    if order_api is None:
+        import keyring
+        from upstox_client.api_client import ApiClient
+        from upstox_client.configuration import Configuration
+        from upstox_client.api import OrderApi
+        access_token = keyring.get_password(service_name, "access_token")
+        if not access_token:
+            raise RuntimeError("No access_token found in keyring. Run test_upstox_auth.py first.")
+        configuration = Configuration()
+        configuration.access_token = access_token
+        configuration.host = "https://api.upstox.com/v2"
+        configuration.connection_pool_maxsize = ORDER_CONCURRENCY
+        order_api = OrderApi(ApiClient(configuration))
+    return order_api
+
+def order_quantity(instrument_key, lots=1):
+    """Order quantity in units for a number of lots, from the instrument master."""
+    return get_instrument_master().lot_size(instrument_key) * lots
+
+def claim_signals(consumer, signals):
+    """Claim signals and record their PENDING orders in one transaction; return the ones to execute.
+
+    Once committed, a crash can never execute the same signal twice. Signals
+    older than SIGNAL_MAX_AGE are claimed, so the cursor moves past them, but
+    never executed.
+    """
+    claimed = []
+    expired = 0
+    cutoff = datetime.now(timezone.utc) - SIGNAL_MAX_AGE
+    with consumer.conn.cursor() as cursor:
+        for signal in signals:
+            if not consumer.claim(signal[0], cursor):
+                continue
+            if signal[1] >= cutoff:
+                claimed.append(signal)
+            else:
+                expired += 1
+        if claimed:
+            execute_values(cursor, """
+                INSERT INTO executed_orders (order_time, instrument_key, order_type, quantity, price, order_id, status)
+                VALUES %s
+                ON CONFLICT (order_time, instrument_key) DO NOTHING;
+            """, [
+                (signal_time, instrument_key, signal_type, order_quantity(instrument_key), ltp, None, "PENDING")
+                for _, signal_time, instrument_key, signal_type, ltp in claimed
+            ])
+    consumer.conn.commit()
+    if expired:
+        consumer.expired.inc(expired)
+        log_msg = f"Skipped {expired} signals older than {SIGNAL_MAX_AGE}"
         print(log_msg)
-        logging.info(log_msg)
-        return order_id, status
-    except Exception as e:
-        log_msg = f"Error placing {signal_type} order for {instrument_key}: {e}"
+        logging.warning(log_msg)
+    return claimed
+
+# Live prices from websocket_market_data's shared state store, if it publishes one
+market_state = None
+
+# Seconds between checks that the attached segment is still the writer's current one
+MARKET_STATE_RECHECK = 5.0
+market_state_checked = 0.0
+
+def get_market_state():
+    """The shared state store, attached on first use and re-attached after a writer restart; None if unpublished."""
+    global market_state, market_state_checked
+    now = time.monotonic()
+    if market_state is not None and now - market_state_checked >= MARKET_STATE_RECHECK:
+        market_state_checked = now
+        if market_state.replaced():
+            print("Market state segment was closed or recreated; re-attaching")
+            market_state.close()
+            market_state = None
+    if market_state is None and MARKET_STATE_SHM:
+        try:
+            market_state = MarketStateStore.attach(MARKET_STATE_SHM)
+        except (FileNotFoundError, ValueError):
+            return None
+        market_state_checked = now
+    return market_state
+
+def live_ltp(instrument_key):
+    """Latest feed LTP for an instrument without a database round-trip, or None if unknown or stale."""
+    store = get_market_state()
+    return store.ltp(instrument_key, MARKET_STATE_MAX_AGE) if store is not None else None
+
+async def create_risk_engine():
+    """Risk engine seeded with today's positions from executed_orders (raises on database errors)."""
+    master = get_instrument_master()
+    delta_fn = MarketDelta(get_market_state, master) if MARKET_STATE_SHM else None
+    risk = RiskEngine(master, delta_fn=delta_fn)
+    # Intraday product: positions start flat each trading day
+    start_of_day = datetime.now(IST).replace(hour=0, minute=0, second=0, microsecond=0)
+    count = await get_pool().run_async(risk.seed, start_of_day)
+    risk.start()
+    print(f"Risk engine seeded with {count} open positions, net delta {risk.net_delta():.1f}")
+    return risk
+
+async def execute_signal(router, recorder, consumer, risk, signal, published_at):
+    """Check one claimed signal against the risk limits, route its order and queue the result for storage."""
+    signal_id, signal_time, instrument_key, signal_type, ltp = signal
+    quantity = order_quantity(instrument_key)
+    reason = risk.reserve(instrument_key, signal_type, quantity)
+    if reason is not None:
+        log_msg = f"Risk check refused {signal_type} order for {instrument_key} ({quantity}): {reason}"
+        print(log_msg)
+        logging.warning(log_msg)
+        recorder.record((signal_time, instrument_key, signal_type, quantity, ltp, None, "RISK_REJECTED"))
+        return
+    order_id, status = await router.place(order_payload(instrument_key, signal_type, quantity), order_tag(signal_id))
+    consumer.observe_submit(published_at)
+    if status == "UNKNOWN":
+        # May be live at the broker: keep the reservation and leave it to be reconciled
+        log_msg = f"{signal_type} order for {instrument_key} ({order_tag(signal_id)}) is in an unknown state"
         print(log_msg)
         logging.error(log_msg)
-        return None, "REJECTED"
+    elif order_id is None:
+        risk.release(instrument_key, signal_type, quantity)
+    else:
+        market_ltp = live_ltp(instrument_key)
+        log_msg = f"Placed {signal_type} order for {instrument_key} at {ltp:.2f}, Order ID: {order_id}, Status: {status}"
+        if market_ltp is not None:
+            log_msg += f", market LTP {market_ltp:.2f}"
+        print(log_msg)
+        logging.info(log_msg)
+    recorder.record((signal_time, instrument_key, signal_type, quantity, ltp, order_id, status))
 
-def store_order(order_time, instrument_key, order_type, quantity, price, order_id, status):
-    """Store executed order in the database."""
+async def run():
+    """Execute signals as they are committed, routing bursts concurrently."""
+    loop = asyncio.get_running_loop()
+    timer = StartupTimer("Executor")
+    # Client and instrument master load concurrently; both are needed before the first order
+    try:
+        api, _ = await asyncio.gather(
+            loop.run_in_executor(None, get_order_api),
+            loop.run_in_executor(None, get_instrument_master)
+        )
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        return
+    timer.mark("client + instrument master")
     try:
-        conn = psycopg2.connect(**db_params)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO executed_orders (order_time, instrument_key, order_type, quantity, price, order_id, status)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (order_time, instrument_key) DO NOTHING;
-        """, (order_time, instrument_key, order_type, quantity, price, order_id, status))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        risk = await create_risk_engine()
     except Exception as e:
-        print(f"Database error storing order: {e}")
+        print(f"Database error seeding positions, not trading: {e}")
+        return
+    timer.mark("risk engine")
+    exporters = start_exporters()
+    consumer = SignalConsumer(db_params)
+    router = OrderRouter(api, concurrency=ORDER_CONCURRENCY)
+    recorder = OrderRecorder(get_pool(), spool_name="orders")
+    timer.mark("consumer")
+    timer.report()
+    pending = set()
+    executed = 0
+    try:
+        published_at = None
+        while True:
+            signals = await loop.run_in_executor(None, consumer.fetch_pending)
+            for signal in await loop.run_in_executor(None, claim_signals, consumer, signals):
+                task = asyncio.create_task(execute_signal(router, recorder, consumer, risk, signal, published_at))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                executed += 1
+                if executed % LATENCY_REPORT_EVERY == 0:
+                    print(f"Signal -> order submit latency: {consumer.latency.summary()}")
+            # A publish time only describes the batch fetched right after its notification
+            published_at = None
+            if len(signals) < consumer.batch_size:
+                published_at = await loop.run_in_executor(None, consumer.wait)
+    finally:
+        await asyncio.gather(*pending, return_exceptions=True)
+        print(f"Signal -> order submit latency: {consumer.latency.summary()}")
+        router.close()
+        recorder.close()
+        consumer.close()
+        risk.close()
+        get_pool().report()
+        get_pool().close()
+        for exporter in exporters:
+            exporter.close()
 
 def main():
-    last_checked = datetime.now(pytz.timezone("Asia/Kolkata")) - timedelta(minutes=5)
-    
-    while True:
-        # Check for new signals every 30 seconds
-        signals = fetch_new_signals(last_checked)
-        current_time = datetime.now(pytz.timezone("Asia/Kolkata"))
-        
-        for signal_time, instrument_key, signal_type, ltp in signals:
-            # Place order
-            order_id, status = place_order(instrument_key, signal_type, ltp)
-            # Store order details
-            store_order(signal_time, instrument_key, signal_type, 25, ltp, order_id, status)
-        
-        last_checked = current_time
-        time.sleep(30)  # Wait before next check
+    """Run the executor, woken by LISTEN/NOTIFY."""
+    asyncio.run(run())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
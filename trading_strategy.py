@@ -1,146 +1,265 @@
-import psycopg2
+import os
 import numpy as np
-import talib
+from psycopg2.extras import execute_values
 from datetime import datetime, timedelta
-import pytz
+import time
 import logging
+from metrics import REGISTRY, configure_logging, start_exporters
+from indicator_engine import IndicatorEngine
+from warm_start import WarmStartSnapshot, StartupTimer
+from spool import open_spool
+from signal_bus import NOTIFY_SQL, SIGNAL_CHANNEL, SIGNAL_WRITER_LOCK, SIGNAL_WRITER_LOCK_SQL, notify_payload
+from market_history import BAR_VIEWS, load_chain_bars, as_datetime, to_datetime64
+from tick_archive import TICK_ARCHIVE_DIR, IST, TickArchive, day_bounds
+from signal_rules import (
+    RSI_OVERSOLD, RSI_OVERBOUGHT, compute_indicators, detect_signals, signal_rows, format_signal
+)
+from db import get_pool, prepare
 
 # Set up logging
-logging.basicConfig(filename='/home/rahul/Documents/prompt_trader/trading_signals.log', level=logging.INFO, 
-                    format='%(asctime)s - %(message)s')
-
-# Database connection parameters
-db_params = {
-    "dbname": "prompt_trader",
-    "user": "trader",
-    "password": "secure_password",
-    "host": "localhost",
-    "port": "5432"
-}
-
-def fetch_options_instruments():
-    """Fetch all NIFTY 50 options chain instruments from the database."""
+configure_logging("trading_signals.log")
+
+# Strategy stage metrics
+evaluate_latency = REGISTRY.histogram("strategy_evaluate_seconds", "Indicator and rule evaluation per instrument")
+store_latency = REGISTRY.histogram("signal_store_seconds", "Signal batch insert + notify")
+store_errors = REGISTRY.counter("db_errors_total", "Database errors", component="signal_store")
+startup_seconds = REGISTRY.gauge("strategy_startup_seconds", "Time from start to the first evaluation")
+
+# History window for instruments without a checkpointed indicator state
+LOOKBACK_DAYS = 14
+
+# Bar resolution the indicators run on: 1s, 1m or 5m (see BAR_VIEWS)
+BAR_RESOLUTION = os.getenv("BAR_RESOLUTION", "1m")
+
+OPTIONS_INSTRUMENTS_QUERY = prepare("options_instruments_after", """
+    SELECT instrument_id, instrument_key FROM instrument_registry
+    WHERE segment = 'NSE_FO' AND instrument_id > $1 ORDER BY instrument_id
+""")
+
+def fetch_options_instruments(after_id=0):
+    """Fetch (instrument_id, instrument_key) for NIFTY 50 options registered after `after_id`, or None on error."""
     try:
-        conn = psycopg2.connect(**db_params)
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT instrument_key FROM market_data WHERE instrument_key LIKE 'NSE_FO%';")
-        instruments = [row[0] for row in cursor.fetchall()]
-        cursor.close()
-        conn.close()
-        return instruments
+        return get_pool().fetch_all(OPTIONS_INSTRUMENTS_QUERY, (after_id,))
     except Exception as e:
         print(f"Database error fetching instruments: {e}")
-        return []
+        return None
 
-def fetch_options_data(instrument_key, lookback_days=14):
-    """Fetch historical LTP data for an instrument from TimescaleDB."""
+def fetch_archived_history(start_time, resolution):
+    """Bars for whole archived days from start_time; returns (history, time the database should resume from)."""
+    if not TICK_ARCHIVE_DIR or not os.path.isdir(TICK_ARCHIVE_DIR):
+        return {}, start_time
     try:
-        conn = psycopg2.connect(**db_params)
-        cursor = conn.cursor()
-        end_time = datetime.now(pytz.timezone("Asia/Kolkata"))
-        start_time = end_time - timedelta(days=lookback_days)
-
-        cursor.execute("""
-            SELECT time, ltp, high, low, open
-            FROM market_data
-            WHERE instrument_key = %s AND time >= %s AND time <= %s
-            ORDER BY time ASC;
-        """, (instrument_key, start_time, end_time))
-
-        data = cursor.fetchall()
-        cursor.close()
-        conn.close()
-
-        if not data:
-            print(f"No data found for {instrument_key}")
-            return None, None, None, None, None
-
-        times, prices, highs, lows, opens = zip(*data)
-        return np.array(prices, dtype=np.float64), np.array(highs, dtype=np.float64), \
-               np.array(lows, dtype=np.float64), np.array(opens, dtype=np.float64), times
+        archive = TickArchive(TICK_ARCHIVE_DIR)
+        start_day = start_time.astimezone(IST).date()
+        covered = archive.covered_until(start_day, datetime.now(IST).date() - timedelta(days=1))
+        if covered is None:
+            return {}, start_time
+        history = archive.load_bars(start_day, covered, BAR_VIEWS[resolution][1], after=start_time)
+        return history, day_bounds(covered)[1] - BAR_VIEWS[resolution][1]
     except Exception as e:
-        print(f"Database error: {e}")
-        return None, None, None, None, None
+        print(f"Error reading tick archive, falling back to the database: {e}")
+        return {}, start_time
 
-def compute_indicators(prices, highs, lows):
-    """Compute RSI, MACD, and ATR indicators using TA-Lib."""
-    if prices is None or len(prices) < 14:
-        return None, None, None, None
+def fetch_chain_history(start_time, resolution=None):
+    """Fetch the whole options chain's completed bars, split per instrument.
 
-    # Compute RSI (14-period)
-    rsi = talib.RSI(prices, timeperiod=14)
+    Whole days already in the local tick archive are read from disk; only the
+    remainder comes from TimescaleDB in one binary COPY.
+    """
+    resolution = resolution or BAR_RESOLUTION
+    history, db_start = fetch_archived_history(start_time, resolution)
+    try:
+        with get_pool().connection() as conn:
+            recent = load_chain_bars(conn, db_start, resolution)
+    except Exception as e:
+        print(f"Database error fetching chain history: {e}")
+        return history
+    for instrument_key, series in recent.items():
+        archived = history.get(instrument_key)
+        history[instrument_key] = series if archived is None else {
+            name: np.concatenate((archived[name], series[name])) for name in series
+        }
+    return history
 
-    # Compute MACD (12, 26, 9)
-    macd, signal, _ = talib.MACD(prices, fastperiod=12, slowperiod=26, signalperiod=9)
+def insert_signals(rows):
+    """Insert trading_signals rows in one statement and announce them to executors; raises on database errors."""
+    started = time.perf_counter()
+    with get_pool().connection() as conn, conn.cursor() as cursor:
+        cursor.execute(SIGNAL_WRITER_LOCK_SQL, (SIGNAL_WRITER_LOCK,))
+        inserted = execute_values(cursor, """
+            INSERT INTO trading_signals (signal_time, instrument_key, signal_type, ltp, rsi, macd, atr)
+            VALUES %s
+            ON CONFLICT (signal_time, instrument_key) DO NOTHING
+            RETURNING signal_id;
+        """, rows, fetch=True)
+        if inserted:
+            max_signal_id = max(row[0] for row in inserted)
+            # Delivered to listeners only when this transaction commits
+            cursor.execute(NOTIFY_SQL, (SIGNAL_CHANNEL, notify_payload(max_signal_id)))
+    store_latency.observe(time.perf_counter() - started)
+
+# Write-ahead spool for signals; replays anything a previous run could not store
+signal_spool, signal_drainer = None, None
 
-    # Compute ATR (14-period)
-    atr = talib.ATR(highs, lows, prices, timeperiod=14)
+def load_spooled_signals(batches):
+    """Spool drainer handler: insert every spooled signal (the executor skips ones too old to trade)."""
+    rows = [row for rows in batches for row in rows]
+    if rows:
+        insert_signals(rows)
 
-    return rsi, macd, signal, atr
+def open_signal_spool():
+    global signal_spool, signal_drainer
+    if signal_spool is None:
+        signal_spool, signal_drainer = open_spool("signals", load_spooled_signals)
+    return signal_spool
 
-def store_signal(instrument_key, signal_time, signal_type, ltp, rsi, macd, atr):
-    """Store trading signal in the database."""
+def close_signal_spool():
+    """Load what is still spooled (bounded by SPOOL_CLOSE_TIMEOUT) and close the spool."""
+    global signal_spool, signal_drainer
+    if signal_spool is not None:
+        signal_drainer.close()
+        signal_spool.close()
+        signal_spool, signal_drainer = None, None
+
+def store_signals(rows):
+    """Store a batch of trading_signals rows: spooled to disk first, or inserted directly without a spool."""
+    if not rows:
+        return
+    spool = open_signal_spool()
+    if spool is not None:
+        spool.append(rows)
+        return
     try:
-        conn = psycopg2.connect(**db_params)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO trading_signals (signal_time, instrument_key, signal_type, ltp, rsi, macd, atr)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (signal_time, instrument_key) DO NOTHING;
-        """, (signal_time, instrument_key, signal_type, ltp, rsi, macd, atr))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        insert_signals(rows)
     except Exception as e:
-        print(f"Database error storing signal: {e}")
+        store_errors.inc()
+        print(f"Database error storing signals: {e}")
+
+def record_signals(rows):
+    """Log and bulk-store signal rows; return their log messages."""
+    messages = [format_signal(row) for row in rows]
+    for row in rows:
+        REGISTRY.counter("signals_generated_total", "Signals by type", type=row[2]).inc()
+    for signal_msg in messages:
+        logging.info(signal_msg)
+    store_signals(rows)
+    return messages
 
-def generate_signals(instrument_key, prices, highs, lows, times):
-    """Generate buy/sell signals based on RSI, MACD, and ATR."""
+def history_signal_rows(instrument_key, prices, highs, lows, times):
+    """trading_signals rows for a full history window using the vectorized TA-Lib path."""
     rsi, macd, signal, atr = compute_indicators(prices, highs, lows)
     if rsi is None:
-        return
-
-    # Volatility filter: Median ATR over lookback period
-    median_atr = np.median(atr[-14:]) if len(atr) >= 14 else 0
+        return []
+    buy_idx, sell_idx = detect_signals(rsi, macd, signal, atr)
+    return signal_rows(instrument_key, prices, rsi, macd, atr, times, buy_idx, sell_idx)
 
-    signals = []
-    for i in range(1, len(prices)):
-        # Volatility check: Only generate signals if current ATR > median ATR
-        if atr[i] <= median_atr:
+def new_bar_signal_rows(instrument_key, prices, highs, lows, times, engine):
+    """Fold bars into the streaming indicators and return signal rows for those bars only."""
+    state = engine.state(instrument_key)
+    rows = []
+    for i in range(len(prices)):
+        bar_time = as_datetime(times[i])
+        rsi, macd, signal, atr = engine.update(instrument_key, bar_time, prices[i], highs[i], lows[i])
+        # Same rules as detect_signals, using the rolling median ATR
+        if atr <= state.median_atr():
             continue
+        if rsi < RSI_OVERSOLD and macd > signal and state.prev_macd <= state.prev_signal:
+            rows.append((bar_time, instrument_key, "BUY", float(prices[i]), rsi, macd, atr))
+        elif rsi > RSI_OVERBOUGHT and macd < signal and state.prev_macd >= state.prev_signal:
+            rows.append((bar_time, instrument_key, "SELL", float(prices[i]), rsi, macd, atr))
+    return rows
+
+def evaluate_instrument(instrument_key, series, since, engine):
+    """Signal rows for one instrument's history, updating its engine state.
 
-        signal_time = times[i]
-        # Buy: RSI < 30 (oversold) and MACD crosses above signal
-        if rsi[i] < 30 and macd[i] > signal[i] and macd[i-1] <= signal[i-1]:
-            signal_msg = f"BUY {instrument_key} at {prices[i]:.2f} (RSI: {rsi[i]:.2f}, MACD: {macd[i]:.2f}, ATR: {atr[i]:.2f})"
-            signals.append(signal_msg)
-            logging.info(signal_msg)
-            store_signal(instrument_key, signal_time, "BUY", prices[i], rsi[i], macd[i], atr[i])
-        # Sell: RSI > 70 (overbought) and MACD crosses below signal
-        elif rsi[i] > 70 and macd[i] < signal[i] and macd[i-1] >= signal[i-1]:
-            signal_msg = f"SELL {instrument_key} at {prices[i]:.2f} (RSI: {rsi[i]:.2f}, MACD: {macd[i]:.2f}, ATR: {atr[i]:.2f})"
-            signals.append(signal_msg)
-            logging.info(signal_msg)
-            store_signal(instrument_key, signal_time, "SELL", prices[i], rsi[i], macd[i], atr[i])
-
-    if signals:
-        print(f"Signals for {instrument_key}:")
-        for signal in signals:
-            print(signal)
+    Without a checkpoint (``since`` is None) the whole window is evaluated and
+    the state rebuilt from it; otherwise only bars after ``since`` are folded in.
+    """
+    times, prices, highs, lows = series["time"], series["close"], series["high"], series["low"]
+    with evaluate_latency.time():
+        if since is None:
+            rows = history_signal_rows(instrument_key, prices, highs, lows, times)
+            engine.warm_up(instrument_key, prices, highs, lows, as_datetime(times[-1]))
+            return rows
+        new = times > to_datetime64(since)
+        if not new.any():
+            return []
+        return new_bar_signal_rows(instrument_key, prices[new], highs[new], lows[new], times[new], engine)
+
+def load_run_inputs():
+    """Return (engine, instruments, watermarks, history, snapshot) for a strategy run, or None if nothing to do.
+
+    With a warm-start snapshot only instruments registered since it was saved
+    are fetched, and the instrument master is parsed only if there are any;
+    otherwise the chain and indicator checkpoint are loaded cold.
+    """
+    timer = StartupTimer("Strategy")
+    today = datetime.now(IST).date()
+    snapshot = WarmStartSnapshot.load(BAR_RESOLUTION)
+    warm = snapshot is not None
+    if warm:
+        engine = snapshot.restore(IndicatorEngine())
     else:
-        print(f"No signals for {instrument_key}")
+        snapshot = WarmStartSnapshot(BAR_RESOLUTION)
+        engine = IndicatorEngine().load()
+    timer.mark("warm-start snapshot" if warm else "checkpoint")
 
-def main():
-    # Fetch all NIFTY 50 options chain instruments
-    instruments = fetch_options_instruments()
+    # Fetch the NIFTY 50 options chain instruments added since the snapshot (all of them when cold)
+    added = fetch_options_instruments(snapshot.last_instrument_id)
+    if added is None:
+        return None
+    timer.mark("registry")
+    if added:
+        from instrument_master import get_instrument_master
+        snapshot.add_instruments(added, get_instrument_master())
+        timer.mark("instrument master")
+
+    # Skip contracts that have already expired
+    instruments = snapshot.live_instruments(today)
     if not instruments:
         print("No options instruments found in database")
-        return
+        return None
+
+    # Instruments with indicator state only fetch and evaluate bars since their last run
+    lookback_start = datetime.now(IST) - timedelta(days=LOOKBACK_DAYS)
+    watermarks = [engine.last_time(key) for key in instruments]
+    start_time = lookback_start if None in watermarks else min(watermarks)
 
-    for instrument_key in instruments:
-        prices, highs, lows, _, times = fetch_options_data(instrument_key)
-        if prices is not None:
-            generate_signals(instrument_key, prices, highs, lows, times)
+    # One bulk fetch for the whole chain, then slice per instrument
+    history = fetch_chain_history(start_time)
+    timer.mark("history")
+    timer.report(startup_seconds)
+    return engine, instruments, watermarks, history, snapshot
+
+def save_run_state(engine, snapshot):
+    """Checkpoint the indicator states and write the warm-start snapshot for the next run."""
+    engine.save()
+    try:
+        snapshot.save(engine, today=datetime.now(IST).date())
+    except OSError as e:
+        print(f"Error writing warm-start snapshot: {e}")
+
+def main():
+    exporters = start_exporters()
+    open_signal_spool()
+    try:
+        inputs = load_run_inputs()
+        if inputs is None:
+            return
+        engine, instruments, watermarks, history, snapshot = inputs
+        for instrument_key, since in zip(instruments, watermarks):
+            series = history.get(instrument_key)
+            if series is None:
+                print(f"No data found for {instrument_key}")
+                continue
+            for signal_msg in record_signals(evaluate_instrument(instrument_key, series, since, engine)):
+                print(signal_msg)
+        save_run_state(engine, snapshot)
+    finally:
+        close_signal_spool()
+        get_pool().report()
+        for exporter in exporters:
+            exporter.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
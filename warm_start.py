@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+import pickle
+import argparse
+from datetime import datetime, timedelta
+from indicator_engine import IndicatorState
+
+# Snapshot written after every strategy run and loaded at the start of the next one
+WARM_START_PATH = os.getenv("WARM_START_PATH", "warm_start.pkl")
+
+# Older snapshots are ignored: their delta would cost as much as a cold start
+WARM_START_MAX_AGE = timedelta(hours=float(os.getenv("WARM_START_MAX_AGE_HOURS", "72")))
+
+# Startup (imports excluded) is reported against this budget
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "1.0"))
+
+SNAPSHOT_VERSION = 1
+
+
+class WarmStartSnapshot:
+    """Everything a strategy run needs before its first signal, in one pickle.
+
+    Holds the option chain from instrument_registry (key -> expiry) with the
+    highest instrument_id seen, so the next run only asks the registry for
+    rows added since, and every instrument's IndicatorState, whose
+    ``last_time`` is the watermark the history delta is fetched from.
+    Expiries are kept so expired contracts can be dropped without parsing the
+    instrument master.
+    """
+
+    def __init__(self, resolution, expiries=None, last_instrument_id=0, states=None, saved_at=None):
+        self.resolution = resolution
+        self.expiries = expiries or {}
+        self.last_instrument_id = last_instrument_id
+        self.states = states or {}
+        self.saved_at = saved_at
+
+    def add_instruments(self, rows, master=None):
+        """Fold (instrument_id, instrument_key) registry rows in; expiries come from ``master``."""
+        for instrument_id, instrument_key in rows:
+            info = master.get(instrument_key) if master is not None else None
+            self.expiries[instrument_key] = info.expiry if info is not None else None
+            self.last_instrument_id = max(self.last_instrument_id, instrument_id)
+
+    def live_instruments(self, today):
+        """Registry order is kept (dicts preserve insertion order); expired contracts are skipped."""
+        return [key for key, expiry in self.expiries.items() if expiry is None or expiry >= today]
+
+    def restore(self, engine):
+        """Load the saved indicator states into ``engine`` and return it."""
+        for key, data in self.states.items():
+            engine.states[key] = IndicatorState.from_dict(data)
+        return engine
+
+    def save(self, engine, path=WARM_START_PATH, today=None):
+        """Atomically write the chain and ``engine``'s states; expired contracts are dropped."""
+        if today is not None:
+            self.expiries = {key: expiry for key, expiry in self.expiries.items() if expiry is None or expiry >= today}
+        self.states = {key: state.to_dict() for key, state in engine.states.items() if key in self.expiries}
+        self.saved_at = datetime.now().astimezone()
+        payload = {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": self.saved_at,
+            "resolution": self.resolution,
+            "expiries": self.expiries,
+            "last_instrument_id": self.last_instrument_id,
+            "states": self.states
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, resolution, path=WARM_START_PATH, max_age=WARM_START_MAX_AGE):
+        """Return the saved snapshot, or None if it is missing, unreadable, stale or for another resolution."""
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                payload = pickle.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable warm-start snapshot {path}: {e}")
+            return None
+        if payload.get("version") != SNAPSHOT_VERSION or payload.get("resolution") != resolution:
+            return None
+        saved_at = payload["saved_at"]
+        if datetime.now().astimezone() - saved_at > max_age:
+            print(f"Warm-start snapshot from {saved_at:%Y-%m-%d %H:%M} is too old, starting cold")
+            return None
+        return cls(resolution, payload["expiries"], payload["last_instrument_id"], payload["states"], saved_at)
+
+
+class StartupTimer:
+    """Measure the phases of startup and report the total against STARTUP_BUDGET_SECONDS."""
+
+    def __init__(self, name, budget=STARTUP_BUDGET_SECONDS):
+        self.name = name
+        self.budget = budget
+        self.started = time.perf_counter()
+        self.phases = []
+
+    def mark(self, phase):
+        self.phases.append((phase, time.perf_counter()))
+
+    def report(self, gauge=None):
+        """Print the per-phase breakdown; return the total seconds."""
+        total = time.perf_counter() - self.started
+        previous, parts = self.started, []
+        for phase, at in self.phases:
+            parts.append(f"{phase} {(at - previous) * 1000:.1f} ms")
+            previous = at
+        status = "within" if total <= self.budget else "over"
+        print(f"{self.name} startup {total * 1000:.1f} ms ({status} the {self.budget * 1000:.0f} ms budget): "
+              + ", ".join(parts))
+        if gauge is not None:
+            gauge.set(total)
+        return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the strategy warm-start snapshot")
+    parser.add_argument("--path", default=WARM_START_PATH)
+    parser.add_argument("--resolution", default=os.getenv("BAR_RESOLUTION", "1m"))
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    snapshot = WarmStartSnapshot.load(args.resolution, args.path)
+    elapsed = time.perf_counter() - started
+    if snapshot is None:
+        print(f"No usable {args.resolution} snapshot at {args.path}")
+        return 1
+    watermarks = [state["last_time"] for state in snapshot.states.values() if state.get("last_time")]
+    print(
+        f"{args.path}: {os.path.getsize(args.path) / 1024:.0f} KiB saved {snapshot.saved_at:%Y-%m-%d %H:%M:%S}, "
+        f"{len(snapshot.expiries)} instruments (registry id {snapshot.last_instrument_id}), "
+        f"{len(snapshot.states)} indicator states, oldest watermark {min(watermarks) if watermarks else None}, "
+        f"loaded in {elapsed * 1000:.1f} ms"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,161 +1,203 @@
 import os
 import ssl
+import time
 import asyncio
-import websockets
-import json
-import keyring
-import psycopg2
-from google.protobuf.json_format import MessageToDict
-import upstox_client
-from upstox_client.api_client import ApiClient
-from upstox_client.configuration import Configuration
-from upstox_client.api import WebsocketApi
-import MarketDataFeed_pb2 as pb
+import threading
+from market_data_writer import TickWriter
+from ingest_pipeline import IngestPipeline
+from instrument_master import get_instrument_master
+from tick_decoder import ColumnarTickDecoder
+from tick_replay import FrameRecorder
+from subscription_manager import SubscriptionManager, StrikeWindow
+from market_state import MARKET_STATE_SHM, MarketStateStore
+from options_analytics import ChainAnalytics
+from metrics import REGISTRY, configure_logging, start_exporters
+from warm_start import StartupTimer
 from datetime import datetime
 import pytz
+from db import db_params
 
-# Database connection parameters
-db_params = {
-    "dbname": "prompt_trader",
-    "user": "trader",
-    "password": "secure_password",
-    "host": "localhost",
-    "port": "5432"
+# Ingest pipeline settings
+ingest_settings = {
+    "queue_size": int(os.getenv("INGEST_QUEUE_SIZE", "2000")),
+    "policy": os.getenv("INGEST_BACKPRESSURE", "block"),  # block, drop-oldest or spill
+    "decode_workers": int(os.getenv("INGEST_DECODE_WORKERS", "2")),
+    "executor": os.getenv("INGEST_EXECUTOR", "thread"),  # thread or process
+    "spill_path": os.getenv("INGEST_SPILL_PATH", "ingest_spill.bin")
 }
 
-# Load access token from keyring
+# Load testing: connect to a tick_replay server instead of Upstox, and/or record raw frames
+FEED_WS_URL = os.getenv("FEED_WS_URL", "")
+FEED_RECORD_PATH = os.getenv("FEED_RECORD_PATH", "")
+
+# Subscriptions: always-on keys plus the ATM +/- FEED_STRIKE_WINDOW strikes of FEED_UNDERLYING's nearest expiry
+FEED_INDEX_KEY = "NSE_INDEX|Nifty 50"
+FEED_FIXED_KEYS = [
+    FEED_INDEX_KEY,
+    "NSE_EQ|INE009A01021"  # Reliance Industries
+] + [key for key in os.getenv("FEED_EXTRA_KEYS", "").split(",") if key]
+FEED_UNDERLYING = os.getenv("FEED_UNDERLYING", "NIFTY")
+FEED_STRIKE_WINDOW = int(os.getenv("FEED_STRIKE_WINDOW", "10"))
+
+# Seconds between checks for a newer instrument master, so new expiries are picked up while running
+INSTRUMENT_REFRESH_INTERVAL = float(os.getenv("INSTRUMENT_REFRESH_INTERVAL", "900"))
+
+# Upstox API client, created on first use from the access token in the keyring
 service_name = "prompt_trader_upstox"
-access_token = keyring.get_password(service_name, "access_token")
-if not access_token:
-    print("Error: No access_token found in keyring. Run test_upstox_auth.py first.")
-    exit(1)
-
-# Initialize configuration
-configuration = Configuration()
-configuration.access_token = access_token
-configuration.host = "https://api.upstox.com/v2"
-client = ApiClient(configuration)
-
-# Get WebSocket authorization
+client = None
+
+def get_api_client():
+    global client
+    if client is None:
+        import keyring
+        from upstox_client.api_client import ApiClient
+        from upstox_client.configuration import Configuration
+        access_token = keyring.get_password(service_name, "access_token")
+        if not access_token:
+            raise RuntimeError("No access_token found in keyring. Run test_upstox_auth.py first.")
+        configuration = Configuration()
+        configuration.access_token = access_token
+        configuration.host = "https://api.upstox.com/v2"
+        client = ApiClient(configuration)
+    return client
+
+# Get WebSocket authorization (raises so the connection's reconnect loop retries)
 def get_websocket_auth():
     try:
-        api_instance = WebsocketApi(client)
+        from upstox_client.api import WebsocketApi
+        api_instance = WebsocketApi(get_api_client())
         response = api_instance.get_market_data_feed_authorize(api_version="2.0")
         return response.data.authorized_redirect_uri
     except Exception as e:
         print(f"Error getting WebSocket authorization: {e}")
-        exit(1)
+        raise
 
-# Decode protobuf message
-def decode_protobuf(buffer):
-    feed_response = pb.FeedResponse()
-    feed_response.ParseFromString(buffer)
-    return MessageToDict(feed_response)
+# Persistent, batched writer for market_data, spooled to disk first (created on first use)
+tick_writer = None
 
-# Store market data in database
-def store_market_data(data):
-    try:
-        conn = psycopg2.connect(**db_params)
-        cursor = conn.cursor()
-        ist = pytz.timezone("Asia/Kolkata")
-        current_time = datetime.now(ist)
-
-        for instrument_key, feed in data.get("feeds", {}).items():
-            ltpc = feed.get("ff", {}).get("indexFf", {}).get("ltpc", {}) or \
-                   feed.get("ff", {}).get("equityFf", {}).get("ltpc", {})
-            volume = feed.get("ff", {}).get("indexFf", {}).get("marketOhlc", {}).get("ohlc", [{}])[0].get("volume", 0) or \
-                     feed.get("ff", {}).get("equityFf", {}).get("marketOhlc", {}).get("ohlc", [{}])[0].get("volume", 0)
-            last_close = feed.get("ff", {}).get("indexFf", {}).get("lastClose", 0) or \
-                         feed.get("ff", {}).get("equityFf", {}).get("lastClose", 0)
-
-            # Extract options-specific fields
-            strike_price = None
-            option_type = None
-            open_interest = None
-            expiry_date = None
-            if "NSE_FO" in instrument_key:
-                parts = instrument_key.split("|")[1].split("NIFTY")
-                if len(parts) > 1:
-                    option_part = parts[1]
-                    if "CE" in option_part or "PE" in option_part:
-                        option_type = "CE" if "CE" in option_part else "PE"
-                        strike_price = float(option_part[:-2])  # e.g., "23000"
-                        expiry_date = "2025-05-29"  # Example; enhance with API/CSV
-                    open_interest = feed.get("ff", {}).get("equityFf", {}).get("marketLevel", {}).get("bids", {}).get("bidsAsks", [{}])[0].get("quantity", 0)
-
-            cursor.execute("""
-                INSERT INTO market_data (
-                    time, instrument_key, ltp, volume, last_trade_time, last_close,
-                    strike_price, option_type, open_interest, expiry_date
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (time, instrument_key) DO UPDATE
-                SET ltp = EXCLUDED.ltp,
-                    volume = EXCLUDED.volume,
-                    last_trade_time = EXCLUDED.last_trade_time,
-                    last_close = EXCLUDED.last_close,
-                    strike_price = EXCLUDED.strike_price,
-                    option_type = EXCLUDED.option_type,
-                    open_interest = EXCLUDED.open_interest,
-                    expiry_date = EXCLUDED.expiry_date;
-            """, (
-                current_time,
-                instrument_key,
-                ltpc.get("ltp", 0.0),
-                volume,
-                ltpc.get("ltt", 0),
-                last_close,
-                strike_price,
-                option_type,
-                open_interest,
-                expiry_date
-            ))
-
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print(f"Stored data for {len(data.get('feeds', {}))} instruments")
-    except Exception as e:
-        print(f"Database error: {e}")
+def get_tick_writer():
+    global tick_writer
+    if tick_writer is None:
+        tick_writer = TickWriter(db_params, spool_name="ticks")
+    return tick_writer
+
+# Latest tick and depth per instrument, published to other processes when MARKET_STATE_SHM is set
+market_state = None
+
+# Chain IV and Greeks, re-solved for contracts whose LTP changed (OPTION_ANALYTICS=1 enables)
+OPTION_ANALYTICS = os.getenv("OPTION_ANALYTICS") == "1"
+option_analytics = None
+analytics_latency = REGISTRY.histogram("option_analytics_seconds", "IV and Greeks update per frame")
+
+# Decode stage of the ingest pipeline: protobuf straight to rows plus a detached batch for the state store
+decoder_local = threading.local()
+
+def decode_market_rows(buffer):
+    decoder = getattr(decoder_local, "decoder", None)
+    if decoder is None:
+        decoder = decoder_local.decoder = ColumnarTickDecoder()
+    current_time = datetime.now(pytz.timezone("Asia/Kolkata"))
+    batch = decoder.decode(buffer)
+    return batch.to_rows(current_time, get_instrument_master()), batch.copy()
 
-# WebSocket connection
+# Set while fetch_market_data runs; follows the index LTP to move the strike window
+subscription_manager = None
+
+# Store stage of the ingest pipeline
+def store_market_rows(decoded, received_at):
+    rows, batch = decoded
+    if market_state is not None:
+        market_state.update(batch, time.time_ns())
+    if option_analytics is not None:
+        with analytics_latency.time():
+            option_analytics.update_from_batch(batch)
+    get_tick_writer().add_rows(rows, received_at)
+    if subscription_manager is not None:
+        for row in rows:
+            if row[1] == FEED_INDEX_KEY and row[2] is not None:
+                subscription_manager.on_index_ltp_threadsafe(row[2])
+
+async def refresh_instruments(instruments, window):
+    """Pull a newer instrument master periodically and rebuild the strike window from it."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(INSTRUMENT_REFRESH_INTERVAL)
+        changed = await loop.run_in_executor(None, instruments.refresh)
+        if changed:
+            print(f"Instrument master refreshed: {changed} entries changed")
+            if window is not None:
+                window.reload()
+
+# Sampled pipeline events are logged here
+configure_logging("market_data.log")
+
+# Websocket stage metrics
+frames_received = REGISTRY.counter("websocket_frames_total", "Frames received from the feed")
+bytes_received = REGISTRY.counter("websocket_bytes_total", "Bytes received from the feed")
+
+# WebSocket connections
 async def fetch_market_data():
+    global subscription_manager, market_state, option_analytics
+    timer = StartupTimer("Market data")
+    loop = asyncio.get_running_loop()
+    # The SDK client is built while the instrument master parses; replaying locally needs no client
+    try:
+        instruments, _ = await asyncio.gather(
+            loop.run_in_executor(None, get_instrument_master),
+            loop.run_in_executor(None, get_api_client) if not FEED_WS_URL else asyncio.sleep(0)
+        )
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        return
+    timer.mark("client + instrument master")
+    market_state = MarketStateStore(shm_name=MARKET_STATE_SHM or None)
+    if OPTION_ANALYTICS:
+        option_analytics = ChainAnalytics(instruments, FEED_INDEX_KEY)
     ssl_context = ssl.create_default_context()
     ssl_context.check_hostname = False
     ssl_context.verify_mode = ssl.CERT_NONE
 
-    ws_url = get_websocket_auth()
-    async with websockets.connect(ws_url, ssl=ssl_context) as websocket:
-        print("WebSocket connection established")
-
-        # Subscribe to NIFTY 50 and options chain
-        data = {
-            "guid": "market-data-feed",
-            "method": "sub",
-            "data": {
-                "mode": "full",
-                "instrumentKeys": [
-                    "NSE_INDEX|Nifty 50",
-                    "NSE_EQ|INE009A01021",  # Reliance Industries
-                    "NSE_FO|NIFTY25MAY23000CE",  # Call option
-                    "NSE_FO|NIFTY25MAY23000PE",  # Put option
-                    "NSE_FO|NIFTY25MAY23500CE",  # Call option
-                    "NSE_FO|NIFTY25MAY23500PE"   # Put option
-                ]
-            }
-        }
-        await websocket.send(json.dumps(data))
-        print("Subscribed to NIFTY 50, Reliance Industries, and NIFTY options chain")
-
-        # Receive and decode data
-        try:
-            while True:
-                message = await websocket.recv()
-                decoded_data = decode_protobuf(message)
-                print("Market Data:", decoded_data)
-                store_market_data(decoded_data)
-        except Exception as e:
-            print(f"WebSocket error: {e}")
+    recorder = FrameRecorder(FEED_RECORD_PATH) if FEED_RECORD_PATH else None
+    exporters = start_exporters()
+
+    # Receive frames; decode and storage run in the pipeline's executors
+    pipeline = IngestPipeline(decode_market_rows, store_market_rows, **ingest_settings)
+    pipeline.start()
+
+    async def on_frame(message):
+        frames_received.inc()
+        bytes_received.inc(len(message))
+        if recorder is not None:
+            recorder.record(message)
+        await pipeline.put_frame(message)
+
+    # Each (re)connect needs a fresh authorized URL unless replaying locally
+    window = StrikeWindow(instruments, FEED_UNDERLYING, FEED_STRIKE_WINDOW) if FEED_STRIKE_WINDOW else None
+    subscription_manager = SubscriptionManager(
+        lambda: FEED_WS_URL or get_websocket_auth(),
+        on_frame,
+        fixed_keys=FEED_FIXED_KEYS,
+        window=window,
+        index_key=FEED_INDEX_KEY,
+        ssl_context=ssl_context
+    )
+    refresher = asyncio.create_task(refresh_instruments(instruments, window))
+    timer.mark("pipeline")
+    timer.report()
+    try:
+        await subscription_manager.run()
+    finally:
+        refresher.cancel()
+        subscription_manager = None
+        await pipeline.close()
+        if recorder is not None:
+            recorder.close()
+            print(f"Recorded {recorder.frames} frames to {recorder.path}")
+        if tick_writer is not None:
+            tick_writer.close()
+        for exporter in exporters:
+            exporter.close()
+        market_state.close()
 
 # Run the WebSocket client
 if __name__ == "__main__":